@@ -27,6 +27,11 @@ export default function App() {
     await apiPost("/repo/rescan", {});
     setRefresh(x => x + 1);
   };
+  const [watching, setWatching] = useState(false);
+  const toggleWatch = async () => {
+    const res = await apiPost<{ watch: { running: boolean } }>("/repo/watch", { enabled: !watching });
+    setWatching(!!res.watch?.running);
+  };
   
   return (
     <div style={{ display: "grid", gridTemplateRows: "48px 40px 1fr 26px", height: "100vh" }}>
@@ -36,6 +41,7 @@ export default function App() {
         <h3 style={{ margin: 0, fontWeight: 700 }}>DevPilot App</h3>
         <RepoPicker onScanned={() => setRefresh((x) => x + 1)} />
         <button onClick={rescan}>Rescan</button>
+        <label style={{ fontSize: 12 }}><input type="checkbox" checked={watching} onChange={toggleWatch} /> Watch</label>
         {selected && <div style={{ marginLeft: "auto", opacity: 0.7, fontSize: 12 }}>Selected: {selected}</div>}
       </div>
 
@@ -1,25 +1,92 @@
 import { useEffect, useState } from "react";
-import { apiGet } from "../lib/api";
+import { apiEvents, apiGet } from "../lib/api";
 
 type Node = {
   name: string;
   path: string;
   isDir: boolean;
-  children?: Node[];
+  children?: Node[] | null;  // null = directory not loaded yet
+  childCount?: number;
 };
 
+type Delta = { added?: { path: string }[]; removed?: string[]; version?: number };
+
+// insert a file path, cloning only the nodes on its spine (unloaded directories fetch it on expand)
+function insertPath(n: Node, parts: string[], depth = 0): Node {
+  if (n.isDir && n.children == null && depth > 0) return n;
+  const path = parts.slice(0, depth + 1).join("/");
+  const isLast = depth === parts.length - 1;
+  const children = [...(n.children || [])];
+  let idx = children.findIndex((c) => c.name === parts[depth]);
+  if (idx < 0) {
+    const child: Node = { name: parts[depth], path, isDir: !isLast, children: isLast ? undefined : [] };
+    idx = children.findIndex((c) => c.name > parts[depth]);
+    if (idx < 0) idx = children.length;
+    children.splice(idx, 0, child);
+  }
+  if (!isLast) children[idx] = insertPath(children[idx], parts, depth + 1);
+  return { ...n, children };
+}
+
+// remove a file path and any directories it leaves empty
+function removePath(n: Node, parts: string[], depth = 0): Node {
+  if (n.children == null) return n;
+  const children = n.children;
+  const idx = children.findIndex((c) => c.name === parts[depth]);
+  if (idx < 0) return n;
+  const next = [...children];
+  if (depth === parts.length - 1) {
+    next.splice(idx, 1);
+  } else {
+    const child = removePath(children[idx], parts, depth + 1);
+    if (child.children != null && child.children.length === 0) next.splice(idx, 1);
+    else next[idx] = child;
+  }
+  return { ...n, children: next };
+}
+
+// replace the (lazy) node at `path` with a freshly loaded one
+function replaceNode(n: Node, path: string, loaded: Node): Node {
+  if (n.path === path) return { ...loaded, name: n.name };
+  if (!n.children) return n;
+  return { ...n, children: n.children.map((c) => (c.isDir && (path === c.path || path.startsWith(c.path + "/")) ? replaceNode(c, path, loaded) : c)) };
+}
+
 export default function FileTree({ onSelect }: { onSelect: (path: string) => void }) {
   const [tree, setTree] = useState<Node | null>(null);
   const [expanded, setExpanded] = useState<Record<string, boolean>>({ "": true });
 
   useEffect(() => {
-    (async () => {
-      const data = await apiGet<{ root: Node }>("/repo/tree");
+    // one level at a time; deeper directories are fetched when expanded
+    const load = async () => {
+      const data = await apiGet<{ root: Node }>("/repo/tree?depth=1");
       setTree(data.root);
-    })();
+      setExpanded({ "": true });
+    };
+    load();
+    // live updates: apply snapshot deltas instead of refetching the whole tree
+    const es = apiEvents("/repo/events");
+    es.addEventListener("delta", (ev) => {
+      const d: Delta = JSON.parse((ev as MessageEvent).data);
+      setTree((t) => {
+        if (!t) return t;
+        let next = t;
+        for (const p of d.removed || []) next = removePath(next, p.split("/"));
+        for (const a of d.added || []) next = insertPath(next, a.path.split("/"));
+        return next;
+      });
+    });
+    es.addEventListener("reset", () => { load(); });
+    return () => es.close();
   }, []);
 
-  const toggle = (p: string) => setExpanded((e) => ({ ...e, [p]: !e[p] }));
+  const toggle = async (n: Node) => {
+    if (!expanded[n.path] && n.children == null) {
+      const data = await apiGet<{ root: Node }>("/repo/tree?depth=1&path=" + encodeURIComponent(n.path));
+      setTree((t) => (t ? replaceNode(t, n.path, data.root) : t));
+    }
+    setExpanded((e) => ({ ...e, [n.path]: !e[n.path] }));
+  };
 
   const renderNode = (n: Node) => {
     if (!n) return null;
@@ -27,7 +94,7 @@ export default function FileTree({ onSelect }: { onSelect: (path: string) => voi
     return (
       <div key={n.path} style={{ marginLeft: n.path ? 12 : 0 }}>
         {n.isDir ? (
-          <div onClick={() => toggle(n.path)} style={{ cursor: "pointer" }}>
+          <div onClick={() => toggle(n)} style={{ cursor: "pointer" }}>
             {isOpen ? "📂" : "📁"} {n.name}
           </div>
         ) : (
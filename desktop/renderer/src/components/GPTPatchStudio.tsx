@@ -1,6 +1,6 @@
 import { useMemo, useState } from "react";
 import { DiffEditor } from "@monaco-editor/react";
-import { apiGet, apiPost } from "../lib/api";
+import { apiGet, apiPost, apiStream } from "../lib/api";
 import { useToasts } from "../lib/toast";
 import ThreeWayMerge from "./ThreeWayMerge";
 import { saveAs } from "./saveAs"; // new helper below
@@ -53,7 +53,7 @@ export default function GPTPatchStudio() {
           const filled: GptFile[] = [];
           for (const f of obj.files) {
             let current = "";
-            try { const meta = await apiGet<{ code: string }>("/repo/metadata?path=" + encodeURIComponent(f.path)); current = meta.code || ""; } catch {}
+            try { const meta = await apiGet<{ code: string }>("/repo/metadata?slim=1&path=" + encodeURIComponent(f.path)); current = meta.code || ""; } catch {}
             filled.push({ path: f.path, code: f.code, current, apply: true, force: false });
           }
           setFiles(filled);
@@ -68,7 +68,7 @@ export default function GPTPatchStudio() {
       for (const f of obj.files) {
         let current = "";
         try {
-          const meta = await apiGet<{ code: string }>("/repo/metadata?path=" + encodeURIComponent(f.path));
+          const meta = await apiGet<{ code: string }>("/repo/metadata?slim=1&path=" + encodeURIComponent(f.path));
           current = meta.code || "";
         } catch { current = ""; }
         filled.push({ path: f.path, code: f.code, current, apply: true, force: false });
@@ -94,6 +94,7 @@ export default function GPTPatchStudio() {
     // fetch 3-way data for that file
     const f = files.find(x => x.path === path)!;
     const res = await apiPost("/apply/plan3", { files: [{ path: f.path, code: f.code, expected_current: f.current ?? null }] });
+    if (res.threeway[0]?.diff_summary) push(`${path}: ${res.threeway[0].diff_summary.message}; the merge view may be slow`, "err");
     setMergeTarget(res.threeway[0]);
   };
 
@@ -147,19 +148,27 @@ const doGitFlow = async () => {
         autoPrompt.trim()
       ].join("\n");
   
-      const res = await apiPost("/autopatch", { prompt: wrapper, dry_run: autoDry, force: autoForce });
-      if (!res?.files) return push("Model returned no files", "err");
-  
-      // Load into Patch Studio buffers
-      const filled: GptFile[] = [];
-      for (const f of res.files) {
-        let current = "";
-        try { const meta = await apiGet<{ code: string }>("/repo/metadata?path=" + encodeURIComponent(f.path)); current = meta.code || ""; } catch {}
-        filled.push({ path: f.path, code: f.code, current, apply: true, force: autoForce });
-      }
-      setFiles(filled);
-      setPlan(res.plan || null);
-      push(res.applied ? "Auto-Patch applied ✅" : "Auto-Patch planned (dry run)", "ok");
+      // Stream: each file lands in the Patch Studio buffers as soon as the model finishes it
+      setFiles([]);
+      setPlan(null);
+      let done: any = null, failed = "";
+      const loads: Promise<void>[] = [];
+      await apiStream("/autopatch/stream", { prompt: wrapper, dry_run: autoDry, force: autoForce }, (type, data) => {
+        if (type === "file" && data.kind !== "error") {
+          const f = data.file;
+          loads.push((async () => {
+            let current = "";
+            try { const meta = await apiGet<{ code: string }>("/repo/metadata?slim=1&path=" + encodeURIComponent(f.path)); current = meta.code || ""; } catch {}
+            setFiles(prev => [...prev, { path: f.path, code: f.code, current, apply: true, force: autoForce }]);
+          })());
+        } else if (type === "done") done = data;
+        else if (type === "error") failed = data.detail;
+      });
+      await Promise.all(loads);
+      if (failed) return push("Auto-Patch failed: " + failed, "err");
+      if (!done?.files?.length) return push("Model returned no files", "err");
+      setPlan(done.plan || null);
+      push(done.applied ? "Auto-Patch applied ✅" : "Auto-Patch planned (dry run)", "ok");
     } catch (e:any) {
       push("Auto-Patch failed: " + (e?.message || e), "err");
     }
@@ -19,3 +19,40 @@ export async function apiPost<T = any>(path: string, body?: any): Promise<T> {
   if (!res.ok) throw new Error(`POST ${path} ${res.status}`);
   return res.json();
 }
+
+/** Server-sent events stream from the engine (e.g. /repo/events). Caller must close() it. */
+export function apiEvents(path: string): EventSource {
+  return new EventSource(`${baseUrl}${path}`);
+}
+
+/**
+ * POST that answers with text/event-stream (e.g. /autopatch/stream): calls onEvent(type, data)
+ * for each frame as it arrives and resolves when the stream ends.
+ */
+export async function apiStream(path: string, body: any, onEvent: (type: string, data: any) => void): Promise<void> {
+  const res = await fetch(`${baseUrl}${path}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body ?? {}),
+  });
+  if (!res.ok || !res.body) throw new Error(`POST ${path} ${res.status}`);
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buf.indexOf("\n\n")) >= 0) {
+      const frame = buf.slice(0, end);
+      buf = buf.slice(end + 2);
+      let type = "message", data = "";
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event:")) type = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (data) onEvent(type, JSON.parse(data));
+    }
+  }
+}
@@ -1,22 +1,45 @@
 import os
 import json
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Iterator
 
-from fastapi import FastAPI, HTTPException, Body, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Body, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import os, shutil
+import os, re, sqlite3, threading, time
+import contextlib, contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from utils.git_task_manager import GitTaskManager
 from dotenv import load_dotenv
-import difflib
 from datetime import datetime
 import subprocess
 from openai import OpenAI
 import requests
-import fnmatch
-from utils.settings_manager import load_settings, save_settings
+from utils.settings_manager import load_settings, save_settings, _app_config_dir
+from utils.snapshot_engine import SnapshotEngine, DEFAULT_SCAN_WORKERS
+from utils.ignore_matcher import IgnoreMatcher
+from utils.event_hub import EventHub, sse_frame
+from utils.fs_watcher import FsWatcher
+from utils.content_hash import FileContents, HashCache, current_contents, hash_bytes, hash_text, decode_text, read_scope
+from utils.dir_index import DirIndex
+from utils.snapshot_store import SnapshotStore
+from utils.snapshot_cache import SnapshotCache, ignore_key
+from utils.trigram_index import TrigramIndex, path_filter, search_files
+from utils.symbol_index import SymbolIndex, language
+from utils.context_packer import ContextIndex, pack, render as render_context, symbol_slicer
+from utils.http_clients import GITHUB_API, ClientPool
+from utils.job_queue import JobQueue, JobRejected, current_job, emit as job_emit, run_command
+from utils.rate_limit import TokenBucket, bucket_for
+from utils.model_router import AllProvidersFailed, ModelRouter
+from utils.completion_cache import MODES as CACHE_MODES, CompletionCache, completion_key
+from utils.stream_json import FilesStreamParser, parse_files
+from utils.diff_engine import DiffEngine
+from utils.plan_pool import PlanPool, plan_entry
+from utils.transaction import TEMP_MARK, ApplyTransaction, TransactionError, recover as recover_journals
+from utils.backup_store import BackupError, BackupStore, migrate_legacy
+from utils.edit_format import INSTRUCTIONS as EDIT_INSTRUCTIONS, EditError, apply_edit, is_edit
+from utils.file_reader import MAX_INLINE_BYTES, iter_text, looks_binary, read_lines, read_range, sniff
 
 # Load the .env file
 load_dotenv()
@@ -37,6 +60,8 @@ def log(msg: str):
 DEFAULT_IGNORES = [
     ".git/**","node_modules/**","dist/**","build/**",".venv/**",".devpilot_backups/**","*.lock","*.min.*"
 ]
+# always appended to the matcher: saved ignore_patterns and POST /ignore replace the defaults, not these
+FIXED_IGNORES = ["*" + TEMP_MARK, ".devpilot_backups/journal/**"]  # in-flight apply temps and journals
 DEFAULT_SETTINGS = {
     "slug_override": None,
     "default_base": None,
@@ -45,15 +70,51 @@ DEFAULT_SETTINGS = {
         "provider": "openai",
         "openai_key": None,
         "http_endpoint": "http://127.0.0.1:8080/v1/chat/completions",
-        "model": "gpt-4o-mini"
+        "model": "gpt-4o-mini",
+        "context_budget": 8000,   # tokens of repo context /autopatch packs when asked to
+        "batch_concurrency": 4,   # parallel completions per /autopatch/batch
+        "edit_format": "edits",   # "edits": model may answer with search/replace or diff hunks; "full": whole files only
+        # "race": hedge across providers (strings reuse the settings above; {"name", "provider": "http",
+        # "endpoint", "model"} adds an endpoint), starting the next when one runs past its p90 latency
+        "routing": {"mode": "single", "providers": ["openai", "http"], "hedge_after_ms": 5000},
+        # token bucket per provider (requests per minute, burst); rpm 0 = unlimited
+        "rate_limits": {"openai": {"rpm": 500, "burst": 8}, "http": {"rpm": 0, "burst": 1}},
     },
     "telemetry": {"enabled": False, "runs": 0, "applied_files": 0},
     "first_run_done": False,
     "ignore_patterns": DEFAULT_IGNORES.copy(),
+    "snapshot_cache": {"enabled": True, "max_mb": 512, "max_age_days": 30},
+    "completion_cache": {"enabled": True, "memory_entries": 64, "max_mb": 64, "ttl_hours": 24},
+    # plan diffs: patience | myers | difflib; over a budget a file's diff becomes a "too large" summary
+    "diff": {"algorithm": "patience", "max_lines": 50000, "max_mb": 16, "timeout_ms": 2000},
+    # /apply/plan payloads of at least parallel_min_files are read on threads and diffed on a process pool
+    "plan": {"workers": 0, "parallel_min_files": 50, "shard_mb": 4, "shard_files": 32},   # workers 0 = cores - 1, max 8
+    # file writes go through utils/transaction (temp + os.replace, journal, rollback); fsync for crash durability
+    "apply": {"fsync": True},
+    # content-addressed backups of overwritten files, one manifest per apply run (POST /revert {run_id});
+    # dir None = <app config>/backups/<repo>; compression zlib | zstd (needs zstandard); link = hardlink/reflink originals
+    "backups": {"dir": None, "compression": "zlib", "level": 6, "link": True,
+                "max_age_days": 30, "max_mb": 1024, "keep_runs": 10},
 }
 STATE: Dict[str, Any] = {
     "repo_root": None,
     "snapshot": {},
+    "snapshot_engine": None,  # SnapshotEngine for repo_root (incremental rescans)
+    "ignore_matcher": None,   # (key, IgnoreMatcher) — rebuilt only when the ignore set changes
+    "watcher": None,          # FsWatcher when watch mode is on
+    "hash_caches": {},        # repo_root -> HashCache (content hashes survive rescans)
+    "dir_index": None,        # (snapshot version, DirIndex) behind the lazy /repo/tree
+    "snapshot_gen": (None, 0),# (snapshot object, generation) — bumped whenever STATE["snapshot"] is replaced
+    "snapshot_cache": None,   # (settings key, SnapshotCache) — persisted snapshots for warm starts
+    "snapshot_save": None,    # pending debounced snapshot save (threading.Timer)
+    "completion_cache": None, # (settings key, CompletionCache) in front of _mux_complete / _mux_stream
+    "plan_pool": None,        # (settings key, PlanPool) diffing large /apply/plan payloads
+    "backup_store": None,     # (settings key, BackupStore) for the current repo
+    "backups_gc_at": 0.0,     # last automatic backup gc (at most hourly, after an apply)
+    "rate_limits": {},        # provider -> (settings key, TokenBucket | None)
+    "search_index": None,     # TrigramIndex following the live engine (/repo/search)
+    "symbol_index": None,     # SymbolIndex following the live engine (/repo/symbols, /repo/slice)
+    "context_index": None,    # ContextIndex (BM25 terms + token counts) behind /context/pack
     "settings": load_settings(DEFAULT_SETTINGS)  # ← persisted
 }
 def _repo_ignore_file(repo_root: Path) -> Path:
@@ -87,130 +148,613 @@ def _effective_ignores(repo_root: Path | None) -> list[str]:
             pats = (pats or []) + ["# REPO-LOCAL BELOW"] + repo_ign
     return [p for p in pats if p and not p.startswith("#")]
 
+def _ignore_matcher() -> IgnoreMatcher:
+    """Compiled matcher for the effective ignores; one stat of .devpilotignore per call."""
+    root = STATE["repo_root"]
+    try:
+        st = _repo_ignore_file(Path(root)).stat() if root else None
+        file_key = (st.st_mtime_ns, st.st_size) if st else None
+    except OSError:
+        file_key = None
+    key = (root, tuple(STATE["settings"].get("ignore_patterns") or []), file_key)
+    cached = STATE.get("ignore_matcher")
+    if cached and cached[0] == key:
+        return cached[1]
+    m = IgnoreMatcher(_effective_ignores(root) + FIXED_IGNORES)
+    STATE["ignore_matcher"] = (key, m)
+    return m
+
 def _is_ignored(rel_posix: str) -> bool:
-    pats = _effective_ignores(STATE["repo_root"])
-    for pat in pats:
-        if fnmatch.fnmatch(rel_posix, pat):
-            return True
-        if pat.endswith("/**") and (rel_posix == pat[:-3] or rel_posix.startswith(pat[:-3] + "/")):
-            return True
-    return False
+    return _ignore_matcher().is_ignored(rel_posix)
 
 def build_snapshot(repo_root: Path) -> Dict[str, Any]:
-    snap: Dict[str, Any] = {}
-    for root, _, files in os.walk(repo_root):
-        for f in files:
-            p = Path(root) / f
-            rel = p.relative_to(repo_root).as_posix()
-            if _is_ignored(rel):
-                continue
+    return SnapshotEngine(str(repo_root), ignores=_ignore_matcher).full_scan()
+
+# snapshot deltas (apply/revert/rescan/watch) fan out to /repo/events subscribers
+EVENTS = EventHub()
+CLIENTS = ClientPool(logger=log)  # keep-alive provider / GitHub clients, rebuilt when their settings change
+# long operations run as background jobs; lanes bound how many of each kind run at once
+JOB_LANES = {"llm": 2, "hooks": 1, "git": 1, "scan": 1}
+JOBS = JobQueue(JOB_LANES, logger=log)
+ROUTER = ModelRouter(logger=log)  # per-provider latency / failure stats; hedged racing when ai.routing.mode is "race"
+
+def _publish_snapshot_delta(delta: Dict[str, Any]) -> None:
+    EVENTS.publish({"type": "reset" if delta.get("reset") else "delta", **delta})
+    _save_snapshot_soon()
+
+SNAPSHOT_SAVE_DELAY = 5.0  # seconds; one save covers every delta in the window
+
+def _snapshot_cache() -> SnapshotCache | None:
+    cfg = STATE["settings"].get("snapshot_cache") or {}
+    if not cfg.get("enabled", True):
+        return None
+    key = (cfg.get("max_mb", 512), cfg.get("max_age_days", 30))
+    cached = STATE.get("snapshot_cache")
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        sc = SnapshotCache(_app_config_dir() / "cache" / "snapshots.sqlite3",
+                           max_bytes=int(key[0]) * 1024 * 1024, max_age_days=float(key[1]), logger=log)
+    except (OSError, sqlite3.Error, TypeError, ValueError) as e:
+        log(f"snapshot cache unavailable: {e}")
+        return None
+    STATE["snapshot_cache"] = (key, sc)
+    return sc
+
+def _completion_cache() -> CompletionCache | None:
+    cfg = STATE["settings"].get("completion_cache") or {}
+    if not cfg.get("enabled", True):
+        return None
+    key = (cfg.get("memory_entries", 64), cfg.get("max_mb", 64), cfg.get("ttl_hours", 24))
+    cached = STATE.get("completion_cache")
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        cc = CompletionCache(_app_config_dir() / "cache" / "completions.sqlite3", max_entries=int(key[0]),
+                             max_bytes=int(key[1]) * 1024 * 1024, ttl=float(key[2]) * 3600, logger=log)
+    except (OSError, sqlite3.Error, TypeError, ValueError) as e:
+        log(f"completion cache unavailable: {e}")
+        return None
+    STATE["completion_cache"] = (key, cc)
+    return cc
+
+def _completion_key(prompt: str) -> str:
+    ai = STATE["settings"]["ai"]
+    provider = ai.get("provider") or ""
+    return completion_key(provider, ai.get("model") or "gpt-4o-mini", 0.2, 4096, prompt,
+                          ai.get("http_endpoint") if provider == "http" else None)
+
+def _rate_bucket(provider: str) -> TokenBucket | None:
+    cfg = (STATE["settings"]["ai"].get("rate_limits") or {}).get(provider) or {}
+    key = (cfg.get("rpm", 0), cfg.get("burst", 1))
+    cached = STATE["rate_limits"].get(provider)
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        bucket = bucket_for(float(key[0]), float(key[1]))
+    except (TypeError, ValueError):
+        log(f"rate limit for {provider} ignored: bad settings {cfg}")
+        bucket = None
+    STATE["rate_limits"][provider] = (key, bucket)
+    return bucket
+
+def _rate_limit(provider: str) -> None:
+    """Wait for the provider's token bucket (a cancelled job stops waiting)."""
+    bucket = _rate_bucket(provider)
+    if bucket is not None:
+        job = current_job()
+        bucket.acquire(check=job.check if job is not None else None)
+
+def _diff_settings() -> Dict[str, Any]:
+    """DiffEngine keyword arguments from the diff settings (also shipped to plan pool workers)."""
+    cfg = STATE["settings"].get("diff") or {}
+    try:
+        kw = {"algorithm": cfg.get("algorithm", "patience"), "max_lines": int(cfg.get("max_lines", 50000)),
+              "max_bytes": int(float(cfg.get("max_mb", 16)) * 1024 * 1024), "timeout": float(cfg.get("timeout_ms", 2000)) / 1000}
+        DiffEngine(**kw)
+        return kw
+    except (TypeError, ValueError) as e:
+        log(f"diff settings ignored: {e}")
+        return {}
+
+def _diff_engine() -> DiffEngine:
+    return DiffEngine(**_diff_settings())
+
+def _diff_into(entry: Dict[str, Any], key: str, a: str, b: str, fromfile: str = "", tofile: str = "") -> Dict[str, Any]:
+    return _diff_engine().into(entry, key, a, b, fromfile, tofile)
+
+def _plan_pool() -> PlanPool:
+    cfg = STATE["settings"].get("plan") or {}
+    workers = int(cfg.get("workers") or 0) or max(1, min(8, (os.cpu_count() or 2) - 1))
+    key = (workers, cfg.get("shard_mb", 4), cfg.get("shard_files", 32))
+    cached = STATE.get("plan_pool")
+    if cached and cached[0] == key:
+        return cached[1]
+    if cached:
+        cached[1].shutdown()
+    pool = PlanPool(workers, shard_bytes=int(float(key[1]) * 1024 * 1024), shard_files=int(key[2]), logger=log)
+    STATE["plan_pool"] = (key, pool)
+    return pool
+
+def _cache_mode(payload: Dict[str, Any]) -> str:
+    mode = payload.get("cache") or "use"
+    if mode not in CACHE_MODES:
+        raise HTTPException(400, f"cache must be one of {', '.join(CACHE_MODES)}")
+    return mode
+
+def _save_snapshot() -> None:
+    eng = STATE.get("snapshot_engine")
+    sc = _snapshot_cache()
+    if eng is None or sc is None:
+        return
+    try:
+        state = {"engine": eng.export_state()}
+        hc = STATE["hash_caches"].get(eng.repo_root)
+        state["hashes"] = hc.export() if hc is not None else {}
+        size = sc.save(eng.repo_root, eng.source, ignore_key(eng.matcher.patterns), state, files=len(eng.snapshot))
+        log(f"snapshot cache: saved {len(eng.snapshot)} files for {eng.repo_root} ({size} bytes)")
+    except (OSError, sqlite3.Error, ValueError) as e:
+        log(f"snapshot cache: save failed: {e}")
+
+def _save_snapshot_soon() -> None:
+    t = STATE.get("snapshot_save")
+    if t is not None and t.is_alive():
+        return
+    t = threading.Timer(SNAPSHOT_SAVE_DELAY, _save_snapshot)
+    t.daemon = True
+    t.start()
+    STATE["snapshot_save"] = t
+
+@app.on_event("shutdown")
+def _flush_snapshot_cache() -> None:
+    t = STATE.get("snapshot_save")
+    if t is not None and t.is_alive():
+        t.cancel()
+        _save_snapshot()
+
+def _warm_start(eng: SnapshotEngine) -> bool:
+    """Restore eng from the snapshot cache and validate it; False if there is no usable entry."""
+    sc = _snapshot_cache()
+    if sc is None:
+        return False
+    t0 = time.perf_counter()
+    try:
+        state = sc.load(eng.repo_root, eng.source, ignore_key(eng.matcher.patterns))
+        if state is None:
+            return False
+        eng.restore(state["engine"])
+    except (KeyError, ValueError, TypeError, sqlite3.Error) as e:
+        log(f"snapshot cache: ignoring entry for {eng.repo_root}: {e}")
+        return False
+    hc = STATE["hash_caches"].setdefault(eng.repo_root, HashCache())
+    hc.load(state.get("hashes") or {})
+    stats = eng.rescan()  # added/removed files show up as directory mtime changes
+    eng.last_scan.update(files=len(eng.snapshot), elapsed_ms=int((time.perf_counter() - t0) * 1000), validated=stats)
+    log(f"snapshot: warm start {eng.last_scan}")
+    return True
+
+def _verify_restored(eng: SnapshotEngine, batch: int = 5000) -> None:
+    """In-place edits made while the engine was down don't move directory mtimes: re-stat every file."""
+    with eng.lock:
+        paths = list(eng.snapshot)
+    for i in range(0, len(paths), batch):
+        if STATE.get("snapshot_engine") is not eng:
+            return
+        eng.refresh_paths(paths[i:i + batch])
+
+def _install_engine(eng: SnapshotEngine, warm: bool = False) -> SnapshotEngine:
+    """
+    Make eng the live engine: full scan (or, with warm=True, the cached snapshot
+    validated incrementally), publish deltas, move an active watcher over.
+    """
+    old = STATE.get("snapshot_engine")
+    if old is not None:
+        old.unsubscribe(_publish_snapshot_delta)
+    eng.subscribe(_publish_snapshot_delta)
+    restored = warm and _warm_start(eng)
+    if not restored:
+        eng.full_scan()
+    STATE["snapshot_engine"] = eng
+    STATE["snapshot"] = eng.snapshot
+    w = STATE.get("watcher")
+    if w is not None:
+        w.stop()
+        STATE["watcher"] = FsWatcher(eng, mode=w.requested_mode, debounce_ms=int(w.debounce * 1000), logger=log).start()
+    for key in ("search_index", "symbol_index", "context_index"):
+        if STATE.get(key) is not None:
+            STATE[key].detach()
+    STATE["search_index"] = TrigramIndex(eng.repo_root, logger=log).attach(eng)
+    STATE["symbol_index"] = SymbolIndex(eng.repo_root, _hash_cache(), logger=log).attach(eng)
+    STATE["context_index"] = ContextIndex(eng.repo_root, _hash_cache(), logger=log).attach(eng)
+    if restored and eng.source == "walk":  # git status already re-checks worktree files
+        threading.Thread(target=_verify_restored, args=(eng,), name="snapshot-verify", daemon=True).start()
+    return eng
+
+def _snapshot_engine() -> SnapshotEngine:
+    eng = STATE.get("snapshot_engine")
+    if eng is None or eng.repo_root != str(Path(STATE["repo_root"]).resolve()):
+        eng = _install_engine(SnapshotEngine(STATE["repo_root"], ignores=_ignore_matcher, logger=log))
+    STATE["snapshot"] = eng.snapshot
+    return eng
+
+def _hash_cache() -> HashCache:
+    caches = STATE["hash_caches"]
+    hc = caches.get(STATE["repo_root"])
+    if hc is None:
+        hc = caches[STATE["repo_root"]] = HashCache()
+    return hc
+
+def _journal_dir(repo: Path, store: BackupStore) -> Path:
+    """
+    Apply journals hardlink every original they replace (the rollback copy), which only works within one
+    filesystem: they live in the backup store when it shares the repo's, else in <repo>/.devpilot_backups
+    (a copy per file there would make every apply pay for a full second write).
+    """
+    try:
+        same = os.stat(store.root).st_dev == os.stat(repo).st_dev
+    except OSError:
+        same = False
+    return Path(store.root) / "journal" if same else repo / ".devpilot_backups" / "journal"
+
+def _transaction(repo: Path) -> ApplyTransaction:
+    """All-or-nothing writer for a batch of engine writes; first rolls back any apply a crash interrupted."""
+    journal = _journal_dir(repo, _backup_store())
+    for d in dict.fromkeys([journal, repo / ".devpilot_backups" / "journal"]):  # the in-repo one may predate the store
+        recover_journals(str(d), logger=log)
+    return ApplyTransaction(str(repo), str(journal), fsync=bool((STATE["settings"].get("apply") or {}).get("fsync", True)))
+
+def _backup_store() -> BackupStore:
+    cfg = STATE["settings"].get("backups") or {}
+    repo = str(Path(STATE["repo_root"]).resolve())
+    key = (repo, cfg.get("dir"), cfg.get("compression", "zlib"), cfg.get("level", 6), cfg.get("link", True))
+    cached = STATE.get("backup_store")
+    if cached and cached[0] == key:
+        return cached[1]
+    root = Path(cfg["dir"]) if cfg.get("dir") else _app_config_dir() / "backups"
+    try:
+        store = BackupStore(str(root / hash_text(repo)[:16]), compression=key[2], level=int(key[3]),
+                            link=bool(key[4]), logger=log)
+    except (OSError, ValueError) as e:
+        raise HTTPException(500, f"backup store unavailable: {e}")
+    legacy = Path(repo) / ".devpilot_backups"
+    run_id = f"legacy-{time.strftime('%Y%m%d%H%M%S')}-{os.urandom(4).hex()}"  # .bak files can reappear (older clients)
+    if legacy.is_dir() and migrate_legacy(store, str(legacy), run_id):
+        log(f"imported .devpilot_backups/*.bak as backup run {run_id}")
+    STATE["backup_store"] = (key, store)
+    return store
+
+def _backups_gc(store: BackupStore, force: bool = False, **limits: Any) -> Dict[str, Any] | None:
+    if not force and time.time() - STATE["backups_gc_at"] < 3600:
+        return None
+    STATE["backups_gc_at"] = time.time()
+    cfg = STATE["settings"].get("backups") or {}
+    days, mb = limits.get("max_age_days", cfg.get("max_age_days")), limits.get("max_mb", cfg.get("max_mb"))
+    return store.gc(max_age=float(days) * 86400 if days else None, max_bytes=int(float(mb) * 1024 * 1024) if mb else None,
+                    keep_runs=int(limits.get("keep_runs", cfg.get("keep_runs", 10))))
+
+def _commit(txn: ApplyTransaction, kind: str = "apply", meta: Dict[str, Any] | None = None) -> List[str]:
+    """Commit txn, backing up every original it replaces first; the run is recorded for /revert under txn.id."""
+    store = _backup_store()
+    previous: Dict[str, str] = {}
+    def backup(rel: str, original: str, digest: str | None) -> None:
+        previous[rel] = store.put_file(original, digest)
+    with store.lock:  # no gc between the backups and the manifest that references them
+        try:
+            written = txn.commit(before_replace=backup)
+        except TransactionError as e:
+            log(str(e))
+            for digest in previous.values():
+                store.unshare(digest)  # originals linked in are back in the tree
+            raise HTTPException(500, f"{e} (no files were changed)")
+        if written:
             try:
-                size = p.stat().st_size
-            except Exception:
-                size = 0
-            snap[rel] = {"size": size, "ext": p.suffix.lower()}
-    return snap
+                store.record_run(txn.id, {rel: previous.get(rel) for rel in written}, kind, meta)
+            except OSError as e:
+                log(f"backup run {txn.id} not recorded: {e}")
+                return written
+    if written:
+        try:
+            _backups_gc(store)
+        except OSError as e:
+            log(f"backups gc failed: {e}")
+    return written
 
-def _mux_complete(prompt: str, files_hint: list[dict] | None = None) -> dict:
+def _refresh_snapshot(paths: List[str]) -> None:
+    """Patch STATE["snapshot"] in place for files the engine itself wrote."""
+    if paths:
+        _snapshot_engine().refresh_paths(paths)
+
+def _mux_complete(prompt: str, files_hint: list[dict] | None = None, cache: str = "use") -> dict:
     """
-    Returns {"files":[{"path":"...","code":"..."}], "raw": <raw response>}
+    Returns {"files":[{"path":"...","code":"..."}], "raw": <raw response>, "cached": bool}
     Uses provider from STATE["settings"]["ai"].
     The prompt must instruct STRICT JSON {"files":[...]}.
+    cache: "use" (serve from / fill the completion cache), "bypass" (neither), "refresh" (fill only).
+    With ai.routing.mode "race" the call is hedged across providers and the result has "route".
     """
     ai = STATE["settings"]["ai"]
     provider = ai.get("provider")
-    model = ai.get("model") or "gpt-4o-mini"
-
-    if provider == "openai":
-        from openai import OpenAI
-        key = ai.get("openai_key")
-        if not key:
+    cc = _completion_cache() if cache != "bypass" and provider in ("openai", "http") else None
+    key = _completion_key(prompt) if cc else None
+    if cc and cache == "use":
+        hit = cc.get(key)
+        if hit is not None:
+            return {**hit, "cached": True}
+    routing = ai.get("routing") or {}
+    if provider in ("openai", "http") and routing.get("mode") == "race":
+        result = _routed_complete(prompt, ai, routing)
+    elif provider in ("openai", "http"):
+        result = ROUTER.timed(provider, lambda _name: _provider_complete(_backend(ai, provider), prompt))
+    else:
+        # webllm (dev): the renderer handles this client-side; engine just returns unsupported
+        raise HTTPException(400, "Provider 'webllm' runs in renderer; use UI Auto-Patch (Dev Mode)")
+    if cc:
+        cc.put(key, {k: v for k, v in result.items() if k != "route"})  # only replies that parsed are worth replaying
+    return {**result, "cached": False}
+
+def _backend(ai: Dict[str, Any], spec: Any) -> Dict[str, Any] | None:
+    """A provider to call: "openai" / "http" with the ai settings, or a dict adding another http endpoint."""
+    base = {"model": ai.get("model") or "gpt-4o-mini", "endpoint": ai.get("http_endpoint"), "openai_key": ai.get("openai_key")}
+    if spec in ("openai", "http"):
+        return {**base, "name": spec, "provider": spec}
+    if isinstance(spec, dict) and spec.get("provider") == "http" and spec.get("endpoint"):
+        return {**base, **spec, "name": spec.get("name") or spec["endpoint"]}
+    return None
+
+def _provider_complete(b: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+    """{"files", "raw"} of one non-streaming completion from backend b (see _backend)."""
+    _rate_limit(b["provider"])
+    if b["provider"] == "openai":
+        if not b.get("openai_key"):
             raise HTTPException(400, "OpenAI key not set")
-        client = OpenAI(api_key=key)
+        client = CLIENTS.openai(b["openai_key"])
         out = client.chat.completions.create(
-            model=model,
+            model=b["model"],
             messages=[{"role":"user","content":prompt}],
             temperature=0.2,
             max_tokens=4096
         )
         text = out.choices[0].message.content or ""
         raw = out.model_dump()
-    elif provider == "http":
-        ep = ai.get("http_endpoint")
+    else:
+        ep = b.get("endpoint")
         if not ep:
             raise HTTPException(400, "HTTP endpoint not configured")
-        payload = {"model": model, "messages":[{"role":"user","content":prompt}], "temperature":0.2, "max_tokens":4096}
-        r = requests.post(ep, json=payload, timeout=120)
+        payload = {"model": b["model"], "messages":[{"role":"user","content":prompt}], "temperature":0.2, "max_tokens":4096}
+        slot = "http-provider" if b["name"] == "http" else f"http-provider:{b['name']}"
+        r = CLIENTS.session(slot, ep).post(ep, json=payload, timeout=120)
         if r.status_code >= 300:
             raise HTTPException(r.status_code, f"HTTP provider failed: {r.text[:400]}")
         data = r.json()
         text = data.get("choices",[{}])[0].get("message",{}).get("content","")
         raw = data
-    else:
-        # webllm (dev): the renderer handles this client-side; engine just returns unsupported
-        raise HTTPException(400, "Provider 'webllm' runs in renderer; use UI Auto-Patch (Dev Mode)")
 
-    # extract JSON block
+    # extract JSON block: outermost {...} of the reply
     try:
-        # naive extraction: find first '{' and last '}' for a JSON object
-        import json, re
-        match = re.search(r"\{[\s\S]*\}", text)
-        obj = json.loads(match.group(0)) if match else json.loads(text)
-        if not isinstance(obj.get("files"), list): raise ValueError("no files[]")
-        return {"files": obj["files"], "raw": raw}
+        return {"files": parse_files(text), "raw": raw}
     except Exception as e:
         raise HTTPException(500, f"Model did not return valid JSON files[]: {e}")
+
+def _routed_complete(prompt: str, ai: Dict[str, Any], routing: Dict[str, Any]) -> Dict[str, Any]:
+    """_provider_complete raced across ai.routing.providers (ModelRouter); the first valid files[] wins."""
+    backends = {b["name"]: b for b in (_backend(ai, p) for p in routing.get("providers") or []) if b}
+    if not backends:
+        raise HTTPException(400, "ai.routing.providers has no usable provider")
+
+    def call(name: str) -> Dict[str, Any]:
+        res = _provider_complete(backends[name], prompt)
+        bad = [f for f in res["files"] if not isinstance(f, dict) or not isinstance(f.get("path"), str)]
+        if bad:
+            raise HTTPException(500, f"files[] entries without a path: {len(bad)}")
+        return res
+
+    job = current_job()
+    try:
+        name, res, info = ROUTER.race(list(backends), call, hedge_after=float(routing.get("hedge_after_ms") or 5000) / 1000,
+                                      check=job.check if job is not None else None)
+    except AllProvidersFailed as e:
+        if len(e.errors) == 1:
+            raise next(iter(e.errors.values()))
+        raise HTTPException(502, f"all providers failed: {e}")
+    return {**res, "route": {"provider": name, **info}}
+
+def _mux_stream(prompt: str, cache: str = "use") -> Iterator[str]:
+    """
+    Streaming counterpart of _mux_complete: opens the completion with the configured
+    provider and returns an iterator of text deltas. Config and upstream HTTP errors
+    raise HTTPException here, before any text is produced. A completion cache hit
+    comes back as a one-item list; a streamed reply that parses is stored.
+    """
+    ai = STATE["settings"]["ai"]
+    provider = ai.get("provider")
+    model = ai.get("model") or "gpt-4o-mini"
+    messages = [{"role":"user","content":prompt}]
+    cc = _completion_cache() if cache != "bypass" and provider in ("openai", "http") else None
+    if cc:
+        key = _completion_key(prompt)
+        hit = cc.get(key) if cache == "use" else None
+        if hit is not None:
+            return [json.dumps({"files": hit["files"]})]  # type: ignore[return-value]
+        return _cache_stream(_open_stream(provider, model, messages, ai), cc, key)
+    return _open_stream(provider, model, messages, ai)
+
+def _cache_stream(deltas: Iterator[str], cc: CompletionCache, key: str) -> Iterator[str]:
+    text = []
+    try:
+        for chunk in deltas:
+            text.append(chunk)
+            yield chunk
+    finally:
+        close = getattr(deltas, "close", None)
+        if close: close()
+    try:
+        cc.put(key, {"files": parse_files("".join(text)), "raw": None})
+    except ValueError:
+        pass
+
+def _open_stream(provider: str | None, model: str, messages: list[dict], ai: Dict[str, Any]) -> Iterator[str]:
+    if provider in ("openai", "http"):
+        _rate_limit(provider)
+    if provider == "openai":
+        key = ai.get("openai_key")
+        if not key:
+            raise HTTPException(400, "OpenAI key not set")
+        stream = CLIENTS.openai(key).chat.completions.create(
+            model=model, messages=messages, temperature=0.2, max_tokens=4096, stream=True)
+        def deltas() -> Iterator[str]:
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                stream.close()
+        return deltas()
+    if provider == "http":
+        ep = ai.get("http_endpoint")
+        if not ep:
+            raise HTTPException(400, "HTTP endpoint not configured")
+        payload = {"model": model, "messages": messages, "temperature":0.2, "max_tokens":4096, "stream": True}
+        r = CLIENTS.session("http-provider", ep).post(ep, json=payload, stream=True, timeout=120)
+        if r.status_code >= 300:
+            body = r.text[:400]; r.close()
+            raise HTTPException(r.status_code, f"HTTP provider failed: {body}")
+        return _http_deltas(r)
+    raise HTTPException(400, "Provider 'webllm' runs in renderer; use UI Auto-Patch (Dev Mode)")
+
+def _http_deltas(r: requests.Response) -> Iterator[str]:
+    """Text deltas of an OpenAI-compatible reply: `data:` SSE chunks, or one JSON body if the endpoint does not stream."""
+    try:
+        if "text/event-stream" not in r.headers.get("content-type", ""):
+            yield (r.json().get("choices") or [{}])[0].get("message", {}).get("content") or ""
+            return
+        r.encoding = "utf-8"  # SSE is always UTF-8; requests would guess latin-1 for text/*
+        for line in r.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                choice = (json.loads(data).get("choices") or [{}])[0]
+            except ValueError:
+                continue
+            text = (choice.get("delta") or {}).get("content") or (choice.get("message") or {}).get("content")
+            if text:
+                yield text
+    finally:
+        r.close()
 def _read_file_text(p: Path) -> str:
+    """File text ("" if missing); inside a read_scope() each file is read and decoded once."""
+    contents = current_contents()
+    if contents is not None:
+        return contents.read(str(p))[1]
     return p.read_text(encoding="utf-8", errors="ignore") if p.exists() else ""
 
 def _file_mtime(p: Path) -> float:
     try: return p.stat().st_mtime
     except: return 0.0
+
+def _hashed_current(p: Path, rel: str) -> tuple[str | None, str | None]:
+    """(disk hash, text). Text is None when the hash came from cache — read it only if needed."""
+    hc, contents = _hash_cache(), current_contents()
+    try:
+        st = p.stat()
+    except OSError:
+        return None, ""
+    hit = contents.get(str(p), st) if contents is not None else None
+    if hit is not None:
+        return hit[1], hit[0]
+    digest = hc.cached(rel, st)
+    if digest is not None:
+        if contents is not None: contents.note(str(p), st)
+        return digest, None
+    if contents is not None:
+        st, text, digest = contents.read(str(p))
+        if st is not None: hc.store(rel, st, digest)
+        return digest, text
+    data, digest = hc.read(str(p), rel)
+    return digest, decode_text(data) if data is not None else ""
+
+def _expected_mismatch(f: Dict[str, Any], disk_hash: str | None, current: Callable[[], str]) -> bool:
+    """expected_hash / expected_current vs disk; full text compare only when hashes differ."""
+    if f.get("expected_hash") is not None:
+        return f["expected_hash"] != disk_hash
+    expected = f.get("expected_current")
+    if expected is None:
+        return False
+    return hash_text(expected) != disk_hash and expected != current()
 @app.get("/health")
 def health():
     return {"ok": True, "engine": "devpilot", "version": "0.3.0"}
 
-def build_snapshot(repo_root: Path) -> Dict[str, Any]:
-    snap: Dict[str, Any] = {}
-    for root, _, files in os.walk(repo_root):
-        for f in files:
-            p = Path(root) / f
-            rel = p.relative_to(repo_root).as_posix()
-            try:
-                size = p.stat().st_size
-            except Exception:
-                size = 0
-            snap[rel] = {"size": size, "ext": p.suffix.lower()}
-    return snap
-
-def build_tree(snapshot: Dict[str, Any]) -> Dict[str, Any]:
-    root: Dict[str, Any] = {"name": "/", "path": "", "isDir": True, "children": []}
-    index = {"": root}
-    for rel in sorted(snapshot.keys()):
-        parts = rel.split("/")
-        acc = ""
-        for i, part in enumerate(parts):
-            is_last = i == len(parts) - 1
-            next_acc = f"{acc}/{part}" if acc else part
-            if next_acc not in index:
-                node = {
-                    "name": part,
-                    "path": next_acc,
-                    "isDir": not is_last,
-                    "children": [] if not is_last else None,
-                }
-                parent = index[acc]
-                parent["children"].append(node)  # type: ignore
-                index[next_acc] = node
-            acc = next_acc
+def _dir_index() -> DirIndex:
+    """DirIndex for the live snapshot, rebuilt only when the snapshot changed."""
+    key = _snapshot_version()
+    cached = STATE.get("dir_index")
+    if cached and cached[0] == key:
+        return cached[1]
+    idx = DirIndex(_snapshot_paths())
+    STATE["dir_index"] = (key, idx)
+    return idx
+
+def _snapshot_lock() -> Any:
+    """The engine lock while STATE["snapshot"] is the live store (the watcher edits it in place)."""
+    eng = STATE.get("snapshot_engine")
+    return eng.lock if eng is not None and eng.snapshot is STATE["snapshot"] else contextlib.nullcontext()
+
+def _snapshot_paths() -> list[str]:
+    with _snapshot_lock():
+        return list(STATE["snapshot"].keys())
+
+def _snapshot_copy() -> Dict[str, Any]:
+    """Plain-dict copy of the snapshot, safe to serialize while the watcher runs."""
+    with _snapshot_lock():
+        snap = STATE["snapshot"]
+        return snap.to_dict() if isinstance(snap, SnapshotStore) else dict(snap)
+
+_EPOCH = os.urandom(4).hex()  # per process: versions from before a restart never match
+
+def _snapshot_version() -> str:
+    """Repo + process epoch + which snapshot object + its change count; unique across rescans, repo switches, restarts."""
+    eng = STATE.get("snapshot_engine")
+    snap = STATE["snapshot"]
+    held, gen = STATE["snapshot_gen"]
+    if held is not snap:  # holding the object (not its id) means a new one can never be mistaken for it
+        gen += 1
+        STATE["snapshot_gen"] = (snap, gen)
+    prefix = f"{_EPOCH}-{hash_text(STATE['repo_root'] or '')[:8]}-{gen}"
+    if eng is not None and eng.snapshot is snap:
+        return f"{prefix}-{eng.version}"
+    return f"{prefix}-{len(snap)}"  # session-imported snapshots are never mutated in place
+
+def build_tree(snapshot: Dict[str, Any], hashes: Dict[str, str] | None = None) -> Dict[str, Any]:
+    root = DirIndex(snapshot.keys()).node("", None)
+    if hashes is not None:
+        _annotate_hashes(root, hashes.get)
     return root
 
+def _annotate_hashes(node: Dict[str, Any], file_hash: Callable[[str], str | None]) -> None:
+    """Set "hash" on the file nodes actually present (expanded, in the page) under node."""
+    for c in node.get("children") or []:
+        if c["isDir"]:
+            _annotate_hashes(c, file_hash)
+        else:
+            c["hash"] = file_hash(c["path"])
+
 def _ensure_repo():
     if not STATE["repo_root"]:
         raise HTTPException(400, "No repo scanned yet")
 
 @app.post("/repo/scan")
-def repo_scan(payload: Dict[str, str] = Body(...)):
+def repo_scan(payload: Dict[str, Any] = Body(...)):
+    """
+    payload = {
+      "repo_root": "...",
+      "workers": 16,          # optional: scan threads (1 = serial)
+      "source": "walk",       # optional: walk | git (index + porcelain status) | auto (git when it's a git repo)
+      "cache": true           # optional: start from the persisted snapshot when there is one (false = walk)
+    }
+    """
     repo_root = payload.get("repo_root")
     if not repo_root:
         raise HTTPException(400, "repo_root is required")
@@ -218,31 +762,268 @@ def repo_scan(payload: Dict[str, str] = Body(...)):
     if not repo_path.exists() or not repo_path.is_dir():
         raise HTTPException(404, f"Folder not found: {repo_root}")
 
-    snapshot = build_snapshot(repo_path)
+    try:
+        workers = int(payload.get("workers") or DEFAULT_SCAN_WORKERS)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "workers must be an integer")
+    if workers < 1 or workers > 256:
+        raise HTTPException(400, "workers must be between 1 and 256")
+
+    source = payload.get("source") or "walk"
+    if source not in ("walk", "git", "auto"):
+        raise HTTPException(400, "source must be walk, git or auto")
+    if source == "auto":
+        source = "git" if GitTaskManager(str(repo_path)).is_repo() else "walk"
+
+    warm = bool(payload.get("cache", True))
     STATE["repo_root"] = str(repo_path)
-    STATE["snapshot"] = snapshot
-    return {"ok": True, "files": len(snapshot)}
+    try:
+        eng = _install_engine(SnapshotEngine(str(repo_path), ignores=_ignore_matcher, logger=log, workers=workers, source=source), warm=warm)
+    except RuntimeError as e:
+        if source != "git":
+            raise
+        log(f"git snapshot failed, walking instead: {e}")
+        eng = _install_engine(SnapshotEngine(str(repo_path), ignores=_ignore_matcher, logger=log, workers=workers), warm=warm)
+    return {"ok": True, "files": len(eng.snapshot), "scan": eng.last_scan}
 
 @app.get("/repo/tree")
-def repo_tree():
+def repo_tree(
+    request: Request,
+    path: str = Query("", description="directory to return (default: repo root)"),
+    depth: int | None = Query(None, ge=0, description="levels to expand below path; omit for the whole tree"),
+    offset: int = Query(0, ge=0, description="page start within path's children"),
+    limit: int | None = Query(None, ge=1, description="page size within path's children"),
+    hashes: bool = Query(False, description="include content hashes (computed lazily, cached)"),
+):
+    """
+    Lazy tree: ?path=src&depth=1 returns one level with childCount/fileCount per
+    directory (unexpanded ones have children=null). Responses carry an ETag tied
+    to the snapshot version; If-None-Match with an unchanged snapshot gets a 304.
+    """
     if not STATE["snapshot"]:
         return {"root": {"name": "/", "path": "", "isDir": True, "children": []}}
-    return {"root": build_tree(STATE["snapshot"])}
-
-@app.get("/repo/metadata")
-def repo_metadata(path: str = Query(..., description="relative file path")):
+    path = path.strip("/")
+    etag = None
+    if not hashes:  # hashes follow file contents, not the snapshot version
+        etag = '"' + f"{_snapshot_version()}-{path}-{depth}-{offset}-{limit}" + '"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+    idx = _dir_index()
+    if path and not idx.is_dir(path):
+        raise HTTPException(404, f"Directory not found: {path}")
+    root = idx.node(path, depth, offset, limit)
+    if hashes:
+        hc, repo = _hash_cache(), STATE["repo_root"]
+        _annotate_hashes(root, lambda rel: hc.file_hash(os.path.join(repo, rel), rel))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    return JSONResponse({"root": root, "version": _snapshot_version()}, headers=headers)
+
+@app.post("/repo/watch")
+def repo_watch(payload: Dict[str, Any] = Body(...)):
+    """
+    payload = { "enabled": true, "mode": "auto" | "inotify" | "poll", "debounce_ms": 300 }
+    Keeps the snapshot current while files change outside DevPilot; deltas go to /repo/events.
+    """
+    _ensure_repo()
+    w = STATE.get("watcher")
+    if w is not None:
+        w.stop()
+        STATE["watcher"] = None
+    if not payload.get("enabled", True):
+        return {"ok": True, "watch": {"running": False}}
+    mode = payload.get("mode") or "auto"
+    if mode not in ("auto", "inotify", "poll"):
+        raise HTTPException(400, "mode must be auto, inotify or poll")
+    try:
+        w = FsWatcher(_snapshot_engine(), mode=mode, debounce_ms=int(payload.get("debounce_ms", 300)), logger=log).start()
+    except OSError as e:
+        raise HTTPException(400, f"watch mode unavailable: {e}")
+    STATE["watcher"] = w
+    return {"ok": True, "watch": w.status()}
+
+@app.get("/repo/watch")
+def repo_watch_status():
+    w = STATE.get("watcher")
+    return {"ok": True, "watch": w.status() if w is not None else {"running": False}, "subscribers": EVENTS.subscribers}
+
+@app.get("/repo/events")
+def repo_events():
+    """Server-sent events: `delta` {added, removed, changed, version} and `reset` (refetch the tree)."""
+    q = EVENTS.subscribe()
+    return StreamingResponse(EVENTS.stream(q), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/repo/search")
+def repo_search(
+    q: str = Query(..., min_length=1, description="literal text, or a Python regex with regex=true"),
+    regex: bool = Query(False),
+    ignore_case: bool = Query(False),
+    path: str = Query("", description="only files below this directory"),
+    glob: str | None = Query(None, description="only files matching this glob (full path or file name)"),
+    context: int = Query(2, ge=0, le=20, description="lines of context before/after each hit"),
+    limit: int = Query(100, ge=1, le=1000),
+    max_per_file: int = Query(20, ge=1, le=1000),
+    timeout_ms: int = Query(2000, ge=1, le=60000),
+):
+    """
+    Code search over the snapshot's text files. The trigram index narrows the
+    files to read (after re-indexing files changed on disk since it read them);
+    every hit is confirmed against the file. Until the index is built
+    (`indexed: false`) all files are scanned.
+    """
+    _ensure_repo()
+    t0 = time.perf_counter()
+    try:
+        rx = re.compile(q if regex else re.escape(q), re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    except re.error as e:
+        raise HTTPException(400, f"invalid regex: {e}")
+    eng = _snapshot_engine()
+    idx = STATE["search_index"]
+    if idx.ready:
+        cands, unindexed = idx.candidates(q, regex)
+        paths = sorted(cands + unindexed)
+    else:
+        with eng.lock:
+            paths = sorted(eng.snapshot)
+    paths = path_filter(paths, path, glob)
+    hits, stats = search_files(STATE["repo_root"], paths, rx, context=context, limit=limit,
+                               max_per_file=max_per_file, deadline=t0 + timeout_ms / 1000)
+    return {"ok": True, "query": q, "hits": hits, "indexed": idx.ready, "candidates": len(paths), **stats,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1), "index": idx.status()}
+
+@app.get("/repo/symbols")
+def repo_symbols(
+    name: str | None = Query(None, description="symbol or qualified name (Class.method)"),
+    path: str | None = Query(None, description="outline of this file (defs + imports) when no name is given"),
+    kind: str | None = Query(None, description="function | class | method | variable | interface | type | enum | namespace"),
+    prefix: bool = Query(False, description="match names starting with `name`"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Definitions from the symbol index (Python via ast, TS/JS via a tokenizer), with 1-based line spans."""
     _ensure_repo()
+    _snapshot_engine()
+    idx = STATE["symbol_index"]
+    if name:
+        hits = idx.lookup(name, kind=kind, prefix=prefix, limit=limit)
+        if path:
+            hits = [h for h in hits if h["path"] == Path(path).as_posix()]
+        return {"ok": True, "symbols": hits, "index": idx.status()}
+    if not path:
+        raise HTTPException(400, "name or path is required")
+    _repo_file(path)
+    rel = Path(path).as_posix()
+    if not language(rel):
+        raise HTTPException(400, f"no symbol support for {path}")
+    syms = idx.symbols(rel)
+    if syms is None:
+        raise HTTPException(404, f"File not found: {path}")
+    defs = [d for d in syms["defs"] if kind is None or d["kind"] == kind]
+    return {"ok": True, "path": rel, "lang": syms["lang"], "symbols": defs, "imports": syms["imports"],
+            "error": syms.get("error")}
+
+@app.get("/repo/slice")
+def repo_slice(
+    symbol: str | None = Query(None, description="name or qualified name (Class.method)"),
+    path: str | None = Query(None, description="file to slice; looked up from the index when omitted"),
+    line: int | None = Query(None, ge=1, description="innermost definition containing this line (with path)"),
+):
+    """
+    Minimal prompt context: one function/class/method plus only the imports it
+    uses (methods keep their class header). The result has the {path, content}
+    shape the DPS `slices` field takes.
+    """
+    _ensure_repo()
+    _snapshot_engine()
+    idx = STATE["symbol_index"]
+    if not symbol and line is None:
+        raise HTTPException(400, "symbol or line is required")
+    alternatives: List[str] = []
+    if path:
+        _repo_file(path)
+        rel = Path(path).as_posix()
+    else:
+        if not symbol:
+            raise HTTPException(400, "path is required with line")
+        hits = idx.lookup(symbol, limit=20)
+        if not hits:
+            raise HTTPException(404, f"Symbol not found: {symbol}")
+        # exact qualified matches first, then shortest path
+        hits.sort(key=lambda h: (h["qualname"] != symbol, len(h["path"]), h["path"]))
+        rel = hits[0]["path"]
+        alternatives = sorted({h["path"] for h in hits[1:]} - {rel})
+    sl = idx.slice(rel, symbol=symbol, line=line)
+    if sl is None:
+        raise HTTPException(404, f"Symbol not found in {rel}: {symbol or f'line {line}'}")
+    return {"ok": True, **sl, "alternatives": alternatives}
+
+def _repo_file(path: str) -> tuple[Path, os.stat_result]:
     rel = Path(path)
+    if rel.is_absolute() or ".." in rel.parts:
+        raise HTTPException(400, f"invalid path: {path}")
     abs_path = Path(STATE["repo_root"]) / rel
-    if not abs_path.exists() or not abs_path.is_file():
+    try:
+        st = abs_path.stat()
+    except OSError:
+        st = None
+    if st is None or not abs_path.is_file():
         raise HTTPException(404, f"File not found: {path}")
-    code = abs_path.read_text(encoding="utf-8", errors="ignore")
-    return {
-        "repo": STATE["repo_root"],
-        "file": rel.as_posix(),
-        "code": code,
-        "snapshot": STATE["snapshot"],
-    }
+    return abs_path, st
+
+@app.get("/repo/metadata")
+def repo_metadata(
+    path: str = Query(..., description="relative file path"),
+    slim: bool = Query(False, description="omit the repo snapshot from the response"),
+    offset: int | None = Query(None, ge=0, description="byte offset of a ranged read"),
+    length: int | None = Query(None, ge=0, description="byte length of a ranged read"),
+    start_line: int | None = Query(None, ge=1, description="first line (1-based) of a line-range read"),
+    end_line: int | None = Query(None, ge=1, description="last line (inclusive) of a line-range read"),
+    max_bytes: int = Query(MAX_INLINE_BYTES, ge=0, description="whole-file reads above this return metadata only"),
+):
+    """
+    Returns the file's code plus metadata. Binary files (NUL in the first 8 KiB) and
+    whole-file reads over max_bytes come back with code=null; use offset/length or
+    start_line/end_line (served from an mmap) or /repo/metadata/stream for those.
+    """
+    _ensure_repo()
+    abs_path, st = _repo_file(path)
+    rel = Path(path).as_posix()
+    hc = _hash_cache()
+    out: Dict[str, Any] = {"repo": STATE["repo_root"], "file": rel, "size": st.st_size,
+                           "hash": hc.cached(rel, st), "binary": False, "too_large": False, "code": None}
+    try:
+        out["binary"] = looks_binary(sniff(str(abs_path)))
+        ranged = offset is not None or length is not None or start_line is not None or end_line is not None
+        if out["binary"]:
+            pass
+        elif start_line is not None or end_line is not None:
+            data, out["range"] = read_lines(str(abs_path), start_line or 1, end_line)
+            out["code"] = decode_text(data)
+        elif ranged:
+            data, out["range"] = read_range(str(abs_path), offset or 0, length)
+            out["code"] = decode_text(data)
+        elif st.st_size > max_bytes:
+            out["too_large"] = True
+        else:
+            data, out["hash"] = hc.read(str(abs_path), rel)
+            out["code"] = decode_text(data) if data is not None else ""
+    except OSError as e:
+        raise HTTPException(500, f"Could not read {path}: {e}")
+    if not slim:
+        out["snapshot"] = _snapshot_copy()
+    return out
+
+@app.get("/repo/metadata/stream")
+def repo_metadata_stream(path: str = Query(..., description="relative file path")):
+    """Streams a text file as utf-8 chunks so large files can render progressively."""
+    _ensure_repo()
+    abs_path, st = _repo_file(path)
+    if looks_binary(sniff(str(abs_path))):
+        raise HTTPException(415, f"Binary file: {path}")
+    headers = {"X-File-Size": str(st.st_size)}
+    digest = _hash_cache().cached(Path(path).as_posix(), st)
+    if digest:
+        headers["X-Content-Hash"] = digest
+    return StreamingResponse(iter_text(str(abs_path)), media_type="text/plain; charset=utf-8", headers=headers)
 
 
 # ---------- v0.3: BASIC GIT ACTIONS ----------
@@ -278,6 +1059,8 @@ def git_push(payload: Dict[str, str] = Body(default={})):
 def apply_changes(payload: Dict[str, Any] = Body(...)):
     """
     payload = { "files": [{ "path": "...", "code": "..." }], "dry_run": bool }
+    All files are written or none are; ones already holding `code` are left alone ("unchanged").
+    Overwritten files are backed up under the returned run_id (POST /revert {"run_id"} undoes the run).
     """
     _ensure_repo()
     files = payload.get("files")
@@ -286,10 +1069,8 @@ def apply_changes(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(400, "files array required")
 
     repo = Path(STATE["repo_root"])
-    backup_root = repo / ".devpilot_backups"
-    backup_root.mkdir(exist_ok=True)
-
     written: List[str] = []
+    txn = None if dry else _transaction(repo)  # a preview touches neither the backup store nor journals
     for f in files:
         rel = f.get("path")
         code = f.get("code")
@@ -300,57 +1081,113 @@ def apply_changes(payload: Dict[str, Any] = Body(...)):
         if rel_path.is_absolute() or ".." in rel_path.parts:
             raise HTTPException(400, f"invalid path: {rel}")
 
-        abs_path = repo / rel_path
-        if dry:
+        if txn is None:
             # just preview; no write
             written.append(rel_path.as_posix())
             continue
 
-        abs_path.parent.mkdir(parents=True, exist_ok=True)
+        data, posix = code.encode("utf-8"), rel_path.as_posix()
+        try:  # the disk hash lets the backup hardlink the original instead of reading it
+            txn.stage(posix, data, _hash_cache().file_hash(str(repo / rel_path), posix), hash_bytes(data))
+        except TransactionError as e:
+            raise HTTPException(400, f"{e} (no files were changed)")
 
-        if abs_path.exists():
-            backup_path = backup_root / (rel_path.as_posix() + ".bak")
-            backup_path.parent.mkdir(parents=True, exist_ok=True)
-            if not backup_path.exists():
-                shutil.copyfile(abs_path, backup_path)
-
-        abs_path.write_text(code, encoding="utf-8")
-        written.append(rel_path.as_posix())
-
-    if not dry:
-        STATE["snapshot"] = build_snapshot(repo)
+    if txn is not None:
+        written = _commit(txn)
+        _refresh_snapshot(written)
 
-    return {"ok": True, "written": written, "dry_run": dry}
+    return {"ok": True, "written": written, "unchanged": txn.unchanged if txn else [], "dry_run": dry,
+            "run_id": txn.id if txn and written else None}
 
 # ---------- v0.4: REVERT from backups ----------
 @app.post("/revert")
 def revert_files(payload: Dict[str, Any] = Body(...)):
     """
-    payload = { "paths": ["rel/path.tsx", ...] }
-    Restores from .devpilot_backups/<path>.bak if present.
+    payload = { "run_id": "...", "paths": ["rel/path.tsx", ...] }
+    run_id: put back every file that apply run wrote (files it created are deleted); paths narrows it.
+    paths alone: each file goes back to what it was before the latest run that wrote it.
+    All or nothing; the revert is itself a run, so it can be reverted too.
     """
     _ensure_repo()
     repo = Path(STATE["repo_root"])
-    backup_root = repo / ".devpilot_backups"
-    paths = payload.get("paths") or []
-    if not isinstance(paths, list) or not paths:
-        raise HTTPException(400, "paths array required")
-
-    restored: List[str] = []
-    for rel in paths:
-        rel_path = Path(rel)
-        if rel_path.is_absolute() or ".." in rel_path.parts:
+    run_id = payload.get("run_id")
+    paths = payload.get("paths")
+    if paths is not None and not isinstance(paths, list):
+        raise HTTPException(400, "paths must be an array")
+    if not run_id and not paths:
+        raise HTTPException(400, "run_id or paths required")
+    for rel in paths or []:
+        if not isinstance(rel, str) or Path(rel).is_absolute() or ".." in Path(rel).parts:
             raise HTTPException(400, f"invalid path: {rel}")
-        src = backup_root / (rel_path.as_posix() + ".bak")
-        dst = repo / rel_path
-        if not src.exists():
-            continue
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copyfile(src, dst)
-        restored.append(rel_path.as_posix())
 
-    STATE["snapshot"] = build_snapshot(repo)
-    return {"ok": True, "restored": restored}
+    store = _backup_store()
+    if run_id:
+        manifest = store.manifest(run_id)
+        if manifest is None: raise HTTPException(404, f"no backup run {run_id}")
+        wanted = {Path(p).as_posix() for p in paths} if paths else None
+        targets = {rel: h for rel, h in manifest["files"].items() if wanted is None or rel in wanted}
+    else:
+        targets = {}
+        for rel in paths:
+            hit = store.latest(Path(rel).as_posix())
+            if hit is not None:
+                targets[Path(rel).as_posix()] = hit[1]
+
+    txn = _transaction(repo)
+    deleted = []
+    try:
+        for rel, digest in targets.items():
+            if Path(rel).is_absolute() or ".." in Path(rel).parts: continue
+            if digest is None:
+                if txn.stage_delete(rel): deleted.append(rel)
+            else:
+                txn.stage(rel, store.get(digest), data_hash=digest)
+    except (BackupError, TransactionError) as e:
+        raise HTTPException(500, f"{e} (no files were changed)")
+
+    changed = _commit(txn, "revert", {"reverts": run_id} if run_id else None)
+    _refresh_snapshot(changed)
+    return {"ok": True, "restored": [p for p in changed if p not in deleted], "deleted": [p for p in changed if p in deleted],
+            "unchanged": txn.unchanged, "missing": [p for p in (paths or []) if Path(p).as_posix() not in targets],
+            "run_id": txn.id if changed else None}
+
+@app.get("/backups")
+def list_backups(limit: int = Query(50, ge=1, le=1000)):
+    """Apply runs with backups, newest first: [{id, kind, created, files}], plus store stats."""
+    _ensure_repo()
+    store = _backup_store()
+    runs = [{"id": m["id"], "kind": m.get("kind"), "created": m.get("created"), "files": len(m["files"]),
+             **({"reverts": m["reverts"]} if m.get("reverts") else {})} for m in store.manifests()[:limit]]
+    return {"ok": True, "runs": runs, "stats": store.stats()}
+
+@app.get("/backups/{run_id}")
+def get_backup_run(run_id: str):
+    """One run's manifest: files maps each path to the hash of its previous content (null = created by the run)."""
+    _ensure_repo()
+    manifest = _backup_store().manifest(run_id)
+    if manifest is None: raise HTTPException(404, f"no backup run {run_id}")
+    return {"ok": True, "run": manifest}
+
+@app.post("/backups/gc")
+def backups_gc(payload: Dict[str, Any] = Body(default={})):
+    """
+    payload = { "max_age_days": 30, "max_mb": 1024, "keep_runs": 10 }   # each defaults to settings.backups
+    Drops runs past the age, then the oldest while the backups exceed max_mb, then unreferenced blobs.
+    """
+    _ensure_repo()
+    limits: Dict[str, Any] = {}
+    for k in ("max_age_days", "max_mb", "keep_runs"):
+        v = payload.get(k)
+        if v is None:
+            continue
+        try:
+            num = float(v) if not isinstance(v, bool) else float("nan")
+        except (TypeError, ValueError):
+            num = float("nan")
+        if not 0 <= num < float("inf"):  # also rejects nan
+            raise HTTPException(400, f"{k} must be a non-negative number")
+        limits[k] = int(num) if k == "keep_runs" else num
+    return {"ok": True, **(_backups_gc(_backup_store(), force=True, **limits) or {})}
 
 # ---------- v0.4: CREATE PR (GitHub) ----------
 @app.post("/git/create-pr")
@@ -382,12 +1219,8 @@ def git_create_pr(payload: Dict[str, str] = Body(...)):
     if not base:
         base = g.default_branch()
 
-    url = f"https://api.github.com/repos/{slug}/pulls"
-    resp = requests.post(
-        url,
-        headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json"},
-        json={"title": title, "body": body, "head": head, "base": base}
-    )
+    url = f"{GITHUB_API}/repos/{slug}/pulls"
+    resp = CLIENTS.github(token).post(url, json={"title": title, "body": body, "head": head, "base": base})
     if resp.status_code >= 300:
         raise HTTPException(resp.status_code, f"GitHub PR create failed: {resp.text}")
 
@@ -455,11 +1288,8 @@ def git_close_pr(payload: Dict[str, Any] = Body(...)):
     if not slug:
         raise HTTPException(400, "Could not infer repo slug; pass payload.slug")
 
-    url = f"https://api.github.com/repos/{slug}/pulls/{number}"
-    resp = requests.patch(url, headers={
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json"
-    }, json={"state": "closed"})
+    url = f"{GITHUB_API}/repos/{slug}/pulls/{number}"
+    resp = CLIENTS.github(token).patch(url, json={"state": "closed"})
     if resp.status_code >= 300:
         raise HTTPException(resp.status_code, f"Close PR failed: {resp.text}")
     return {"ok": True, "pr": resp.json()}
@@ -511,12 +1341,8 @@ def git_revert_pr(payload: Dict[str, Any] = Body(...)):
     if not slug:
         raise HTTPException(400, "Could not infer repo slug from remote")
 
-    url = f"https://api.github.com/repos/{slug}/pulls"
-    resp = requests.post(
-        url,
-        headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json"},
-        json={"title": title, "body": body, "head": branch, "base": base}
-    )
+    url = f"{GITHUB_API}/repos/{slug}/pulls"
+    resp = CLIENTS.github(token).post(url, json={"title": title, "body": body, "head": branch, "base": base})
     if resp.status_code >= 300:
         raise HTTPException(resp.status_code, f"GitHub PR create failed: {resp.text}")
 
@@ -533,7 +1359,7 @@ def set_settings(payload: Dict[str, Any] = Body(...)):
         tel["enabled"] = bool(payload["telemetry"].get("enabled", tel["enabled"]))
     if "ai" in payload and isinstance(payload["ai"], dict):
         s_ai = s["ai"]
-        for k in ["mode", "provider", "openai_key", "http_endpoint", "model"]:
+        for k in ["mode", "provider", "openai_key", "http_endpoint", "model", "context_budget", "batch_concurrency", "rate_limits", "edit_format", "routing"]:
             if k in payload["ai"]:
                 s_ai[k] = payload["ai"][k]
     save_settings(STATE["settings"])
@@ -565,8 +1391,8 @@ def git_list_prs(remote: str = "origin", state: str = "open"):
     if not slug:
         raise HTTPException(400, "Could not infer repo slug; set settings.slug_override")
 
-    url = f"https://api.github.com/repos/{slug}/pulls?state={state}"
-    resp = requests.get(url, headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json"})
+    url = f"{GITHUB_API}/repos/{slug}/pulls?state={state}"
+    resp = CLIENTS.github(token).get(url)
     if resp.status_code >= 300:
         raise HTTPException(resp.status_code, f"List PRs failed: {resp.text}")
     return {"ok": True, "prs": resp.json()}
@@ -585,56 +1411,157 @@ def apply_plan(payload: Dict[str, Any] = Body(...)):
     payload = {
       "files": [
         { "path": "...", "code": "...", "expected_current": "..." }  # expected_current optional
-      ]
-    }
+      ]                                                           # (or "expected_hash": "<blake2b>")
+    }                                         # "edits": [{search, replace}] or "diff" may stand in for "code"
     Returns a plan with create/update/unchanged/conflict and diffs.
+    Content hashes short-circuit no-op files without reading them when the hash is cached.
     """
     _ensure_repo()
     repo = Path(STATE["repo_root"])
     items = payload.get("files")
     if not isinstance(items, list): raise HTTPException(400, "files array required")
 
-    plan = {"create": [], "update": [], "unchanged": [], "conflict": [], "summary": {}}
+    results: list[Any] = [None] * len(items)
+    with read_scope():
+        for i, kind, entry in _plan_iter(repo, items):
+            results[i] = (kind, entry)
+    return {"ok": True, "plan": _plan_merge(results)}
+
+@app.post("/apply/plan/stream")
+def apply_plan_stream(payload: Dict[str, Any] = Body(...)):
+    """
+    /apply/plan (same payload) as text/event-stream:
+      start  {files}
+      entry  {index, kind, entry}     # as each file's plan is ready (completion order, index = input position)
+      done   {plan}                   # same as /apply/plan's, in input order
+    """
+    _ensure_repo()
+    repo = Path(STATE["repo_root"])
+    items = payload.get("files")
+    if not isinstance(items, list): raise HTTPException(400, "files array required")
     for f in items:
-        rel = f.get("path"); new_code = f.get("code", "")
+        rel = f.get("path") if isinstance(f, dict) else None
         if not rel: raise HTTPException(400, "each file needs path")
-        relp = Path(rel)
-        if relp.is_absolute() or ".." in relp.parts: raise HTTPException(400, f"invalid path: {rel}")
+        if Path(rel).is_absolute() or ".." in Path(rel).parts: raise HTTPException(400, f"invalid path: {rel}")
 
-        abs_p = repo / relp
-        exists = abs_p.exists()
+    def events() -> Iterator[Dict[str, Any]]:
+        results: list[Any] = [None] * len(items)
+        it = _plan_iter(repo, items)
+        try:
+            yield {"type": "start", "files": len(items)}
+            for i, kind, entry in it:
+                results[i] = (kind, entry)
+                yield {"type": "entry", "index": i, "kind": kind, "entry": entry}
+            yield {"type": "done", "plan": _plan_merge(results)}
+        except HTTPException as e:
+            yield {"type": "error", "detail": e.detail}
+        finally:
+            it.close()
+    return StreamingResponse(_sse(events()), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _plan_one(repo: Path, f: Dict[str, Any]) -> tuple[str, Dict[str, Any]]:
+    """(bucket, entry) for one proposed file, bucket being create / update / unchanged / conflict."""
+    bucket, entry = _plan_input(repo, f)
+    return (bucket, entry) if bucket else plan_entry(entry, _diff_engine())
+
+def _plan_input(repo: Path, f: Dict[str, Any]) -> tuple[str | None, Dict[str, Any]]:
+    """
+    The disk side of planning one file: (bucket, entry) when no diff is needed, else
+    (None, work) for plan_entry, which only diffs and so can run in a pool worker.
+    """
+    if is_edit(f):
+        try:
+            f = _expand_edit(repo, f)
+        except EditError as e:
+            return "conflict", {"path": f.get("path"), "error": f"edit does not apply: {e}"}
+    rel = f.get("path"); new_code = f.get("code", "")
+    if not rel: raise HTTPException(400, "each file needs path")
+    relp = Path(rel)
+    if relp.is_absolute() or ".." in relp.parts: raise HTTPException(400, f"invalid path: {rel}")
+
+    abs_p = repo / relp
+    expected = f.get("expected_current", None)
+
+    if not abs_p.exists():
+        return None, {"kind": "create", "path": rel, "new": new_code}
+
+    disk_hash, current = _hashed_current(abs_p, relp.as_posix())
+    if disk_hash is not None and disk_hash == hash_text(new_code):
+        return "unchanged", {"path": rel, "hash": disk_hash}
+    if current is None:
         current = _read_file_text(abs_p)
-        expected = f.get("expected_current", None)
-
-        if not exists:
-            plan["create"].append({"path": rel, "diff": list(difflib.unified_diff([], new_code.splitlines(), lineterm=""))})
-            continue
+    if current == new_code:
+        return "unchanged", {"path": rel, "hash": disk_hash}
 
-        if current == new_code:
-            plan["unchanged"].append({"path": rel})
-            continue
+    # conflict detection: if expected_current provided and doesn't match disk, we flag conflict
+    kind = "conflict" if _expected_mismatch(f, disk_hash, lambda: current) else "update"
+    return None, {"kind": kind, "path": rel, "hash": disk_hash, "current": current, "new": new_code,
+                  "expected": expected if kind == "conflict" else None}
 
-        # conflict detection: if expected_current provided and doesn't match disk, we flag conflict
-        if expected is not None and expected != current:
-            diff_a = list(difflib.unified_diff(expected.splitlines(), current.splitlines(), fromfile="expected", tofile="current", lineterm=""))
-            diff_b = list(difflib.unified_diff(current.splitlines(), new_code.splitlines(), fromfile="current", tofile="proposed", lineterm=""))
-            plan["conflict"].append({"path": rel, "diff_expected_vs_current": diff_a, "diff_current_vs_proposed": diff_b})
+def _plan_iter(repo: Path, items: list[Any]) -> Iterator[tuple[int, str, Dict[str, Any]]]:
+    """
+    (index, bucket, entry) for every file, in completion order. Payloads of at least
+    plan.parallel_min_files are read on a thread pool and diffed on the plan process pool.
+    """
+    if len(items) < int((STATE["settings"].get("plan") or {}).get("parallel_min_files", 50)):
+        for i, f in enumerate(items):
+            yield (i, *_plan_one(repo, f))
+        return
+    contents = current_contents() or FileContents()
+
+    def prepare(f: Any) -> tuple[str | None, Dict[str, Any]]:
+        with read_scope(contents):  # pool threads don't inherit the caller's context
+            return _plan_input(repo, f)
+    with ThreadPoolExecutor(max_workers=min(32, len(items)), thread_name_prefix="plan-read") as ex:
+        prepared = list(ex.map(prepare, items))
+    work = []
+    for i, (bucket, entry) in enumerate(prepared):
+        if bucket:
+            yield i, bucket, entry
         else:
-            # normal update
-            diff = list(difflib.unified_diff(current.splitlines(), new_code.splitlines(), fromfile="current", tofile="proposed", lineterm=""))
-            plan["update"].append({"path": rel, "diff": diff})
-
+            work.append((i, entry))
+    yield from _plan_pool().run(work, _diff_settings())
+
+def _plan_merge(results: list[Any]) -> Dict[str, Any]:
+    """Plan buckets from (bucket, entry) results in input order."""
+    plan: Dict[str, Any] = {"create": [], "update": [], "unchanged": [], "conflict": [], "summary": {}}
+    for kind, entry in results:
+        plan[kind].append(entry)
     plan["summary"] = {k: len(plan[k]) for k in ["create","update","unchanged","conflict"]}
-    return {"ok": True, "plan": plan}
+    return plan
+
+def _expand_edit(repo: Path, f: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Full-file form of an `edits` / `diff` entry, applied to the file as it is on disk now.
+    The result carries expected_hash of that text, so a file changing between plan and
+    apply is still caught as a conflict. Raises EditError when the edits don't apply.
+    """
+    rel = f.get("path")
+    if not rel: raise HTTPException(400, "each file needs path")
+    relp = Path(rel)
+    if relp.is_absolute() or ".." in relp.parts: raise HTTPException(400, f"invalid path: {rel}")
+    abs_p = repo / relp
+    current = _read_file_text(abs_p) if abs_p.exists() else ""
+    code, fmt = apply_edit(current, f)
+    out = {k: v for k, v in f.items() if k not in ("edits", "diff")}
+    out.update(code=code, edit_format=fmt)
+    if abs_p.exists() and "expected_current" not in f and "expected_hash" not in f:
+        out["expected_hash"] = hash_text(current)
+    return out
 
 # strengthen /apply to optionally enforce expected_current unless force=true
 @app.post("/apply/strict")
 def apply_strict(payload: Dict[str, Any] = Body(...)):
     """
     payload = {
-      "files": [{ "path": "...", "code": "...", "expected_current": "...", "force": bool }],
+      "files": [{ "path": "...", "code": "...", "expected_current": "...", "force": bool }],  # or "expected_hash"
       "force": false  # global fallback
     }
+    Files whose content hash already matches `code` are not rewritten (listed in "unchanged").
+    Edit-form entries ("edits" / "diff") are applied to the current file; ones that don't apply are conflicts.
+    The files to write are replaced together at the end; if any write fails, none of them change.
+    Overwritten files are backed up under the returned run_id (POST /revert {"run_id"} undoes the run).
     """
     _ensure_repo()
     repo = Path(STATE["repo_root"])
@@ -642,41 +1569,52 @@ def apply_strict(payload: Dict[str, Any] = Body(...)):
     items = payload.get("files") or []
     if not isinstance(items, list): raise HTTPException(400, "files array required")
 
-    backup_root = repo / ".devpilot_backups"
-    backup_root.mkdir(exist_ok=True)
-    written, conflicts = [], []
-
-    for f in items:
-        rel = f.get("path"); code = f.get("code", ""); expected = f.get("expected_current")
-        local_force = bool(f.get("force", False)) or global_force
-        if not rel: raise HTTPException(400, "each file needs path")
-        relp = Path(rel)
-        if relp.is_absolute() or ".." in relp.parts: raise HTTPException(400, f"invalid path: {rel}")
-
-        abs_p = repo / relp
-        disk = _read_file_text(abs_p)
-
-        if expected is not None and expected != disk and not local_force:
-            conflicts.append(relp.as_posix()); continue
-
-        abs_p.parent.mkdir(parents=True, exist_ok=True)
-        if abs_p.exists():
-            backup = backup_root / (relp.as_posix() + ".bak")
-            backup.parent.mkdir(parents=True, exist_ok=True)
-            if not backup.exists():
-                shutil.copyfile(abs_p, backup)
-        abs_p.write_text(code, encoding="utf-8")
-        written.append(relp.as_posix())
+    written, conflicts, unchanged = [], [], []
+    txn = _transaction(repo)
+
+    with read_scope() as contents:
+        for f in items:
+            rel = f.get("path"); code = f.get("code", "")
+            local_force = bool(f.get("force", False)) or global_force
+            if not rel: raise HTTPException(400, "each file needs path")
+            relp = Path(rel)
+            if relp.is_absolute() or ".." in relp.parts: raise HTTPException(400, f"invalid path: {rel}")
+            if is_edit(f):
+                try:
+                    f = _expand_edit(repo, f); code = f["code"]
+                except EditError:
+                    conflicts.append(relp.as_posix()); continue
+
+            abs_p = repo / relp
+            disk_hash, disk = _hashed_current(abs_p, relp.as_posix()) if abs_p.exists() else (None, "")
+            read_disk = lambda: disk if disk is not None else _read_file_text(abs_p)
+
+            if not local_force and _expected_mismatch(f, disk_hash, read_disk):
+                conflicts.append(relp.as_posix()); continue
+            code_hash = hash_text(code)
+            if disk_hash is not None and disk_hash == code_hash:
+                unchanged.append(relp.as_posix()); continue
+
+            if not local_force and contents.changed(str(abs_p)):
+                conflicts.append(relp.as_posix()); continue  # changed on disk since it was checked
+            try:
+                txn.stage(relp.as_posix(), code.encode("utf-8"), disk_hash, code_hash)
+            except TransactionError as e:
+                raise HTTPException(400, f"{e} (no files were changed)")
+            contents.forget(str(abs_p))
 
-    STATE["snapshot"] = build_snapshot(repo)
-    return {"ok": True, "written": written, "conflicts": conflicts, "forced": global_force or any(f.get("force") for f in items)}
+    written = _commit(txn, "strict")
+    _refresh_snapshot(written)
+    return {"ok": True, "written": written, "conflicts": conflicts, "unchanged": unchanged, "forced": global_force or any(f.get("force") for f in items),
+            "run_id": txn.id if written else None}
 
 
 @app.post("/apply/plan3")
 def apply_plan3(payload: Dict[str, Any] = Body(...)):
     """
     payload.files: [{ path, code, expected_current? }]
-    Returns minimal 3-way context for UI (only for files that exist or conflict)
+    Returns minimal 3-way context for UI (only for files that exist or conflict),
+    plus the current -> proposed diff (diff_summary instead when it is too large to render)
     """
     _ensure_repo()
     repo = Path(STATE["repo_root"])
@@ -691,12 +1629,12 @@ def apply_plan3(payload: Dict[str, Any] = Body(...)):
         if relp.is_absolute() or ".." in relp.parts: raise HTTPException(400, f"invalid path: {rel}")
         abs_p = repo / relp
         current = _read_file_text(abs_p)
-        out.append({
+        out.append(_diff_into({
             "path": rel,
             "expected": expected if expected is not None else current,  # fallback so 3 panes are always filled
             "current": current,
             "proposed": proposed
-        })
+        }, "diff", current, proposed, "current", "proposed"))
     return {"ok": True, "threeway": out}
 
 @app.post("/hooks/run")
@@ -715,10 +1653,11 @@ def run_hooks(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(400, "commands array required")
 
     logs = []
-    for cmd in cmds:
+    for i, cmd in enumerate(cmds):
         logs.append(f"$ {cmd}")
+        job_emit({"type": "command", "index": i, "command": cmd})
         try:
-            p = subprocess.run(cmd, cwd=str(repo), shell=True, text=True, capture_output=True, timeout=timeout)
+            p = run_command(cmd, cwd=str(repo), shell=True, text=True, timeout=timeout)
             if p.stdout: logs.append(p.stdout.strip())
             if p.stderr: logs.append(p.stderr.strip())
             if p.returncode != 0:
@@ -769,9 +1708,10 @@ def run_targeted_hooks(payload: Dict[str, Any] = Body(...)):
 
     commands = _guess_test_commands(paths)
     logs = []
-    for cmd in commands:
+    for i, cmd in enumerate(commands):
         logs.append(f"$ {cmd}")
-        p = subprocess.run(cmd, cwd=str(repo), shell=True, text=True, capture_output=True, timeout=timeout)
+        job_emit({"type": "command", "index": i, "command": cmd})
+        p = run_command(cmd, cwd=str(repo), shell=True, text=True, timeout=timeout)
         if p.stdout: logs.append(p.stdout.strip())
         if p.stderr: logs.append(p.stderr.strip())
         if p.returncode != 0:
@@ -783,7 +1723,7 @@ def _openai_client() -> OpenAI:
     key = STATE["settings"]["ai"].get("openai_key")
     if not key:
         raise HTTPException(400, "OpenAI key not set in settings.ai.openai_key")
-    return OpenAI(api_key=key)
+    return CLIENTS.openai(key)
 
 @app.post("/ai/complete")
 def ai_complete(payload: Dict[str, Any] = Body(...)):
@@ -814,7 +1754,7 @@ def session_export(payload: Dict[str, Any] = Body(default={})):
         "version": "0.9.0",
         "settings": STATE["settings"],
         "repo_root": STATE["repo_root"],
-        "snapshot": STATE["snapshot"] if include_snapshot else {},
+        "snapshot": _snapshot_copy() if include_snapshot else {},
     }
     return {"ok": True, "session": data}
 
@@ -827,67 +1767,566 @@ def session_import(payload: Dict[str, Any] = Body(...)):
     if "settings" in sess and isinstance(sess["settings"], dict):
         STATE["settings"] = sess["settings"]
     if "snapshot" in sess and isinstance(sess["snapshot"], dict):
-        STATE["snapshot"] = sess["snapshot"]
+        STATE["snapshot"] = SnapshotStore(sess["snapshot"])
     return {"ok": True, "settings": STATE["settings"], "snapshot_len": len(STATE["snapshot"])}
 
+def _pack_context(task: str, budget: int, include: List[str] | None = None, max_files: int = 20,
+                  slices: bool = True) -> Dict[str, Any]:
+    if include is not None and (not isinstance(include, list) or not all(isinstance(p, str) for p in include)):
+        raise HTTPException(400, "include must be a list of paths")
+    for rel in include or []:
+        if Path(rel).is_absolute() or ".." in Path(rel).parts: raise HTTPException(400, f"invalid path: {rel}")
+    _snapshot_engine()
+    idx = STATE["context_index"]
+    res = pack(idx, task, budget, include=include or [], max_files=max_files,
+               slicer=symbol_slicer(STATE["symbol_index"]) if slices else None)
+    res["totals"]["indexed"] = idx.ready
+    return res
+
+@app.post("/context/pack")
+def context_pack(payload: Dict[str, Any] = Body(...)):
+    """
+    payload = {
+      "task": "...",          # what the change is about; ranks files with BM25
+      "budget": 8000,         # optional: token budget (default: settings ai.context_budget)
+      "include": ["a.py"],    # optional: always packed first (e.g. the selected file)
+      "max_files": 20,        # optional
+      "slices": true          # optional: fall back to matching functions/classes when a file is too big
+    }
+    Returns the packed items (path, kind file|slice, tokens, score), skipped files,
+    token totals and the rendered context block.
+    """
+    _ensure_repo()
+    task = payload.get("task")
+    if not task:
+        raise HTTPException(400, "task required")
+    try:
+        budget = int(payload.get("budget") or STATE["settings"]["ai"].get("context_budget") or 8000)
+        max_files = int(payload.get("max_files") or 20)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "budget and max_files must be integers")
+    if budget < 1 or max_files < 1:
+        raise HTTPException(400, "budget and max_files must be positive")
+    res = _pack_context(task, budget, payload.get("include"), max_files, bool(payload.get("slices", True)))
+    context = render_context(res["items"])
+    items = [{k: v for k, v in it.items() if k != "content"} for it in res["items"]]
+    return {"ok": True, "items": items, "skipped": res["skipped"], "totals": res["totals"], "context": context}
+
+def _autopatch_prompt(payload: Dict[str, Any]) -> tuple[str, Dict[str, Any] | None]:
+    """The /autopatch prompt, with the edit-format instructions and packed repo context appended as asked."""
+    prompt = payload.get("prompt")
+    if not prompt: raise HTTPException(400, "prompt required")
+    fmt = payload.get("edit_format") or STATE["settings"]["ai"].get("edit_format") or "full"
+    if fmt not in ("full", "edits"): raise HTTPException(400, "edit_format must be full or edits")
+    if fmt == "edits":
+        prompt = prompt + "\n\n" + EDIT_INSTRUCTIONS
+    if not payload.get("context_budget"):
+        return prompt, None
+    try:
+        budget = int(payload["context_budget"])
+    except (TypeError, ValueError):
+        raise HTTPException(400, "context_budget must be an integer")
+    packed = _pack_context(payload.get("task") or prompt, budget, payload.get("include"))
+    if packed["items"]:
+        prompt = prompt + "\n\n### Repository context\n\n" + render_context(packed["items"])
+    return prompt, {"items": [{k: v for k, v in it.items() if k != "content"} for it in packed["items"]],
+                    "totals": packed["totals"]}
+
+def _edit_fallback(prompt: str, failed: Dict[str, str], cache: str) -> Dict[str, Dict[str, Any]]:
+    """Ask again, in full-file form, for the files whose edits did not apply (path -> error)."""
+    retry = (prompt + "\n\n### Retry\nYour edits for these files did not apply to the current contents:\n"
+             + "\n".join(f"- {p}: {err}" for p, err in failed.items())
+             + '\nReturn ONLY these files, each with the FULL new file content in "code" (no edits or diff).')
+    got = {f.get("path"): f for f in _mux_complete(retry, cache=cache)["files"]
+           if isinstance(f, dict) and isinstance(f.get("code"), str)}
+    missing = [p for p in failed if p not in got]
+    if missing:
+        raise HTTPException(422, f"edits did not apply and no full file came back for: {', '.join(missing)}")
+    return {p: {**got[p], "edit_format": "full-fallback", "edit_error": failed[p]} for p in failed}
+
+def _pinned(f: Dict[str, Any]) -> Dict[str, Any]:
+    """The expected_hash an expanded edit was applied against, for apply_strict."""
+    return {"expected_hash": f["expected_hash"]} if "expected_hash" in f else {}
+
+def _resolve_edits(files: list[Any], prompt: str, cache: str) -> list[Any]:
+    """files[] with edit-form entries expanded to full code; ones that don't apply go through _edit_fallback."""
+    repo = Path(STATE["repo_root"])
+    out, failed = [], {}
+    for f in files:
+        if isinstance(f, dict) and is_edit(f):
+            try:
+                f = _expand_edit(repo, f)
+            except EditError as e:
+                failed[f.get("path")] = str(e)
+        out.append(f)
+    if failed:
+        full = _edit_fallback(prompt, failed, cache)
+        out = [full[f.get("path")] if isinstance(f, dict) and is_edit(f) else f for f in out]
+    return out
+
 @app.post("/autopatch")
 def autopatch(payload: Dict[str, Any] = Body(...)):
     """
     payload = {
       "prompt": "...",                 # full prompt built by UI
       "dry_run": True,                 # preview only
-      "force": False                   # override conflicts
+      "force": False,                  # override conflicts
+      "context_budget": 8000,          # optional: append BM25-packed repo context up to this many tokens
+      "task": "...",                   # optional: what to rank context by (default: the prompt)
+      "include": ["a.py"],             # optional: files always packed first
+      "cache": "use",                  # optional: use | bypass | refresh (completion cache)
+      "edit_format": "edits"           # optional: let the model answer with edits / diff hunks (default settings ai.edit_format)
     }
+    Edit-form answers are applied to the current files; any that don't apply are asked for again in full.
     """
     _ensure_repo()
     s = STATE["settings"]
     tel = s["telemetry"]
     dry = bool(payload.get("dry_run", True))
     force = bool(payload.get("force", False))
-    prompt = payload.get("prompt")
-    if not prompt: raise HTTPException(400, "prompt required")
+    prompt, context = _autopatch_prompt(payload)
+
+    # call model (a dry run followed by the same apply is answered from the completion cache)
+    cache = _cache_mode(payload)
+    result = _mux_complete(prompt, cache=cache)
 
-    # call model
-    result = _mux_complete(prompt)
-    files = result["files"]
+    # one read per file from here on: edits, plan and apply share the request's file contents
+    with read_scope():
+        files = _resolve_edits(result["files"], prompt, cache)
 
-    # plan
-    plan_res = apply_plan({"files":[{"path":f["path"],"code":f["code"],"expected_current":_read_file_text(Path(STATE["repo_root"])/f["path"])} for f in files]})  # type: ignore
-    plan = plan_res["plan"]
+        # plan (edit-form files already carry expected_hash of the text their edits were applied to);
+        # apply is pinned to the same text, so a file changing in between is a conflict
+        pins = [_pinned(f) or {"expected_current": _read_file_text(Path(STATE["repo_root"])/f["path"])} for f in files]
+        plan_res = apply_plan({"files":[{"path":f["path"],"code":f["code"],**pin} for f, pin in zip(files, pins)]})  # type: ignore
+        plan = plan_res["plan"]
 
-    if dry:
-        if tel["enabled"]: tel["runs"] += 1
-        return {"ok": True, "plan": plan, "files": files, "applied": False}
+        if dry:
+            if tel["enabled"]: tel["runs"] += 1
+            return {"ok": True, "plan": plan, "files": files, "applied": False, "context": context, "cached": result["cached"]}
 
-    # apply strict
-    strict_res = apply_strict({"files":[{"path":f["path"],"code":f["code"],"expected_current":_read_file_text(Path(STATE["repo_root"])/f["path"]), "force": force} for f in files], "force": force})
+        # apply strict
+        strict_res = apply_strict({"files":[{"path":f["path"],"code":f["code"],**pin, "force": force} for f, pin in zip(files, pins)], "force": force})
     if tel["enabled"]:
         tel["runs"] += 1
         tel["applied_files"] += len(strict_res.get("written", []))
-    return {"ok": True, "plan": plan, "files": files, "applied": True, "strict": strict_res}
+    return {"ok": True, "plan": plan, "files": files, "applied": True, "strict": strict_res, "context": context,
+            "cached": result["cached"]}
+
+@app.post("/autopatch/stream")
+def autopatch_stream(payload: Dict[str, Any] = Body(...)):
+    """
+    /autopatch with a streamed completion (same payload), as text/event-stream:
+      start     {context}
+      progress  {chars}                       # while the model writes, at most 4/s
+      file      {index, file, kind, plan}     # as soon as each files[] object closes; kind is the
+                                              #   /apply/plan bucket, plan its entry (or {error})
+      done      {plan, files, applied, cached, strict?, timings: {first_file_ms, total_ms}}
+      error     {detail}
+    Nothing is written until the reply is complete (and only when dry_run is false).
+    """
+    _ensure_repo()
+    dry = bool(payload.get("dry_run", True))
+    force = bool(payload.get("force", False))
+    prompt, context = _autopatch_prompt(payload)
+    cache = _cache_mode(payload)
+    deltas = _mux_stream(prompt, cache=cache)
+    events = _autopatch_run(deltas, context, dry, force, cached=isinstance(deltas, list), prompt=prompt, cache=cache)
+    return StreamingResponse(_sse(events), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _sse(events: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    try:
+        for ev in events:
+            yield sse_frame(ev)
+    finally:
+        close = getattr(events, "close", None)
+        if close: close()  # client went away: stop the upstream completion too
+
+def _autopatch_run(deltas: Iterator[str], context: Dict[str, Any] | None, dry: bool, force: bool,
+                   cached: bool = False, prompt: str | None = None, cache: str = "use") -> Iterator[Dict[str, Any]]:
+    """The /autopatch/stream events as dicts (also drives autopatch jobs); prompt is needed for edit fallbacks."""
+    repo = Path(STATE["repo_root"])
+    tel = STATE["settings"]["telemetry"]
+    t0 = time.perf_counter()
+    parser, text, files = FilesStreamParser(), [], []
+    plan: Dict[str, Any] = {"create": [], "update": [], "unchanged": [], "conflict": [], "summary": {}}
+    timings: Dict[str, Any] = {"first_file_ms": None}
+    failed: Dict[str, str] = {}
+    contents = FileContents()  # entered per step: a scope can't stay open across the yields
+
+    def file_event(f: Any) -> Dict[str, Any]:
+        ev: Dict[str, Any] = {"type": "file", "index": len(files), "file": f}
+        try:
+            if not isinstance(f, dict): raise HTTPException(400, "files[] entries must be objects")
+            with read_scope(contents):
+                if is_edit(f):
+                    try:
+                        f = ev["file"] = _expand_edit(repo, f)
+                    except EditError as e:
+                        failed[f["path"]] = str(e)
+                        return {"type": "edit_failed", "path": f["path"], "error": str(e)}
+                ev["kind"], ev["plan"] = _plan_one(repo, f)
+            plan[ev["kind"]].append(ev["plan"])
+            files.append(f)
+        except HTTPException as e:
+            ev["kind"], ev["plan"] = "error", {"error": e.detail}
+        if timings["first_file_ms"] is None:
+            timings["first_file_ms"] = int((time.perf_counter() - t0) * 1000)
+        return ev
+
+    try:
+        yield {"type": "start", "context": context}
+        chars, last = 0, 0.0
+        for chunk in deltas:
+            text.append(chunk)
+            chars += len(chunk)
+            for f in parser.feed(chunk):
+                yield file_event(f)
+            now = time.perf_counter()
+            if now - last >= 0.25:
+                yield {"type": "progress", "chars": chars}
+                last = now
+        if not parser.count:
+            # no files[] array seen while streaming; parse the whole reply like _mux_complete
+            try:
+                whole = parse_files("".join(text))
+            except Exception as e:
+                yield {"type": "error", "detail": f"Model did not return valid JSON files[]: {e}"}
+                return
+            for f in whole:
+                yield file_event(f)
+        if failed:
+            if prompt is None:
+                yield {"type": "error", "detail": f"edits did not apply: {', '.join(failed)}"}
+                return
+            yield {"type": "progress", "chars": chars, "retrying": list(failed)}
+            for f in _edit_fallback(prompt, failed, cache).values():
+                yield file_event(f)
+
+        plan["summary"] = {k: len(plan[k]) for k in ["create","update","unchanged","conflict"]}
+        done: Dict[str, Any] = {"type": "done", "plan": plan, "files": files, "applied": False, "context": context,
+                                "cached": cached}
+        if not dry:
+            with read_scope(contents):
+                done["strict"] = apply_strict({"files": [{"path": f["path"], "code": f.get("code", ""), **_pinned(f), "force": force} for f in files], "force": force})
+            done["applied"] = True
+        if tel["enabled"]:
+            tel["runs"] += 1
+            tel["applied_files"] += len(done.get("strict", {}).get("written", []))
+        timings["total_ms"] = int((time.perf_counter() - t0) * 1000)
+        done["timings"] = timings
+        yield done
+    except Exception as e:
+        log(f"autopatch stream failed: {e}")
+        yield {"type": "error", "detail": getattr(e, "detail", None) or str(e)}
+    finally:
+        close = getattr(deltas, "close", None)
+        if close: close()
+
+MAX_BATCH_PROMPTS = 500
+
+def _batch_args(payload: Dict[str, Any]) -> tuple[list[Dict[str, Any]], int]:
+    """(per-prompt payloads, concurrency) for /autopatch/batch; shared options are folded into each prompt."""
+    prompts = payload.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        raise HTTPException(400, "prompts array required")
+    if len(prompts) > MAX_BATCH_PROMPTS:
+        raise HTTPException(400, f"at most {MAX_BATCH_PROMPTS} prompts per batch")
+    shared = {k: payload[k] for k in ("context_budget", "task", "include", "cache") if k in payload}
+    items = []
+    for p in prompts:
+        item = {"prompt": p} if isinstance(p, str) else p
+        if not isinstance(item, dict) or not item.get("prompt"):
+            raise HTTPException(400, "each prompt must be a string or an object with prompt")
+        items.append({**shared, **item})
+    try:
+        concurrency = int(payload.get("concurrency") or STATE["settings"]["ai"].get("batch_concurrency") or 4)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "concurrency must be an integer")
+    for item in items:
+        _cache_mode(item)
+    return items, max(1, min(concurrency, 32))
+
+def _autopatch_batch_run(items: list[Dict[str, Any]], concurrency: int, dry: bool, force: bool) -> Iterator[Dict[str, Any]]:
+    """
+    Events of one batch: `start`, a `result` per prompt as its completion lands (any order),
+    then `done` with the merged plan. Files proposed by several prompts with different
+    code are collisions: listed under plan.conflict and never applied.
+    """
+    repo = Path(STATE["repo_root"])
+    provider = STATE["settings"]["ai"].get("provider")
+    t0 = time.perf_counter()
+    results: list[Dict[str, Any]] = [{} for _ in items]
+
+    def one(item: Dict[str, Any]) -> tuple[Dict[str, Any], Any]:
+        prompt, context = _autopatch_prompt(item)
+        res = _mux_complete(prompt, cache=_cache_mode(item))
+        return {**res, "files": _resolve_edits(res["files"], prompt, _cache_mode(item))}, context
+
+    yield {"type": "start", "prompts": len(items), "concurrency": concurrency}
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="autopatch-batch")
+    futures = {pool.submit(contextvars.copy_context().run, one, item): i for i, item in enumerate(items)}
+    first_ms = None
+    try:
+        for n, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            try:
+                res, context = fut.result()
+                files = [f for f in res["files"] if isinstance(f, dict) and f.get("path")]
+                results[i] = {"index": i, "ok": True, "files": files, "cached": res["cached"], "context": context}
+                ev = {"type": "result", "index": i, "ok": True, "paths": [f["path"] for f in files], "cached": res["cached"]}
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e)
+                results[i] = {"index": i, "ok": False, "error": detail}
+                ev = {"type": "result", "index": i, "ok": False, "error": detail}
+            if first_ms is None:
+                first_ms = int((time.perf_counter() - t0) * 1000)
+            yield {**ev, "completed": n, "total": len(items)}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    # merge: identical proposals for a path collapse, differing ones collide
+    by_path: Dict[str, list[tuple[int, Dict[str, Any]]]] = {}
+    for r in results:
+        for f in r.get("files", []):
+            by_path.setdefault(f["path"], []).append((r["index"], f))
+    plan: Dict[str, Any] = {"create": [], "update": [], "unchanged": [], "conflict": [], "summary": {}}
+    files, collisions, errors = [], [], []
+    contents = FileContents()  # planned files are read once for plan and apply
+    for path, proposals in by_path.items():
+        prompts = [i for i, _ in proposals]
+        if len({f.get("code", "") for _, f in proposals}) == 1:
+            f = {"path": path, "code": proposals[0][1].get("code", ""), **_pinned(proposals[0][1]), "prompts": prompts}
+            try:
+                with read_scope(contents):
+                    kind, entry = _plan_one(repo, f)
+            except HTTPException as e:
+                errors.append({"path": path, "prompts": prompts, "error": e.detail}); continue
+            plan[kind].append({**entry, "prompts": prompts})
+            files.append(f)
+            continue
+        current = _read_file_text(repo / path) if not Path(path).is_absolute() and ".." not in Path(path).parts else ""
+        plan["conflict"].append({"path": path, "collision": prompts, "proposals": [
+            _diff_into({"prompt": i}, "diff", current, f.get("code", ""), "current", f"prompt {i}") for i, f in proposals]})
+        collisions.append({"path": path, "prompts": prompts})
+    plan["summary"] = {k: len(plan[k]) for k in ["create","update","unchanged","conflict"]}
+
+    done: Dict[str, Any] = {"type": "done", "plan": plan, "files": files, "collisions": collisions, "errors": errors,
+                            "results": [{k: v for k, v in r.items() if k != "files"} for r in results], "applied": False}
+    if not dry:
+        with read_scope(contents):
+            done["strict"] = apply_strict({"files": [{"path": f["path"], "code": f["code"], **_pinned(f), "force": force} for f in files], "force": force})
+        done["applied"] = True
+    tel = STATE["settings"]["telemetry"]
+    if tel["enabled"]:
+        tel["runs"] += len(items)
+        tel["applied_files"] += len(done.get("strict", {}).get("written", []))
+    bucket = _rate_bucket(provider) if provider else None
+    done["rate_limit"] = bucket.stats() if bucket is not None else None
+    done["timings"] = {"first_result_ms": first_ms, "total_ms": int((time.perf_counter() - t0) * 1000)}
+    yield done
+
+@app.post("/autopatch/batch")
+def autopatch_batch(payload: Dict[str, Any] = Body(...)):
+    """
+    payload = {
+      "prompts": ["...", {"prompt": "...", "task": "...", "include": [...]}],   # one /autopatch each
+      "concurrency": 4,     # optional (default settings ai.batch_concurrency), capped at 32
+      "dry_run": true, "force": false, "cache": "use", "context_budget": 0    # shared options
+    }
+    text/event-stream: start, result {index, ok, paths | error, completed, total} per prompt,
+    done {plan (merged; cross-prompt collisions under conflict), files, collisions, results, ...}.
+    Completions run concurrently and are rate limited per provider (settings ai.rate_limits).
+    """
+    _ensure_repo()
+    items, concurrency = _batch_args(payload)
+    events = _autopatch_batch_run(items, concurrency, bool(payload.get("dry_run", True)), bool(payload.get("force", False)))
+    return StreamingResponse(_sse(events), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------- background jobs ----------
+def _job_autopatch(job, payload: Dict[str, Any]) -> Dict[str, Any]:
+    _ensure_repo()
+    dry = bool(payload.get("dry_run", True))
+    force = bool(payload.get("force", False))
+    prompt, context = _autopatch_prompt(payload)
+    job.check()
+    cache = _cache_mode(payload)
+    deltas = _mux_stream(prompt, cache=cache)
+    events = _autopatch_run(deltas, context, dry, force, cached=isinstance(deltas, list), prompt=prompt, cache=cache)
+    try:
+        for ev in events:
+            job.check()  # cancelling closes the stream (and the upstream request) via finally
+            if ev["type"] == "done":
+                return {"ok": True, **{k: v for k, v in ev.items() if k != "type"}}
+            if ev["type"] == "error":
+                raise HTTPException(502, ev["detail"])
+            job.emit(ev)
+    finally:
+        events.close()
+    raise HTTPException(502, "completion ended without a result")
+
+def _job_autopatch_batch(job, payload: Dict[str, Any]) -> Dict[str, Any]:
+    _ensure_repo()
+    items, concurrency = _batch_args(payload)
+    events = _autopatch_batch_run(items, concurrency, bool(payload.get("dry_run", True)), bool(payload.get("force", False)))
+    try:
+        for ev in events:
+            job.check()
+            if ev["type"] == "done":
+                return {"ok": True, **{k: v for k, v in ev.items() if k != "type"}}
+            job.emit(ev)
+    finally:
+        events.close()
+    raise HTTPException(500, "batch ended without a result")
+
+JOB_KINDS: Dict[str, tuple[str, Callable[[Any, Dict[str, Any]], Any]]] = {
+    # kind: (lane, runner(job, payload)); payloads are those of the matching endpoint
+    "autopatch":     ("llm",   _job_autopatch),
+    "autopatch-batch": ("llm", _job_autopatch_batch),
+    "hooks":         ("hooks", lambda job, p: run_hooks(p)),
+    "hooks-targets": ("hooks", lambda job, p: run_targeted_hooks(p)),
+    "push":          ("git",   lambda job, p: git_push(p)),
+    "revert-pr":     ("git",   lambda job, p: git_revert_pr(p)),
+    "scan":          ("scan",  lambda job, p: repo_scan(p)),
+    "rescan":        ("scan",  lambda job, p: repo_rescan(bool(p.get("full", False)))),
+}
+
+@app.post("/jobs")
+async def job_submit(payload: Dict[str, Any] = Body(...)):
+    """
+    payload = { "kind": "autopatch" | "autopatch-batch" | "hooks" | "hooks-targets" | "push" | "revert-pr" | "scan" | "rescan",
+                "payload": {...} }   # same body as the matching endpoint
+    Returns the queued job at once; follow it with GET /jobs/{id} or GET /jobs/events.
+    """
+    kind = payload.get("kind")
+    if kind not in JOB_KINDS:
+        raise HTTPException(400, f"kind must be one of {', '.join(JOB_KINDS)}")
+    body = payload.get("payload") or {}
+    if not isinstance(body, dict):
+        raise HTTPException(400, "payload must be an object")
+    lane, runner = JOB_KINDS[kind]
+    try:
+        job = JOBS.submit(kind, lane, runner, body)
+    except JobRejected as e:
+        raise HTTPException(429, str(e))
+    return {"ok": True, "job": job.to_dict()}
+
+@app.get("/jobs")
+async def job_list(status: str | None = Query(None), kind: str | None = Query(None)):
+    return {"ok": True, "jobs": [j.to_dict(result=False) for j in JOBS.list(status, kind)], **JOBS.stats()}
+
+@app.get("/jobs/events")
+def job_events():
+    """Server-sent events: `job` on every status change, `progress` while a job runs (files, commands, chars)."""
+    q = JOBS.events.subscribe()
+    return StreamingResponse(JOBS.events.stream(q), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}")
+async def job_get(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "unknown job")
+    return {"ok": True, "job": job.to_dict()}
+
+@app.delete("/jobs/{job_id}")
+async def job_cancel(job_id: str):
+    job = JOBS.cancel(job_id)
+    if job is None:
+        raise HTTPException(404, "unknown job")
+    return {"ok": True, "job": job.to_dict(result=False)}
+
+@app.on_event("shutdown")
+def _cancel_jobs() -> None:
+    JOBS.shutdown()
+    ROUTER.shutdown()
+    if STATE.get("plan_pool"):
+        STATE["plan_pool"][1].shutdown()
 
 @app.get("/ignore")
 def get_ignore():
-    return {"ok": True, "patterns": STATE["settings"].get("ignore_patterns", [])}
+    eng = STATE.get("snapshot_engine")
+    # per-pattern exclusion counts (effective set: settings + .devpilotignore) from the last full scan
+    stats = eng.ignore_stats if eng is not None else []
+    return {"ok": True, "patterns": STATE["settings"].get("ignore_patterns", []), "stats": stats}
 
 @app.post("/ignore")
 def set_ignore(payload: Dict[str, Any] = Body(...)):
     pats = payload.get("patterns")
     if not isinstance(pats, list):
         raise HTTPException(400, "patterns must be an array of glob expressions")
+    old = STATE["settings"].get("ignore_patterns") or []
     STATE["settings"]["ignore_patterns"] = pats
     # refresh snapshot if repo loaded
     save_settings(STATE["settings"])
     if STATE["repo_root"]:
-        STATE["snapshot"] = build_snapshot(Path(STATE["repo_root"]))
+        _reapply_ignores(removed=bool(set(old) - set(pats)))
     return {"ok": True, "patterns": pats}
 
+def _reapply_ignores(removed: bool) -> None:
+    # only patterns that went away can re-include files we never listed -> rescan;
+    # pure additions just drop entries from the snapshot we already have
+    eng = _snapshot_engine()
+    if removed:
+        eng.full_scan()
+    else:
+        eng.prune_ignored()
+
+@app.get("/cache/snapshots")
+def snapshot_cache_stats():
+    sc = _snapshot_cache()
+    if sc is None:
+        return {"ok": True, "enabled": False}
+    return {"ok": True, "enabled": True, **sc.stats()}
+
+@app.delete("/cache/snapshots")
+def snapshot_cache_clear(repo_root: str | None = Query(None, description="only this repo (default: all)")):
+    sc = _snapshot_cache()
+    if sc is None:
+        return {"ok": True, "removed": 0}
+    root = str(Path(repo_root).expanduser().resolve()) if repo_root else None
+    return {"ok": True, "removed": sc.drop(root)}
+
+@app.get("/cache/completions")
+def completion_cache_stats():
+    cc = _completion_cache()
+    if cc is None:
+        return {"ok": True, "enabled": False}
+    return {"ok": True, "enabled": True, **cc.stats()}
+
+@app.delete("/cache/completions")
+def completion_cache_clear():
+    cc = _completion_cache()
+    return {"ok": True, "removed": cc.clear() if cc is not None else 0}
+
+@app.get("/ai/routing")
+def ai_routing_stats():
+    """Per-provider call counts, failure rate, hedges, wins and latency p50/p90/p99 + histogram (recent window)."""
+    return {"ok": True, "routing": STATE["settings"]["ai"].get("routing"), "providers": ROUTER.stats()}
+
+@app.delete("/ai/routing")
+def ai_routing_reset():
+    return {"ok": True, "reset": ROUTER.reset()}
+
+@app.get("/clients")
+def http_client_stats():
+    """Pooled provider / GitHub clients: requests, connections opened, open/idle connections, reuse rate."""
+    return {"ok": True, "pools": CLIENTS.stats()}
+
+@app.delete("/clients")
+def http_client_reset(name: str | None = Query(None, description="openai | http-provider | github (default: all)")):
+    return {"ok": True, "closed": CLIENTS.reset(name)}
+
 @app.post("/repo/rescan")
-def repo_rescan():
+def repo_rescan(full: bool = Query(False, description="force a full walk instead of the incremental rescan")):
     _ensure_repo()
-    root = Path(STATE["repo_root"])
-    STATE["snapshot"] = build_snapshot(root)
-    return {"ok": True, "files": len(STATE["snapshot"])}
+    eng = _snapshot_engine()
+    if full:
+        eng.full_scan()
+        return {"ok": True, "files": len(eng.snapshot), "mode": "full", "scan": eng.last_scan}
+    stats = eng.rescan()
+    return {"ok": True, "files": len(eng.snapshot), "mode": "incremental", "stats": stats}
 @app.get("/ignore/repo")
 def get_ignore_repo():
     if not STATE["repo_root"]:
@@ -904,18 +2343,14 @@ def set_ignore_repo(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(400, "patterns must be an array of glob expressions")
     txt = "\n".join(pats) + "\n"
     f = _repo_ignore_file(Path(STATE["repo_root"]))
+    old = _load_repo_ignores(Path(STATE["repo_root"]))
     f.write_text(txt, encoding="utf-8")
     # refresh snapshot using effective ignores
-    STATE["snapshot"] = build_snapshot(Path(STATE["repo_root"]))
+    _reapply_ignores(removed=bool(set(old) - set(pats)))
+    _refresh_snapshot([f.name])
     return {"ok": True, "patterns": pats}
-@app.post("/repo/rescan")
-def repo_rescan():
-    _ensure_repo()
-    STATE["snapshot"] = build_snapshot(Path(STATE["repo_root"]))
-    return {"ok": True, "files": len(STATE["snapshot"])}
 def _openai_client() -> "OpenAI":
-    from openai import OpenAI
     key = os.environ.get("OPENAI_API_KEY") or STATE["settings"]["ai"].get("openai_key")
     if not key:
         raise HTTPException(400, "OpenAI key not set (env OPENAI_API_KEY or settings.ai.openai_key)")
-    return OpenAI(api_key=key)
+    return CLIENTS.openai(key)
@@ -0,0 +1,114 @@
+"""
+Plan diffs: difflib.unified_diff vs utils/diff_engine (patience, myers) on real file
+pairs from git history plus generated worst cases (lockfile churn, a rewritten
+file, a minified bundle).
+
+    python bench/bench_diff.py                       # pairs from this repo's last 40 commits
+    python bench/bench_diff.py --repo ~/src/app --commits 200 --top 15
+    python bench/bench_diff.py --synthetic-only --scale 4
+
+Times are per pair; "budget" shows what the default DiffEngine budgets did (ok, or
+the reason it fell back to a summary). Run from the engine/ directory.
+"""
+import argparse, difflib, json, os, random, subprocess, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.diff_engine import DiffEngine  # noqa: E402
+
+
+def git(repo, *args):
+    return subprocess.run(["git", "-C", repo, *args], capture_output=True, text=True, errors="replace").stdout
+
+
+def history_pairs(repo, commits):
+    """(label, before, after) for files modified in the last `commits` commits."""
+    out = []
+    for sha in git(repo, "log", f"-{commits}", "--no-merges", "--format=%h").split():
+        for path in git(repo, "diff", "--name-only", "--diff-filter=M", f"{sha}^", sha).splitlines():
+            before, after = git(repo, "show", f"{sha}^:{path}"), git(repo, "show", f"{sha}:{path}")
+            if before and after and "\0" not in before[:8000]:
+                out.append((f"{sha} {path}", before, after))
+    return out
+
+
+def synthetic_pairs(scale, seed=5):
+    rnd = random.Random(seed)
+    pkgs = [f"pkg-{i}" for i in range(int(3000 * scale))]
+
+    def lock(versions):
+        return json.dumps({"packages": {f"node_modules/{p}": {"version": v, "resolved": f"https://registry/{p}/-/{p}-{v}.tgz",
+                                                              "integrity": "sha512-" + "A" * 20, "dev": True}
+                                        for p, v in versions.items()}}, indent=2)
+    v1 = {p: f"1.{rnd.randint(0, 9)}.0" for p in pkgs}
+    v2 = {p: (f"2.{rnd.randint(0, 9)}.0" if rnd.random() < 0.3 else v) for p, v in v1.items()}
+    words = ["return", "}", "{", "if (x) {", "else {", "i++;", "break;", "", "  ", "const a = b;"]
+    rewritten_a = "\n".join(rnd.choice(words) for _ in range(int(20000 * scale)))
+    rewritten_b = "\n".join(rnd.choice(words) for _ in range(int(20000 * scale)))
+    minified = ";".join(f"var a{i}=function(){{return {i}}}" for i in range(int(30000 * scale)))
+    return [("lockfile churn (30% bumped)", lock(v1), lock(v2)),
+            ("rewritten, low-entropy lines", rewritten_a, rewritten_b),
+            ("minified bundle, one line", minified, minified.replace("return 7", "return 8"))]
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repo", default=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    ap.add_argument("--commits", type=int, default=40)
+    ap.add_argument("--top", type=int, default=10, help="show the N slowest real pairs (by difflib time)")
+    ap.add_argument("--scale", type=float, default=1.0, help="size factor for the generated pairs")
+    ap.add_argument("--synthetic-only", action="store_true")
+    ap.add_argument("--difflib-timeout", type=float, default=60, help="skip difflib on pairs after it exceeded this")
+    args = ap.parse_args()
+
+    pairs = [] if args.synthetic_only else history_pairs(args.repo, args.commits)
+    engines = {"patience": DiffEngine("patience", max_lines=10 ** 9, max_bytes=1 << 40, timeout=3600),
+               "myers": DiffEngine("myers", max_lines=10 ** 9, max_bytes=1 << 40, timeout=3600)}
+    guarded = DiffEngine()
+
+    def row(label, before, after, skip_difflib=False):
+        a, b = before.splitlines(), after.splitlines()
+        r = {"label": label, "lines": f"{len(a)}/{len(b)}"}
+        if not skip_difflib:
+            r["difflib"], out = timed(lambda: list(difflib.unified_diff(a, b, "current", "proposed", lineterm="")))
+            r["difflib_out"] = len(out)
+        for name, eng in engines.items():
+            r[name], (out, _) = timed(lambda: eng.unified(a, b, "current", "proposed"))
+            r[name + "_out"] = len(out)
+        r["guarded"], (_, summary) = timed(lambda: guarded.unified(a, b, "current", "proposed"))
+        r["budget"] = summary["reason"] if summary else "ok"
+        return r
+
+    def show(rows):
+        ms = lambda v: f"{v * 1000:9.1f}" if isinstance(v, float) else f"{'-':>9}"
+        print(f"{'pair':<48} {'lines':>13} {'difflib ms':>10} {'patience':>9} {'myers':>9} {'guarded':>9}  out d/p/m      budget")
+        for r in rows:
+            outs = "/".join(str(r.get(k + "_out", "-")) for k in ("difflib", "patience", "myers"))
+            print(f"{r['label'][:48]:<48} {r['lines']:>13} {ms(r.get('difflib')):>10} {ms(r['patience'])} {ms(r['myers'])}"
+                  f" {ms(r['guarded'])}  {outs:<14} {r['budget']}")
+
+    if pairs:
+        rows = [row(*p) for p in pairs]
+        rows.sort(key=lambda r: -r["difflib"])
+        tot = {k: sum(r[k] for r in rows) for k in ("difflib", "patience", "myers")}
+        print(f"{len(rows)} real pairs from {args.repo}: total difflib {tot['difflib'] * 1000:.0f} ms, "
+              f"patience {tot['patience'] * 1000:.0f} ms, myers {tot['myers'] * 1000:.0f} ms")
+        show(rows[:args.top])
+        print()
+    slow = False
+    rows = []
+    for p in synthetic_pairs(args.scale):
+        r = row(*p, skip_difflib=slow)
+        slow = slow or r.get("difflib", 0) > args.difflib_timeout
+        rows.append(r)
+    show(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Single-provider vs hedged routing (ai.routing.mode "race") against two local stub
+providers: a fast one with a slow tail and occasional failures, and a steadier,
+slower one. Prints latency percentiles, failures and how often each provider won.
+
+    python bench/bench_routing.py --calls 200 --concurrency 4
+    python bench/bench_routing.py --slow-rate 0.2 --slow-ms 4000 --fail-rate 0.1
+
+Run from the engine/ directory (nothing is written outside a temp config dir).
+"""
+import argparse, os, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("XDG_CONFIG_HOME", tempfile.mkdtemp(prefix="devpilot-bench-"))
+os.environ.setdefault("APPDATA", os.environ["XDG_CONFIG_HOME"])
+
+import app as engine  # noqa: E402
+from bench.stub_llm_server import serve  # noqa: E402
+
+
+def pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else float("nan")
+
+
+def run(label, calls, concurrency):
+    def one(i):
+        t0 = time.perf_counter()
+        try:
+            res = engine._mux_complete(f"bench call {label}-{i}", cache="bypass")
+            return time.perf_counter() - t0, (res.get("route") or {}).get("provider", "single")
+        except Exception as e:
+            return time.perf_counter() - t0, f"error: {getattr(e, 'detail', None) or e}"[:60]
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        out = list(pool.map(one, range(calls)))
+    wall = time.perf_counter() - t0
+    ok = [s for s, who in out if not who.startswith("error")]
+    winners = {}
+    for _, who in out:
+        winners[who] = winners.get(who, 0) + 1
+    print(f"{label:>7}: {wall:6.1f}s wall  p50 {pct(ok, .5) * 1000:6.0f}ms  p90 {pct(ok, .9) * 1000:6.0f}ms"
+          f"  p99 {pct(ok, .99) * 1000:6.0f}ms  max {max(ok, default=0) * 1000:6.0f}ms  {winners}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--calls", type=int, default=120)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--latency-ms", type=float, default=150, help="fast provider's typical latency")
+    ap.add_argument("--slow-rate", type=float, default=0.1, help="fast provider's share of stalled calls")
+    ap.add_argument("--slow-ms", type=float, default=3000)
+    ap.add_argument("--fail-rate", type=float, default=0.05)
+    ap.add_argument("--backup-ms", type=float, default=400, help="second provider's typical latency")
+    args = ap.parse_args()
+
+    fast, fast_url = serve(seed=1, latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 3,
+                           slow_rate=args.slow_rate, slow_ms=args.slow_ms, fail_rate=args.fail_rate)
+    backup, backup_url = serve(seed=2, latency_ms=args.backup_ms, jitter_ms=args.backup_ms / 4)
+    ai = engine.STATE["settings"]["ai"]
+    ai.update(provider="http", http_endpoint=fast_url, rate_limits={"http": {"rpm": 0, "burst": 1}})
+    ai["routing"] = {"mode": "single", "providers": ["http", {"name": "backup", "provider": "http", "endpoint": backup_url}],
+                     "hedge_after_ms": 2000}
+    print(f"fast provider {args.latency_ms:.0f}ms ({args.slow_rate:.0%} stall {args.slow_ms:.0f}ms, "
+          f"{args.fail_rate:.0%} fail), backup {args.backup_ms:.0f}ms; {args.calls} calls x{args.concurrency}")
+    run("single", args.calls, args.concurrency)
+    ai["routing"]["mode"] = "race"
+    engine.ROUTER.reset()
+    run("race", args.calls, args.concurrency)
+    for name, s in engine.ROUTER.stats().items():
+        print(f"  {name:>7}: calls {s['calls']}, failures {s['failures']}, hedges {s['hedges']}, wins {s['wins']}, "
+              f"p50 {s['p50_ms']}ms, p90 {s['p90_ms']}ms")
+    fast.shutdown()
+    backup.shutdown()
+    engine.ROUTER.shutdown()
+
+
+if __name__ == "__main__":
+    main()
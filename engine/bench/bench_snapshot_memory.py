@@ -0,0 +1,99 @@
+"""
+Memory/speed comparison of the snapshot layouts: plain {path: {"size", "ext", "mtime_ns"}}
+dict vs the columnar SnapshotStore.
+
+    python bench/bench_snapshot_memory.py --files 1000000
+    python bench/bench_snapshot_memory.py --repo ~/src/some-repo   # real paths from a scan
+
+Run from the engine/ directory.
+"""
+import argparse, gc, os, random, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.snapshot_engine import SnapshotEngine  # noqa: E402
+from utils.snapshot_store import SnapshotStore  # noqa: E402
+
+EXTS = [".ts", ".tsx", ".js", ".py", ".json", ".md", ".css", ".go", ".rs", ".java", ""]
+WORDS = ["src", "lib", "components", "utils", "core", "api", "models", "views", "tests", "internal",
+         "server", "client", "common", "services", "handlers", "store", "hooks", "pages", "styles", "types"]
+
+
+def synthetic(n: int, seed: int = 7):
+    """Repo-shaped entries: ~20 files per directory, 2-7 levels deep, fresh key/value objects."""
+    rnd = random.Random(seed)
+    now = time.time_ns()
+    dirs, out = [""], []
+    while len(out) < n:
+        if rnd.random() < 0.05 or len(dirs) < 2:
+            parent = rnd.choice(dirs)
+            if parent.count("/") < 6:
+                dirs.append(f"{parent}/{rnd.choice(WORDS)}{rnd.randint(0, 99)}".lstrip("/"))
+            continue
+        d = rnd.choice(dirs)
+        ext = rnd.choice(EXTS)
+        name = f"{rnd.choice(WORDS)}_{rnd.randint(0, 10 ** 6)}{ext}"
+        out.append((f"{d}/{name}" if d else name,
+                    {"size": rnd.randint(0, 200_000), "ext": ext, "mtime_ns": now - rnd.randint(0, 10 ** 17)}))
+    return out
+
+
+def from_repo(root: str):
+    snap = SnapshotEngine(root).full_scan()
+    return [(rel, dict(e)) for rel, e in snap.items()]
+
+
+def measure(label: str, build):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return label, obj, current, peak, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--files", type=int, default=200_000)
+    ap.add_argument("--repo", help="use the paths of a real repository instead of synthetic ones")
+    args = ap.parse_args()
+
+    # the source list is built outside the traced sections and serialized so neither
+    # layout shares string objects with it (as after a real scan)
+    rows = from_repo(args.repo) if args.repo else synthetic(args.files)
+    text = [(p.encode(), e["size"], e["ext"].encode(), e["mtime_ns"]) for p, e in rows]
+    del rows
+    n = len(text)
+
+    def plain():
+        return {p.decode(): {"size": s, "ext": x.decode(), "mtime_ns": m} for p, s, x, m in text}
+
+    def columnar():
+        store = SnapshotStore()
+        for p, s, x, m in text:
+            store[p.decode()] = {"size": s, "ext": x.decode(), "mtime_ns": m}
+        return store
+
+    print(f"{n} files")
+    print(f"{'layout':<10} {'retained MB':>12} {'peak MB':>9} {'B/file':>7} {'build s':>8} {'lookup s':>9} {'iter s':>7}")
+    probe = [p.decode() for p, _, _, _ in random.Random(1).sample(text, min(n, 100_000))]
+    for label, build in (("dict", plain), ("columnar", columnar)):
+        label, obj, current, peak, elapsed = measure(label, build)
+        t0 = time.perf_counter()
+        for p in probe:
+            obj[p]
+        lookup = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for _ in obj:
+            pass
+        it = time.perf_counter() - t0
+        print(f"{label:<10} {current / 2 ** 20:>12.1f} {peak / 2 ** 20:>9.1f} {current / max(1, n):>7.0f} "
+              f"{elapsed:>8.2f} {lookup:>9.3f} {it:>7.3f}")
+        del obj
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+OpenAI-compatible chat completions stub with tunable latency and failures, for
+exercising provider routing, streaming and rate limits without a real model.
+
+    python bench/stub_llm_server.py --port 8081 --latency-ms 300 --slow-rate 0.1 --slow-ms 8000
+    python bench/stub_llm_server.py --port 8082 --fail-rate 0.2 --invalid-rate 0.1
+
+Point ai.http_endpoint (or an ai.routing.providers entry) at http://127.0.0.1:<port>/v1/chat/completions.
+Every POST answers {"files": [...]} naming the last word of the prompt; "stream": true gets SSE chunks.
+Run from the engine/ directory.
+"""
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+
+DEFAULTS = {"latency_ms": 200.0, "jitter_ms": 50.0, "slow_rate": 0.0, "slow_ms": 5000.0,
+            "fail_rate": 0.0, "invalid_rate": 0.0, "chunks": 8}
+
+
+def reply_files(prompt: str) -> Dict[str, Any]:
+    tag = (prompt.split() or ["stub"])[-1]
+    return {"files": [{"path": f"stub/{tag}.py", "code": f"# answered by the stub for {tag}\n"}]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behavior: Dict[str, Any] = DEFAULTS
+    rnd = random.Random()
+    counters = {"requests": 0, "failed": 0, "invalid": 0, "slow": 0}
+
+    def log_message(self, *_args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes, ctype: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("content-type", ctype)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        b, c = self.behavior, self.counters
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)) or b"{}")
+        prompt = ((body.get("messages") or [{}])[-1]).get("content") or ""
+        c["requests"] += 1
+        delay = max(0.0, b["latency_ms"] + self.rnd.uniform(-b["jitter_ms"], b["jitter_ms"])) / 1000
+        if self.rnd.random() < b["slow_rate"]:
+            c["slow"] += 1
+            delay = b["slow_ms"] / 1000
+        if self.rnd.random() < b["fail_rate"]:
+            c["failed"] += 1
+            time.sleep(delay / 4)
+            return self._send(503, b'{"error": {"message": "stub overloaded"}}')
+        invalid = self.rnd.random() < b["invalid_rate"]
+        c["invalid"] += invalid
+        text = "Sorry, no JSON today." if invalid else json.dumps(reply_files(prompt))
+        if not body.get("stream"):
+            time.sleep(delay)
+            out = {"id": "stub", "object": "chat.completion", "model": body.get("model"),
+                   "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}
+            return self._send(200, json.dumps(out).encode("utf-8"))
+        # streamed: the delay is spread over the chunks, chunked transfer encoding like real servers
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        n = max(1, int(b["chunks"]))
+        step = -(-len(text) // n)
+        for i in range(0, len(text), step):
+            time.sleep(delay / n)
+            frame = {"choices": [{"index": 0, "delta": {"content": text[i:i + step]}}]}
+            self._chunk(f"data: {json.dumps(frame)}\n\n".encode("utf-8"))
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(port: int = 0, seed: int | None = None, **behavior: Any) -> Tuple[ThreadingHTTPServer, str]:
+    """Start a stub on a background thread; returns (server, chat completions URL). server.shutdown() stops it."""
+    handler = type("StubHandler", (Handler,), {"behavior": {**DEFAULTS, **behavior}, "rnd": random.Random(seed),
+                                               "counters": dict(Handler.counters)})
+    srv = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_port}/v1/chat/completions"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--seed", type=int)
+    for k, v in DEFAULTS.items():
+        ap.add_argument("--" + k.replace("_", "-"), type=type(v), default=v)
+    args = vars(ap.parse_args())
+    port, seed = args.pop("port"), args.pop("seed")
+    srv, url = serve(port, seed, **args)
+    print(f"stub listening on {url}")
+    try:
+        while True:
+            time.sleep(5)
+    except KeyboardInterrupt:
+        print(srv.RequestHandlerClass.counters)
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import json, os, threading, time, uuid, zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.content_hash import hash_bytes
+
+try:  # optional: faster and smaller than zlib when installed
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+FICLONE = 0x40049409  # linux ioctl: share extents (btrfs, xfs, bcachefs)
+CODECS = ("zlib", "zstd")
+_SUFFIX = {"zlib": ".z", "zstd": ".zst", "raw": ""}
+MANIFEST_SUFFIX = ".json"
+
+
+class BackupError(Exception):
+    pass
+
+
+def _reflink(src: str, dst: str) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # windows
+        return False
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        try:
+            os.unlink(dst)
+        except OSError:
+            pass
+        return False
+
+
+class BackupStore:
+    """
+    Content-addressed backups of the files applies overwrite, plus one manifest per run.
+
+    Blobs live in objects/<2 hex>/<hash>[.z|.zst], named by hash_bytes of the original
+    content, so a version is kept once however many paths and runs it backs up.
+    Originals are hardlinked or reflinked in when the filesystem allows (stored
+    raw: no read, no copy) and compressed otherwise. A manifest (runs/<id>.json)
+    maps each path a run touched to its previous content's hash, or None for files
+    the run created, so any run can be reverted. gc() drops runs by age and total
+    size, then every blob no remaining run references. A writer holds .lock from
+    its first put until record_run(), so gc() can't collect a run's blobs before
+    its manifest exists.
+    """
+
+    def __init__(self, root: str, compression: str = "zlib", level: int = 6, link: bool = True,
+                 logger: Optional[Callable[[str], None]] = None):
+        if compression not in CODECS:
+            raise ValueError(f"compression must be one of {', '.join(CODECS)}")
+        self.logger = logger or (lambda _msg: None)
+        if compression == "zstd" and zstandard is None:
+            self.logger("backups: zstandard is not installed; using zlib")
+            compression = "zlib"
+        self.root, self.compression, self.level, self.link = root, compression, level, link
+        self.objects, self.runs_dir = os.path.join(root, "objects"), os.path.join(root, "runs")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.runs_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.counters = {"stored": 0, "deduped": 0, "linked": 0, "reflinked": 0, "compressed": 0, "bytes_in": 0, "bytes_stored": 0}
+
+    # ---- blobs ----
+
+    def _blob(self, digest: str, codec: str) -> str:
+        return os.path.join(self.objects, digest[:2], digest + _SUFFIX[codec])
+
+    def _find(self, digest: str) -> Optional[Tuple[str, str]]:
+        for codec in ("raw", "zlib", "zstd"):
+            path = self._blob(digest, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def has(self, digest: str) -> bool:
+        return self._find(digest) is not None
+
+    def _tmp(self, digest: str) -> str:
+        d = os.path.join(self.objects, digest[:2])
+        os.makedirs(d, exist_ok=True)
+        return os.path.join(d, f".{digest}.{uuid.uuid4().hex[:8]}.tmp")
+
+    def put_bytes(self, data: bytes, digest: Optional[str] = None) -> str:
+        """Store data (compressed) unless a blob for it exists; returns its hash."""
+        digest = digest or hash_bytes(data)
+        if self.has(digest):
+            self.counters["deduped"] += 1
+            return digest
+        if self.compression == "zstd":
+            packed = zstandard.ZstdCompressor(level=self.level).compress(data)
+        else:
+            packed = zlib.compress(data, self.level)
+        codec = self.compression if len(packed) < len(data) else "raw"  # incompressible: keep as is
+        tmp = self._tmp(digest)
+        with open(tmp, "wb") as fh:
+            fh.write(packed if codec != "raw" else data)
+        os.replace(tmp, self._blob(digest, codec))
+        self.counters["stored"] += 1
+        self.counters["compressed"] += codec != "raw"
+        self.counters["bytes_in"] += len(data)
+        self.counters["bytes_stored"] += len(packed) if codec != "raw" else len(data)
+        return digest
+
+    def put_file(self, path: str, digest: Optional[str] = None) -> str:
+        """
+        Back up the file at path; returns its hash. With digest known, an existing blob
+        means no read at all, and a hardlink / reflink stores it without copying. Only
+        link files nothing will write to again (e.g. an original about to be replaced).
+        """
+        if digest is not None:
+            if self.has(digest):
+                self.counters["deduped"] += 1
+                return digest
+            if self.link:
+                tmp = self._tmp(digest)
+                how = None
+                try:
+                    os.link(path, tmp)
+                    how = "linked"
+                except OSError:
+                    if _reflink(path, tmp):
+                        how = "reflinked"
+                if how:
+                    os.replace(tmp, self._blob(digest, "raw"))
+                    self.counters["stored"] += 1
+                    self.counters[how] += 1
+                    return digest
+        with open(path, "rb") as fh:
+            data = fh.read()
+        return self.put_bytes(data)
+
+    def get(self, digest: str) -> bytes:
+        """Content of a blob, verified against its hash."""
+        found = self._find(digest)
+        if found is None:
+            raise BackupError(f"backup {digest} is missing")
+        path, codec = found
+        with open(path, "rb") as fh:
+            data = fh.read()
+        if codec == "zlib":
+            data = zlib.decompress(data)
+        elif codec == "zstd":
+            if zstandard is None:
+                raise BackupError(f"backup {digest} is zstd-compressed and zstandard is not installed")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        if hash_bytes(data) != digest:
+            raise BackupError(f"backup {digest} is corrupt")
+        return data
+
+    def _blobs(self) -> Iterator[Tuple[str, str, os.stat_result]]:
+        """(digest, path, stat) for every blob (and stray temp) in the store."""
+        for sub in os.scandir(self.objects):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                try:
+                    yield e.name.split(".")[0] if not e.name.startswith(".") else "", e.path, e.stat()
+                except OSError:
+                    continue
+
+    # ---- runs ----
+
+    def record_run(self, run_id: str, files: Dict[str, Optional[str]], kind: str = "apply",
+                   meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Write runs/<run_id>.json: files maps each path the run wrote to its previous hash (None = created)."""
+        manifest = {"id": run_id, "kind": kind, "created": time.time(), "files": files, **(meta or {})}
+        path = os.path.join(self.runs_dir, run_id + MANIFEST_SUFFIX)
+        tmp = path + ".part"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(manifest))
+        os.replace(tmp, path)
+        return manifest
+
+    def manifest(self, run_id: str) -> Optional[Dict[str, Any]]:
+        if not run_id or "/" in run_id or "\\" in run_id or run_id.startswith("."):
+            return None
+        try:
+            with open(os.path.join(self.runs_dir, run_id + MANIFEST_SUFFIX), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def manifests(self) -> List[Dict[str, Any]]:
+        """All run manifests, newest first."""
+        out = []
+        for name in os.listdir(self.runs_dir):
+            if name.endswith(MANIFEST_SUFFIX):
+                m = self.manifest(name[:-len(MANIFEST_SUFFIX)])
+                if m is not None:
+                    out.append(m)
+        out.sort(key=lambda m: (m.get("created") or 0, m["id"]), reverse=True)
+        return out
+
+    def latest(self, rel: str) -> Optional[Tuple[str, Optional[str]]]:
+        """(run_id, previous hash) of the newest run that wrote rel."""
+        for m in self.manifests():
+            if rel in m["files"]:
+                return m["id"], m["files"][rel]
+        return None
+
+    def drop_run(self, run_id: str) -> bool:
+        try:
+            os.unlink(os.path.join(self.runs_dir, run_id + MANIFEST_SUFFIX))
+            return True
+        except OSError:
+            return False
+
+    # ---- gc ----
+
+    def gc(self, max_age: Optional[float] = None, max_bytes: Optional[int] = None, keep_runs: int = 1) -> Dict[str, Any]:
+        """
+        Drop runs older than max_age seconds, then the oldest runs while the blobs the rest
+        reference exceed max_bytes (the newest keep_runs always stay), then unreferenced
+        blobs. Raw blobs still sharing an inode with another file are rewritten compressed.
+        """
+        with self.lock:
+            runs = self.manifests()
+            now = time.time()
+            blobs: Dict[str, Tuple[str, os.stat_result]] = {}
+            stray = []
+            for digest, path, st in self._blobs():
+                if digest:
+                    blobs[digest] = (path, st)
+                elif now - st.st_mtime > 3600:
+                    stray.append(path)  # temp left by a crash
+            keep = [m for i, m in enumerate(runs) if i < keep_runs or max_age is None or now - (m.get("created") or 0) <= max_age]
+
+            def referenced(ms: List[Dict[str, Any]]) -> set:
+                return {h for m in ms for h in m["files"].values() if h}
+            if max_bytes is not None:
+                size = lambda refs: sum(blobs[h][1].st_size for h in refs if h in blobs)
+                while len(keep) > keep_runs and size(referenced(keep)) > max_bytes:
+                    keep.pop()
+            dropped = [m["id"] for m in runs if m not in keep]
+            for run_id in dropped:
+                self.drop_run(run_id)
+            live = referenced(keep)
+            freed, removed, relinked = 0, 0, 0
+            for digest, (path, st) in blobs.items():
+                if digest not in live:
+                    try:
+                        os.unlink(path)
+                        freed += st.st_size
+                        removed += 1
+                    except OSError:
+                        pass
+                elif st.st_nlink > 1 and not os.path.splitext(path)[1]:
+                    relinked += self._detach(digest, path)
+            for path in stray:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            kept = sum(st.st_size for h, (_, st) in blobs.items() if h in live)
+            return {"runs_dropped": len(dropped), "runs": len(keep), "blobs_removed": removed,
+                    "bytes_freed": freed, "bytes_kept": kept, "detached": relinked}
+
+    def unshare(self, digest: str) -> bool:
+        """Give a raw blob its own copy if it still shares an inode with another file; True if it did."""
+        found = self._find(digest)
+        if found is None or found[1] != "raw":
+            return False
+        try:
+            shared = os.stat(found[0]).st_nlink > 1
+        except OSError:
+            return False
+        return shared and bool(self._detach(digest, found[0]))
+
+    def _detach(self, digest: str, path: str) -> int:
+        """A hardlinked blob whose original came back into use (e.g. a rolled-back apply): store a private copy."""
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            return 0
+        if hash_bytes(data) != digest:
+            self.logger(f"backups: blob {digest} changed through a shared link; dropped")
+            os.unlink(path)
+            return 0
+        os.unlink(path)
+        self.put_bytes(data, digest)
+        return 1
+
+    def stats(self) -> Dict[str, Any]:
+        n, size = 0, 0
+        for digest, _, st in self._blobs():
+            if digest:
+                n += 1
+                size += st.st_size
+        return {"root": self.root, "compression": self.compression, "runs": len(self.manifests()),
+                "blobs": n, "bytes": size, **self.counters}
+
+
+def migrate_legacy(store: BackupStore, legacy_root: str, run_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Import .devpilot_backups/**/*.bak (the first version of each file) as one run dated by the oldest
+    of them, so age-based gc treats it as the old backup it is; None if there are none.
+    """
+    files: Dict[str, Optional[str]] = {}
+    oldest = time.time()
+    with store.lock:
+        for d, dirs, names in os.walk(legacy_root):
+            dirs[:] = [x for x in dirs if x != "journal"]
+            for name in names:
+                if name.endswith(".bak"):
+                    path = os.path.join(d, name)
+                    rel = os.path.relpath(path, legacy_root)[:-len(".bak")].replace(os.sep, "/")
+                    oldest = min(oldest, os.stat(path).st_mtime)
+                    files[rel] = store.put_file(path)
+        if not files:
+            return None
+        manifest = store.record_run(run_id, files, kind="legacy", meta={"created": oldest})
+    for rel in files:
+        try:
+            os.unlink(os.path.join(legacy_root, rel + ".bak"))
+        except OSError:
+            pass
+    for d, _dirs, _names in os.walk(legacy_root, topdown=False):
+        if d != legacy_root:
+            try:
+                os.rmdir(d)  # only succeeds once empty
+            except OSError:
+                pass
+    return manifest
@@ -0,0 +1,143 @@
+import hashlib, json, sqlite3, threading, time, zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key         TEXT PRIMARY KEY,
+    bytes       INTEGER NOT NULL,
+    saved_at    REAL NOT NULL,
+    last_used   REAL NOT NULL,
+    payload     BLOB NOT NULL
+)
+"""
+
+MODES = ("use", "bypass", "refresh")
+
+
+def completion_key(provider: str, model: str, temperature: float, max_tokens: int, prompt: str,
+                   endpoint: Optional[str] = None) -> str:
+    """Hash of everything that decides a completion (the endpoint only matters for the http provider)."""
+    h = hashlib.blake2b(digest_size=20)
+    for part in (provider, model, repr(float(temperature)), str(max_tokens), endpoint or ""):
+        h.update(part.encode("utf-8") + b"\0")
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CompletionCache:
+    """
+    Two-tier cache of parsed model replies, keyed by completion_key().
+
+    The memory tier is an LRU of at most max_entries; the disk tier is one SQLite
+    file bounded by max_bytes (least recently used rows go first) and rows older
+    than ttl seconds are never returned. A disk hit is promoted to memory.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 64, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 24 * 3600, logger: Optional[Callable[[str], None]] = None):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.logger = logger or (lambda _msg: None)
+        self._mem: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.execute(_SCHEMA)
+
+    @contextmanager
+    def _db(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None and now - hit[0] <= self.ttl:
+                self._mem.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return hit[1]
+            self._mem.pop(key, None)
+        try:
+            with self._db() as db:
+                row = db.execute("SELECT saved_at, payload FROM completions WHERE key=?", (key,)).fetchone()
+                if row is not None and now - row[0] > self.ttl:
+                    row = None
+                if row is not None:
+                    db.execute("UPDATE completions SET last_used=? WHERE key=?", (now, key))
+        except sqlite3.Error as e:
+            self.logger(f"completion cache: read failed: {e}")
+            row = None
+        value = None
+        if row is not None:
+            try:
+                value = json.loads(zlib.decompress(row[1]))
+            except (ValueError, zlib.error):
+                value = None
+        with self._lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, row[0], value)  # type: ignore[index]
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        payload = zlib.compress(json.dumps(value).encode("utf-8"), 6)
+        with self._lock:
+            self._remember(key, now, value)
+            self.counters["stores"] += 1
+        try:
+            with self._db() as db:
+                db.execute("INSERT OR REPLACE INTO completions VALUES (?,?,?,?,?)", (key, len(payload), now, now, payload))
+                self._evict(db)
+        except sqlite3.Error as e:
+            self.logger(f"completion cache: write failed: {e}")
+
+    def _remember(self, key: str, saved_at: float, value: Dict[str, Any]) -> None:
+        self._mem[key] = (saved_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _evict(self, db: sqlite3.Connection) -> int:
+        gone = db.execute("DELETE FROM completions WHERE saved_at < ?", (time.time() - self.ttl,)).rowcount
+        total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM completions").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in db.execute("SELECT key, bytes FROM completions ORDER BY last_used ASC").fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM completions WHERE key=?", (key,))
+                total -= size
+                gone += 1
+        return gone
+
+    def clear(self) -> int:
+        with self._lock:
+            self._mem.clear()
+        with self._db() as db:
+            return db.execute("DELETE FROM completions").rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._db() as db:
+            rows, size = db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM completions").fetchone()
+        with self._lock:
+            c = dict(self.counters)
+            mem = len(self._mem)
+        lookups = c["memory_hits"] + c["disk_hits"] + c["misses"]
+        return {
+            "path": str(self.path), "ttl_hours": self.ttl / 3600, "max_bytes": self.max_bytes,
+            "memory_entries": mem, "max_entries": self.max_entries, "disk_entries": rows, "bytes": size,
+            **c, "hit_rate": round((c["memory_hits"] + c["disk_hits"]) / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,195 @@
+import contextlib, contextvars, hashlib, os, threading, time
+from typing import Dict, Iterator, Optional, Tuple
+
+DIGEST_SIZE = 16  # blake2b-128: plenty for change detection, 32 hex chars
+# files touched this recently may still change within the same mtime tick
+# (the "racily clean" problem); hash them but don't trust the cache entry
+_RACY_NS = 2_000_000_000
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """Hash of text as the engine writes it (utf-8)."""
+    return hash_bytes(text.encode("utf-8"))
+
+
+def decode_text(data: bytes) -> str:
+    """Same result as Path.read_text(encoding="utf-8", errors="ignore") on these bytes."""
+    return data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _key(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashCache:
+    """
+    Lazily computed content hashes, cached per path by (inode, size, mtime_ns).
+
+    A cached hash is only returned when a fresh stat still matches its key, so
+    unchanged files are never re-read across rescans and edited ones always are.
+    Equal hashes mean equal bytes; callers treat a mismatch as "compare for real".
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple[int, int, int], str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, rel: str, st: os.stat_result) -> Optional[str]:
+        ent = self._entries.get(rel)
+        if ent is not None and ent[0] == _key(st):
+            self.hits += 1
+            return ent[1]
+        return None
+
+    def store(self, rel: str, st: os.stat_result, digest: str) -> None:
+        if time.time_ns() - st.st_mtime_ns < _RACY_NS:
+            return
+        with self._lock:
+            self._entries[rel] = (_key(st), digest)
+
+    def read(self, abs_path: str, rel: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """Read the file once and return (bytes, hash); (None, None) if it is not a readable file."""
+        try:
+            with open(abs_path, "rb") as fh:
+                st = os.fstat(fh.fileno())
+                data = fh.read()
+        except OSError:
+            return None, None
+        digest = hash_bytes(data)
+        self.misses += 1
+        self.store(rel, st, digest)
+        return data, digest
+
+    def file_hash(self, abs_path: str, rel: str) -> Optional[str]:
+        """Hash of the file on disk, reading it only when the cache entry is stale."""
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            return None
+        digest = self.cached(rel, st)
+        if digest is not None:
+            return digest
+        h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        try:
+            with open(abs_path, "rb") as fh:
+                st = os.fstat(fh.fileno())
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    h.update(chunk)
+        except OSError:
+            return None
+        self.misses += 1
+        digest = h.hexdigest()
+        self.store(rel, st, digest)
+        return digest
+
+    def export(self) -> Dict[str, Tuple[Tuple[int, int, int], str]]:
+        with self._lock:
+            return dict(self._entries)
+
+    def load(self, entries: Dict[str, Tuple[Tuple[int, int, int], str]]) -> None:
+        """Seed from export(); entries are still checked against a fresh stat before use."""
+        with self._lock:
+            for rel, (key, digest) in entries.items():
+                self._entries.setdefault(rel, (tuple(key), digest))  # type: ignore[arg-type]
+
+    def forget(self, rel: str) -> None:
+        with self._lock:
+            self._entries.pop(rel, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class FileContents:
+    """
+    Decoded text of the files one operation touches, read once per (inode, size, mtime_ns).
+
+    Every lookup re-stats the file, so a change on disk is a miss and a fresh read;
+    the stat each file was last read or validated at is kept so a writer can
+    check changed() just before replacing it.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple[int, int, int], str, str]] = {}
+        self._seen: Dict[str, Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.hits = 0
+
+    def get(self, abs_path: str, st: os.stat_result) -> Optional[Tuple[str, str]]:
+        """(text, hash) if the file was read in this scope and still matches st."""
+        ent = self._entries.get(abs_path)
+        if ent is not None and ent[0] == _key(st):
+            self.hits += 1
+            return ent[1], ent[2]
+        return None
+
+    def read(self, abs_path: str) -> Tuple[Optional[os.stat_result], str, Optional[str]]:
+        """(stat, text, hash); (None, "", None) if it is not a readable file."""
+        try:
+            st = os.stat(abs_path)
+            hit = self.get(abs_path, st)
+            if hit is not None:
+                return st, hit[0], hit[1]
+            with open(abs_path, "rb") as fh:
+                st = os.fstat(fh.fileno())
+                data = fh.read()
+        except OSError:
+            return None, "", None
+        text, digest = decode_text(data), hash_bytes(data)
+        with self._lock:
+            self.reads += 1
+            self._entries[abs_path] = (_key(st), text, digest)
+            self._seen[abs_path] = _key(st)
+        return st, text, digest
+
+    def note(self, abs_path: str, st: os.stat_result) -> None:
+        """Record the stat a file was validated at without reading it (e.g. a HashCache hit)."""
+        with self._lock:
+            self._seen[abs_path] = _key(st)
+
+    def changed(self, abs_path: str) -> bool:
+        """True when the file no longer has the stat it was read or validated at in this scope."""
+        key = self._seen.get(abs_path)
+        if key is None:
+            return False
+        try:
+            return _key(os.stat(abs_path)) != key
+        except OSError:
+            return True
+
+    def forget(self, abs_path: str) -> None:
+        with self._lock:
+            self._entries.pop(abs_path, None)
+            self._seen.pop(abs_path, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"files": len(self._entries), "reads": self.reads, "hits": self.hits}
+
+
+_scope: "contextvars.ContextVar[Optional[FileContents]]" = contextvars.ContextVar("file_contents", default=None)
+
+
+def current_contents() -> Optional[FileContents]:
+    return _scope.get()
+
+
+@contextlib.contextmanager
+def read_scope(contents: Optional[FileContents] = None) -> Iterator[FileContents]:
+    """
+    Make `contents` (else the enclosing scope's, else a new one) the active FileContents.
+    Nested scopes share the outer cache, so one request reads each file once.
+    Don't hold a scope open across a yield; re-enter it with the same object instead.
+    """
+    contents = contents or _scope.get() or FileContents()
+    token = _scope.set(contents)
+    try:
+        yield contents
+    finally:
+        _scope.reset(token)
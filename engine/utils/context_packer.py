@@ -0,0 +1,283 @@
+import math, os, re, threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.content_hash import HashCache, decode_text
+from utils.file_reader import SNIFF_BYTES, looks_binary
+from utils.snapshot_follower import SnapshotFollower
+
+MAX_RANK_BYTES = 512 * 1024  # bigger files are neither ranked nor packed whole
+PATH_WEIGHT = 3              # a term in the path counts like this many body occurrences
+BM25_K1, BM25_B = 1.2, 0.75
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9]*")
+_PART = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_STOP = frozenset("""
+a an and are as at be by for from has have if in into is it its of on or that the this to was were will with
+def class return import self none true false null undefined const let var function new async await
+else elif while try except finally catch throw raise pass break continue public private static void
+int str string bool number any type interface export default
+""".split())
+
+_encoder_lock = threading.Lock()
+_encoder: Any = None
+
+
+def _tiktoken():
+    """cl100k_base encoder when tiktoken is installed (and its data available), else False."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            try:
+                import tiktoken  # optional
+                _encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoder = False
+        return _encoder
+
+
+def count_tokens(text: str) -> int:
+    enc = _tiktoken()
+    if enc:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4  # ~4 chars per token for code and English
+
+
+def tokenizer_name() -> str:
+    return "tiktoken/cl100k_base" if _tiktoken() else "chars/4"
+
+
+def terms(text: str) -> List[str]:
+    """Lowercased identifier parts (camelCase / snake_case split), stopwords dropped."""
+    out = []
+    for word in _WORD.findall(text):
+        parts = _PART.findall(word) if not word.islower() else [word]
+        for p in parts:
+            p = p.lower()
+            if len(p) > 1 and p not in _STOP:
+                out.append(p)
+    return out
+
+
+class _Doc:
+    __slots__ = ("tf", "length", "tokens")
+
+    def __init__(self, tf: Dict[str, int], length: int, tokens: int):
+        self.tf, self.length, self.tokens = tf, length, tokens
+
+
+class ContextIndex(SnapshotFollower):
+    """
+    BM25 term index + token counts over the snapshot's text files, for packing
+    prompt context under a token budget.
+
+    Per-file term frequencies and token counts are cached by content hash, so a
+    rebuild or repack only re-reads files whose bytes changed. Path components
+    are indexed too (weighted), so "fix the tree endpoint" finds dir_index.py.
+    """
+
+    name = "context-index"
+
+    def __init__(self, repo_root: str, hash_cache: HashCache, logger: Optional[Callable[[str], None]] = None):
+        super().__init__(logger)
+        self.repo_root = repo_root
+        self.hashes = hash_cache
+        self._lock = threading.Lock()
+        self._by_hash: Dict[str, _Doc] = {}
+        self._docs: Dict[str, str] = {}  # rel -> content hash
+        self._df: Counter = Counter()
+        self._total_len = 0
+
+    # ---------- maintenance ----------
+    def rebuild(self, paths: List[str]) -> Optional[bool]:
+        with self._lock:
+            self._docs, self._df, self._total_len = {}, Counter(), 0
+        for i, rel in enumerate(paths):
+            if i % 256 == 0 and self.superseded():
+                return False
+            self._load(rel)
+        with self._lock:
+            live = set(self._docs.values())
+            self._by_hash = {h: d for h, d in self._by_hash.items() if h in live}
+        self.logger(f"context index: {len(self._docs)} files, {len(self._df)} terms")
+        return True
+
+    def update(self, paths: Iterable[str], removed: Iterable[str] = ()) -> None:
+        with self._lock:
+            for rel in removed:
+                self._drop(rel)
+        for rel in paths:
+            self._load(rel)
+
+    def _drop(self, rel: str) -> None:
+        digest = self._docs.pop(rel, None)
+        doc = self._by_hash.get(digest) if digest else None
+        if doc is not None:
+            df = self._df
+            for t in doc.tf:
+                if df[t] <= 1:
+                    del df[t]
+                else:
+                    df[t] -= 1
+            self._total_len -= doc.length
+
+    def _forget(self, rel: str) -> Tuple[None, None]:
+        """rel can't be ranked any more (gone, too large, binary, unreadable): take it out of the stats."""
+        with self._lock:
+            self._drop(rel)
+        return None, None
+
+    def _analyze(self, rel: str, text: str) -> _Doc:
+        tf = Counter(terms(text))
+        for t in terms(rel.replace("/", " ").replace(".", " ")):
+            tf[t] += PATH_WEIGHT
+        return _Doc(dict(tf), sum(tf.values()), count_tokens(text))
+
+    def _load(self, rel: str) -> Tuple[Optional[str], Optional[_Doc]]:
+        """(content hash, doc) for rel, re-analyzing only when its bytes changed."""
+        abs_path = os.path.join(self.repo_root, rel)
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            return self._forget(rel)
+        if st.st_size > MAX_RANK_BYTES:
+            return self._forget(rel)
+        digest = self.hashes.cached(rel, st)
+        doc = self._by_hash.get(digest) if digest else None
+        if doc is None:
+            data, digest = self.hashes.read(abs_path, rel)
+            if data is None or digest is None or looks_binary(data[:SNIFF_BYTES]):
+                return self._forget(rel)
+            doc = self._by_hash.get(digest)
+            if doc is None:
+                doc = self._analyze(rel, decode_text(data))
+        with self._lock:
+            if self._docs.get(rel) != digest:
+                self._drop(rel)
+                self._by_hash[digest] = doc  # type: ignore[index]
+                self._docs[rel] = digest  # type: ignore[assignment]
+                self._df.update(doc.tf.keys())
+                self._total_len += doc.length
+        return digest, doc
+
+    # ---------- ranking ----------
+    def rank(self, query: str, limit: int = 50) -> List[Dict[str, Any]]:
+        q = Counter(terms(query))
+        if not q:
+            return []
+        with self._lock:
+            n = len(self._docs)
+            if not n:
+                return []
+            avg = self._total_len / n
+            idf = {t: math.log(1 + (n - self._df.get(t, 0) + 0.5) / (self._df.get(t, 0) + 0.5))
+                   for t in q if self._df.get(t, 0) > 0}
+            scored = []
+            for rel, digest in self._docs.items():
+                doc = self._by_hash[digest]
+                tf = doc.tf
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc.length / avg)
+                score = 0.0
+                for t, w in idf.items():
+                    f = tf.get(t)
+                    if f:
+                        score += w * f * (BM25_K1 + 1) / (f + norm) * q[t]
+                if score > 0:
+                    scored.append((score, rel, doc.tokens))
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        return [{"path": rel, "score": round(score, 4), "tokens": tokens} for score, rel, tokens in scored[:limit]]
+
+    def tokens(self, rel: str) -> Optional[int]:
+        """Cached token count of rel (None for binary/oversized/missing files)."""
+        doc = self._load(rel)[1]
+        return doc.tokens if doc is not None else None
+
+    def status(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "files": len(self._docs), "terms": len(self._df), "tokenizer": tokenizer_name(),
+                "pending": self.pending, **self.stats}
+
+
+def pack(index: ContextIndex, task: str, budget: int, include: Iterable[str] = (), max_files: int = 20,
+         slicer: Optional[Callable[[str, str], List[Dict[str, Any]]]] = None,
+         read: Optional[Callable[[str], Optional[str]]] = None) -> Dict[str, Any]:
+    """
+    Greedy packing: `include` paths first, then files by BM25 score. A file that
+    does not fit whole is replaced by its matching symbol slices (slicer(rel, task))
+    when those fit. Returns the packed items with token counts and totals.
+    """
+    read = read or (lambda rel: _read_text(index.repo_root, rel))
+    items: List[Dict[str, Any]] = []
+    skipped: List[Dict[str, Any]] = []
+    used = 0
+    seen = set()
+    ranked = index.rank(task, limit=max(max_files * 3, 50))
+    queue = [{"path": p, "score": None, "tokens": None, "pinned": True} for p in include] + ranked
+    for cand in queue:
+        rel = cand["path"]
+        if rel in seen or len(items) >= max_files:
+            continue
+        seen.add(rel)
+        text = read(rel)
+        if text is None:
+            skipped.append({"path": rel, "reason": "unreadable"})
+            continue
+        tokens = cand["tokens"] if cand["tokens"] is not None else index.tokens(rel)
+        if tokens is None:
+            tokens = count_tokens(text)
+        if used + tokens <= budget:
+            items.append({"path": rel, "kind": "file", "score": cand["score"], "tokens": tokens, "content": text})
+            used += tokens
+            continue
+        fitted = False
+        for sl in (slicer(rel, task) if slicer else []):
+            t = count_tokens(sl["content"])
+            if used + t <= budget:
+                items.append({"path": rel, "kind": "slice", "symbol": sl["symbol"], "score": cand["score"],
+                              "tokens": t, "content": sl["content"],
+                              "lines": [sl["start_line"], sl["end_line"]]})
+                used += t
+                fitted = True
+        if not fitted:
+            skipped.append({"path": rel, "reason": "over budget", "tokens": tokens})
+    return {"items": items, "skipped": skipped[:50],
+            "totals": {"budget": budget, "used": used, "files": len({i["path"] for i in items}),
+                       "items": len(items), "tokenizer": tokenizer_name()}}
+
+
+def symbol_slicer(symbols, limit: int = 3) -> Callable[[str, str], List[Dict[str, Any]]]:
+    """slicer for pack(): the definitions of rel whose names share terms with the task (SymbolIndex)."""
+    def slicer(rel: str, task: str) -> List[Dict[str, Any]]:
+        syms = symbols.symbols(rel)
+        if not syms:
+            return []
+        want = set(terms(task))
+        scored = [(len(want & set(terms(d["qualname"]))), d["qualname"]) for d in syms["defs"] if d["kind"] != "variable"]
+        out = []
+        for n, qual in sorted(scored, key=lambda x: -x[0]):
+            if n == 0 or len(out) >= limit:
+                break
+            sl = symbols.slice(rel, symbol=qual)
+            if sl is not None:
+                out.append(sl)
+        return out
+    return slicer
+
+
+def render(items: List[Dict[str, Any]]) -> str:
+    blocks = []
+    for it in items:
+        lang = os.path.splitext(it["path"])[1].lstrip(".")
+        label = it["path"] + (f" ({it['symbol']}, lines {it['lines'][0]}-{it['lines'][1]})" if it["kind"] == "slice" else "")
+        blocks.append(f"### {label}\n```{lang}\n{it['content']}\n```")
+    return "\n\n".join(blocks)
+
+
+def _read_text(repo_root: str, rel: str) -> Optional[str]:
+    try:
+        with open(os.path.join(repo_root, rel), "rb") as fh:
+            data = fh.read(MAX_RANK_BYTES + 1)
+    except OSError:
+        return None
+    if len(data) > MAX_RANK_BYTES or looks_binary(data[:SNIFF_BYTES]):
+        return None
+    return decode_text(data)
@@ -0,0 +1,285 @@
+import difflib, math, time
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Opcode = Tuple[str, int, int, int, int]
+Block = Tuple[int, int, int]  # (i, j, size): a[i:i+size] == b[j:j+size]
+
+ALGORITHMS = ("patience", "myers", "difflib")
+
+
+class DiffTooLarge(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def intern(a: List[str], b: List[str]) -> Tuple[List[int], List[int]]:
+    """Lines as small ints (equal lines, equal ids) so comparisons and hashing are cheap."""
+    ids: Dict[str, int] = {}
+    return [ids.setdefault(x, len(ids)) for x in a], [ids.setdefault(x, len(ids)) for x in b]
+
+
+# ---------- Myers (linear space: middle snake, divide and conquer) ----------
+def _middle_snake(a: List[int], b: List[int], a0: int, n: int, b0: int, m: int,
+                  check: Callable[[], None]) -> Tuple[int, int, int, int, int]:
+    """
+    (d, x, y, u, v): an edit script of length d passes through the snake (x, y) -> (u, v).
+    Past max_cost edits the search gives up on minimality (as xdiff does) and splits at
+    the furthest-reaching forward point instead, keeping big dissimilar regions near-linear.
+    """
+    delta = n - m
+    odd = delta & 1
+    off = (n + m + 1) // 2 + 2
+    vf = [0] * (2 * off + 2)
+    vb = [0] * (2 * off + 2)
+    max_cost = max(64, math.isqrt(n + m))
+    for d in range((n + m + 1) // 2 + 1):
+        if not d & 63:
+            check()
+        if d > max_cost:
+            best, bx = -1, 0
+            for k in range(-d + 1, d, 2):
+                x = min(vf[off + k], n)
+                if x - k <= m and best < 2 * x - k and (x, x - k) != (n, m):
+                    best, bx = 2 * x - k, x
+            if best > 0:
+                return 2 * d, bx, best - bx, bx, best - bx
+        for k in range(-d, d + 1, 2):
+            x = vf[off + k + 1] if k == -d or (k != d and vf[off + k - 1] < vf[off + k + 1]) else vf[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1; y += 1
+            vf[off + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + vb[off + delta - k] >= n:
+                return 2 * d - 1, x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            x = vb[off + k + 1] if k == -d or (k != d and vb[off + k - 1] < vb[off + k + 1]) else vb[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a0 + n - 1 - x] == b[b0 + m - 1 - y]:
+                x += 1; y += 1
+            vb[off + k] = x
+            if not odd and -d <= delta - k <= d and x + vf[off + delta - k] >= n:
+                return 2 * d, n - x, m - y, n - x0, m - y0
+    raise AssertionError("no middle snake")  # unreachable: d = (n + m) / 2 always overlaps
+
+
+def _trim(a: List[int], b: List[int], a0: int, a1: int, b0: int, b1: int) -> Tuple[int, int, int, int, int, int]:
+    """Common prefix / suffix lengths and the range left between them."""
+    p = 0
+    while a0 + p < a1 and b0 + p < b1 and a[a0 + p] == b[b0 + p]:
+        p += 1
+    s = 0
+    while a1 - s > a0 + p and b1 - s > b0 + p and a[a1 - 1 - s] == b[b1 - 1 - s]:
+        s += 1
+    return p, s, a0 + p, a1 - s, b0 + p, b1 - s
+
+
+def _myers(a: List[int], b: List[int], a0: int, a1: int, b0: int, b1: int, out: List[Block],
+           check: Callable[[], None]) -> None:
+    suffixes = []
+    while True:  # recurse on the left half, loop on the right (cost-capped splits can be lopsided)
+        p, s, a0, a1, b0, b1 = _trim(a, b, a0, a1, b0, b1)
+        if p:
+            out.append((a0 - p, b0 - p, p))
+        if s:
+            suffixes.append((a1, b1, s))
+        if a0 >= a1 or b0 >= b1:
+            break
+        d, x, y, u, v = _middle_snake(a, b, a0, a1 - a0, b0, b1 - b0, check)
+        if d <= 1:
+            break
+        _myers(a, b, a0, a0 + x, b0, b0 + y, out, check)
+        if u > x:
+            out.append((a0 + x, b0 + y, u - x))
+        a0, b0 = a0 + u, b0 + v
+    out.extend(reversed(suffixes))
+
+
+# ---------- patience ----------
+def _unique_anchors(a: List[int], b: List[int], a0: int, a1: int, b0: int, b1: int) -> List[Tuple[int, int]]:
+    """Longest increasing run of lines that occur exactly once on both sides (patience sorting)."""
+    seen_a: Dict[int, int] = {}
+    for i in range(a0, a1):
+        seen_a[a[i]] = -1 if a[i] in seen_a else i
+    seen_b: Dict[int, int] = {}
+    for j in range(b0, b1):
+        if b[j] in seen_a:  # only lines present on both sides matter
+            seen_b[b[j]] = -1 if b[j] in seen_b else j
+    pairs = [(seen_a[x], j) for x, j in seen_b.items() if j >= 0 and seen_a[x] >= 0]
+    if not pairs:
+        return []
+    pairs.sort()
+    tops: List[int] = []          # b index on top of each pile
+    piles: List[int] = []         # pair index on top of each pile
+    back: List[int] = [-1] * len(pairs)
+    for n, (_, j) in enumerate(pairs):
+        k = bisect_left(tops, j)
+        if k:
+            back[n] = piles[k - 1]
+        if k == len(tops):
+            tops.append(j); piles.append(n)
+        else:
+            tops[k] = j; piles[k] = n
+    chain, n = [], piles[-1]
+    while n >= 0:
+        chain.append(pairs[n])
+        n = back[n]
+    return chain[::-1]
+
+
+def _patience(a: List[int], b: List[int], a0: int, a1: int, b0: int, b1: int, out: List[Block],
+              check: Callable[[], None]) -> None:
+    p, s, a0, a1, b0, b1 = _trim(a, b, a0, a1, b0, b1)
+    if p:
+        out.append((a0 - p, b0 - p, p))
+    if a0 < a1 and b0 < b1:
+        check()
+        anchors = _unique_anchors(a, b, a0, a1, b0, b1)
+        if not anchors:
+            _myers(a, b, a0, a1, b0, b1, out, check)
+        else:
+            i0, j0 = a0, b0
+            for i, j in anchors:
+                if i > i0 or j > j0:  # most gaps between anchors are empty
+                    _patience(a, b, i0, i, j0, j, out, check)
+                out.append((i, j, 1))
+                i0, j0 = i + 1, j + 1
+            _patience(a, b, i0, a1, j0, b1, out, check)
+    if s:
+        out.append((a1, b1, s))
+
+
+# ---------- opcodes / unified output ----------
+def _opcodes(blocks: List[Block], n: int, m: int) -> List[Opcode]:
+    ops: List[Opcode] = []
+    i = j = 0
+    for bi, bj, size in sorted(blocks) + [(n, m, 0)]:
+        tag = "replace" if i < bi and j < bj else "delete" if i < bi else "insert" if j < bj else ""
+        if tag:
+            ops.append((tag, i, bi, j, bj))
+        if size:
+            if ops and ops[-1][0] == "equal":  # adjacent blocks merge
+                ops[-1] = ("equal", ops[-1][1], bi + size, ops[-1][3], bj + size)
+            else:
+                ops.append(("equal", bi, bi + size, bj, bj + size))
+        i, j = bi + size, bj + size
+    return ops
+
+
+def opcodes(a: List[str], b: List[str], algorithm: str = "patience",
+            check: Callable[[], None] = lambda: None) -> List[Opcode]:
+    """difflib.SequenceMatcher.get_opcodes() shaped edit script of a -> b."""
+    if algorithm == "difflib":
+        return difflib.SequenceMatcher(None, a, b).get_opcodes()
+    ia, ib = intern(a, b)
+    blocks: List[Block] = []
+    (_patience if algorithm == "patience" else _myers)(ia, ib, 0, len(ia), 0, len(ib), blocks, check)
+    return _opcodes(blocks, len(a), len(b))
+
+
+def _grouped(codes: List[Opcode], n: int = 3) -> List[List[Opcode]]:
+    """Hunks with n lines of context (same grouping as difflib)."""
+    codes = list(codes) or [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        t, i1, i2, j1, j2 = codes[0]
+        codes[0] = (t, max(i1, i2 - n), i2, max(j1, j2 - n), j2)
+    if codes[-1][0] == "equal":
+        t, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = (t, i1, min(i2, i1 + n), j1, min(j2, j1 + n))
+    groups, group = [], []
+    for t, i1, i2, j1, j2 in codes:
+        if t == "equal" and i2 - i1 > 2 * n:
+            group.append((t, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((t, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+    return groups
+
+
+def _range(start: int, stop: int) -> str:
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def format_unified(a: List[str], b: List[str], codes: List[Opcode], fromfile: str = "", tofile: str = "",
+                   n: int = 3) -> List[str]:
+    """Unified diff lines (no line terminators), as difflib.unified_diff(..., lineterm="") renders them."""
+    out: List[str] = []
+    for group in _grouped(codes, n):
+        if not out:
+            out += [f"--- {fromfile}", f"+++ {tofile}"]
+        out.append(f"@@ -{_range(group[0][1], group[-1][2])} +{_range(group[0][3], group[-1][4])} @@")
+        for t, i1, i2, j1, j2 in group:
+            if t == "equal":
+                out += [" " + x for x in a[i1:i2]]
+                continue
+            if t in ("replace", "delete"):
+                out += ["-" + x for x in a[i1:i2]]
+            if t in ("replace", "insert"):
+                out += ["+" + x for x in b[j1:j2]]
+    return out
+
+
+def change_counts(a: List[str], b: List[str]) -> Tuple[int, int]:
+    """(added, removed) lines by multiset difference: a cheap lower bound on the real diff."""
+    ca, cb = Counter(a), Counter(b)
+    return sum((cb - ca).values()), sum((ca - cb).values())
+
+
+class DiffEngine:
+    """
+    Line diffs for plans and previews with size and time budgets.
+
+    Lines are interned to ints, the common prefix/suffix is trimmed, and the rest
+    goes through patience diff (unique lines as anchors) with linear-space Myers
+    for regions without anchors. Inputs over max_bytes, changed regions over
+    max_lines, or a diff still running after `timeout` seconds degrade to a
+    summary ("too large, N lines changed") instead of pinning a core.
+    """
+
+    def __init__(self, algorithm: str = "patience", max_lines: int = 50_000, max_bytes: int = 16 * 1024 * 1024,
+                 timeout: float = 2.0, context: int = 3):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"algorithm must be one of {', '.join(ALGORITHMS)}")
+        self.algorithm = algorithm
+        self.max_lines, self.max_bytes, self.timeout, self.context = max_lines, max_bytes, timeout, context
+
+    def unified(self, a: List[str], b: List[str], fromfile: str = "", tofile: str = "") -> Tuple[List[str], Optional[Dict[str, Any]]]:
+        """(unified diff lines, None) or ([], summary) when a budget is exceeded."""
+        try:
+            if sum(map(len, a)) + sum(map(len, b)) > self.max_bytes:
+                raise DiffTooLarge("bytes")
+            p, s = 0, 0
+            while p < len(a) and p < len(b) and a[p] == b[p]:
+                p += 1
+            while s < len(a) - p and s < len(b) - p and a[-1 - s] == b[-1 - s]:
+                s += 1
+            if (len(a) - p - s) + (len(b) - p - s) > self.max_lines:
+                raise DiffTooLarge("lines")
+            deadline = time.perf_counter() + self.timeout
+
+            def check() -> None:
+                if time.perf_counter() > deadline:
+                    raise DiffTooLarge("timeout")
+            codes = opcodes(a, b, self.algorithm, check)
+        except DiffTooLarge as e:
+            added, removed = change_counts(a, b)
+            return [], {"too_large": True, "reason": e.reason, "added": added, "removed": removed,
+                        "message": f"too large to diff ({e.reason}), {added + removed} lines changed"}
+        return format_unified(a, b, codes, fromfile, tofile, self.context), None
+
+    def into(self, entry: Dict[str, Any], key: str, a: str, b: str, fromfile: str = "", tofile: str = "") -> Dict[str, Any]:
+        """entry[key] = diff lines of text a -> b; over budget it is [] and entry[key + "_summary"] says why."""
+        entry[key], summary = self.unified(a.splitlines(), b.splitlines(), fromfile, tofile)
+        if summary:
+            entry[key + "_summary"] = summary
+        return entry
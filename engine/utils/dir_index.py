@@ -0,0 +1,79 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class DirIndex:
+    """
+    Pre-sorted directory listing derived from snapshot paths.
+
+    Built once per snapshot version and then answers /repo/tree one level
+    (or a few) at a time without re-sorting or walking the whole snapshot.
+    Children are ordered the way the old build_tree produced them (by full
+    path, a directory sorting as "name/").
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        dirs: Dict[str, Tuple[set, List[str]]] = {"": (set(), [])}
+        for rel in paths:
+            parent, _, name = rel.rpartition("/")
+            ent = dirs.get(parent)
+            if ent is None:
+                # register the missing ancestor chain
+                child = parent
+                ent = dirs[parent] = (set(), [])
+                while child:
+                    up, _, leaf = child.rpartition("/")
+                    up_ent = dirs.get(up)
+                    if up_ent is not None:
+                        up_ent[0].add(leaf)
+                        break
+                    up_ent = dirs[up] = (set(), [])
+                    up_ent[0].add(leaf)
+                    child = up
+            ent[1].append(name)
+        self.children: Dict[str, List[Tuple[str, bool]]] = {}
+        for d, (subdirs, files) in dirs.items():
+            items = [(n, True) for n in subdirs] + [(n, False) for n in files]
+            items.sort(key=lambda it: it[0] + "/" if it[1] else it[0])
+            self.children[d] = items
+        # total files below each directory, deepest first so parents can sum children
+        self.file_counts: Dict[str, int] = {}
+        for d in sorted(self.children, key=lambda x: -x.count("/") - (1 if x else 0)):
+            self.file_counts[d] = sum(self.file_counts[_join(d, n)] if is_dir else 1 for n, is_dir in self.children[d])
+
+    def is_dir(self, path: str) -> bool:
+        return path in self.children
+
+    def node(self, path: str, depth: Optional[int], offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Directory node for `path` expanded `depth` levels (None = everything).
+        offset/limit page the children of the top node only; deeper levels are
+        returned whole. Unexpanded directories carry children=None + childCount.
+        """
+        name = path.rpartition("/")[2] if path else "/"
+        node = self._dir_node(name, path, depth)
+        kids = self.children.get(path, [])
+        if offset or limit is not None:
+            page = kids[offset: offset + limit if limit is not None else None]
+            node["children"] = [self._child(path, n, is_dir, depth) for n, is_dir in page] if depth != 0 else None
+            node["offset"], node["total"] = offset, len(kids)
+        return node
+
+    def _dir_node(self, name: str, path: str, depth: Optional[int]) -> Dict[str, Any]:
+        kids = self.children.get(path, [])
+        node: Dict[str, Any] = {"name": name, "path": path, "isDir": True,
+                                "childCount": len(kids), "fileCount": self.file_counts.get(path, 0)}
+        if depth is not None and depth <= 0:
+            node["children"] = None
+        else:
+            node["children"] = [self._child(path, n, is_dir, depth) for n, is_dir in kids]
+        return node
+
+    def _child(self, parent: str, name: str, is_dir: bool, depth: Optional[int]) -> Dict[str, Any]:
+        path = _join(parent, name)
+        if is_dir:
+            return self._dir_node(name, path, None if depth is None else depth - 1)
+        return {"name": name, "path": path, "isDir": False, "children": None}
+
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
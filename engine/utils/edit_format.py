@@ -0,0 +1,136 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+INSTRUCTIONS = """\
+For files that already exist, return only your edits instead of the full file when the change is small:
+  { "path": "relative/path", "edits": [ { "search": "exact current lines", "replace": "new lines" } ] }
+Each "search" must match the current file exactly once; include a few unchanged lines around the change
+to make it unique. A unified diff also works: { "path": "relative/path", "diff": "@@ -12,3 +12,4 @@\\n..." }.
+Use "code" with the FULL file content for new files or when most of a file changes."""
+
+_HUNK = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class EditError(ValueError):
+    pass
+
+
+def is_edit(entry: Dict[str, Any]) -> bool:
+    """files[] entry in edit form (no full `code`, but `edits` or `diff`)."""
+    return "code" not in entry and ("edits" in entry or "diff" in entry)
+
+
+def apply_edit(current: str, entry: Dict[str, Any]) -> Tuple[str, str]:
+    """(new text, format) for an edit-form entry applied to current; raises EditError."""
+    if "edits" in entry:
+        edits = entry["edits"]
+        if not isinstance(edits, list):
+            raise EditError("edits must be an array")
+        return apply_search_replace(current, edits), "search-replace"
+    if not isinstance(entry.get("diff"), str):
+        raise EditError("diff must be a string")
+    return apply_unified_diff(current, entry["diff"]), "unified-diff"
+
+
+# ---------- search / replace ----------
+def apply_search_replace(text: str, edits: List[Dict[str, Any]]) -> str:
+    for n, e in enumerate(edits):
+        search, replace = (e.get("search"), e.get("replace", "")) if isinstance(e, dict) else (None, None)
+        if not isinstance(search, str) or not isinstance(replace, str):
+            raise EditError(f"edit {n}: search and replace must be strings")
+        if not search:
+            text += replace  # nothing to find: append
+            continue
+        count = text.count(search)
+        if count == 1:
+            text = text.replace(search, replace, 1)
+            continue
+        if count > 1:
+            raise EditError(f"edit {n}: search text matches {count} places; include more surrounding lines")
+        text = _replace_lines(text, search, replace, n)
+    return text
+
+
+def _indent(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _replace_lines(text: str, search: str, replace: str, n: int) -> str:
+    """Whole-line match ignoring trailing whitespace, then ignoring indentation (re-indenting replace)."""
+    lines = text.splitlines(keepends=True)
+    want = search.strip("\n").splitlines()
+    for norm in (str.rstrip, str.strip):
+        target = [norm(w) for w in want]
+        hits = [i for i in range(len(lines) - len(want) + 1)
+                if all(norm(lines[i + k]) == target[k] for k in range(len(want)))]
+        if len(hits) > 1:
+            raise EditError(f"edit {n}: search text matches {len(hits)} places; include more surrounding lines")
+        if hits:
+            i = hits[0]
+            block = replace.strip("\n").splitlines() if replace.strip("\n") else []
+            if norm is str.strip:
+                first = next((w for w in want if w.strip()), "")
+                found = next((lines[i + k] for k, w in enumerate(want) if w.strip()), "")
+                old, new = _indent(first), _indent(found)
+                block = [new + b[len(old):] if b.startswith(old) else b for b in block]
+            eol = "\n" if lines[i + len(want) - 1].endswith("\n") else ""
+            out = "\n".join(block) + eol if block else ""
+            return "".join(lines[:i]) + out + "".join(lines[i + len(want):])
+    raise EditError(f"edit {n}: search text not found in the current file")
+
+
+# ---------- unified diff ----------
+def _parse_hunks(diff: str) -> List[Tuple[int, List[Tuple[str, str]]]]:
+    hunks: List[Tuple[int, List[Tuple[str, str]]]] = []
+    cur: Optional[List[Tuple[str, str]]] = None
+    lines = diff.splitlines()
+    for i, line in enumerate(lines):
+        m = _HUNK.match(line)
+        if m:
+            cur = []
+            hunks.append((int(m.group(1)), cur))
+            continue
+        if cur is None or line.startswith(("diff ", "index ")):
+            continue
+        # a removed "-- x" line also starts with "--- "; only a ---/+++ pair is a file header
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ ") \
+                or line.startswith("+++ ") and i > 0 and lines[i - 1].startswith("--- "):
+            continue
+        if line.startswith("\\"):
+            continue  # "\ No newline at end of file"
+        tag, body = (line[0], line[1:]) if line[:1] in (" ", "+", "-") else (" ", line)  # bare blank context line
+        cur.append((tag, body))
+    return hunks
+
+
+def _locate(lines: List[str], old: List[str], expected: int) -> Optional[int]:
+    """Start of `old` in lines nearest to expected (exact, then ignoring trailing whitespace)."""
+    if not old:
+        return max(0, min(expected, len(lines)))
+    span = len(lines) - len(old)
+    order = sorted(range(span + 1), key=lambda i: abs(i - expected))
+    for norm in (lambda s: s, str.rstrip):
+        target = [norm(o) for o in old]
+        for i in order:
+            if norm(lines[i]) == target[0] and all(norm(lines[i + k]) == target[k] for k in range(1, len(old))):
+                return i
+    return None
+
+
+def apply_unified_diff(text: str, diff: str) -> str:
+    hunks = _parse_hunks(diff)
+    if not hunks:
+        raise EditError("diff has no @@ hunks")
+    lines = text.splitlines()
+    trailing_nl = text.endswith("\n") or not text
+    shift = 0
+    for n, (old_start, body) in enumerate(hunks):
+        old = [b for t, b in body if t in " -"]
+        new = [b for t, b in body if t in " +"]
+        stated = old_start - 1 if old else old_start  # a pure insertion goes after line old_start
+        pos = _locate(lines, old, max(0, stated + shift))
+        if pos is None:
+            raise EditError(f"hunk {n} (@@ -{old_start}) does not match the current file")
+        lines[pos:pos + len(old)] = new
+        shift = pos - stated + len(new) - len(old)  # where the next hunk's stated line ended up
+    return "\n".join(lines) + ("\n" if trailing_nl and lines else "")
@@ -0,0 +1,66 @@
+import json, queue, threading
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def sse_frame(ev: Dict[str, Any]) -> str:
+    """One text/event-stream frame; the event name is ev["type"]."""
+    return f"event: {ev.get('type', 'message')}\ndata: {json.dumps(ev)}\n\n"
+
+
+class EventHub:
+    """
+    Fan-out of engine events to any number of SSE subscribers.
+
+    publish() never blocks: a subscriber that falls behind gets its backlog
+    replaced by a single {"type": "reset"} so it refetches instead of
+    replaying stale deltas.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._subs: List["queue.Queue[Dict[str, Any]]"] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> "queue.Queue[Dict[str, Any]]":
+        q: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=self.maxsize)
+        with self._lock:
+            self._subs.append(q)
+        return q
+
+    def unsubscribe(self, q: "queue.Queue[Dict[str, Any]]") -> None:
+        with self._lock:
+            if q in self._subs:
+                self._subs.remove(q)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subs = list(self._subs)
+        for q in subs:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                try:
+                    while True:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait({"type": "reset", "reason": "subscriber overflow"})
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subs)
+
+    def stream(self, q: "queue.Queue[Dict[str, Any]]", keepalive: float = 15.0,
+               stop: Optional[threading.Event] = None) -> Iterator[str]:
+        """text/event-stream frames for one subscriber; unsubscribes when the client goes away."""
+        try:
+            yield ": connected\n\n"
+            while stop is None or not stop.is_set():
+                try:
+                    ev = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_frame(ev)
+        finally:
+            self.unsubscribe(q)
@@ -0,0 +1,73 @@
+import codecs, mmap, os
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+SNIFF_BYTES = 8192
+MAX_INLINE_BYTES = 8 * 1024 * 1024  # larger files come back as metadata only (use ranges or the stream)
+STREAM_CHUNK = 64 * 1024
+
+
+def looks_binary(sample: bytes) -> bool:
+    """Same heuristic as git/grep: a NUL byte in the first block means binary."""
+    return b"\0" in sample
+
+
+def sniff(abs_path: str) -> bytes:
+    with open(abs_path, "rb") as fh:
+        return fh.read(SNIFF_BYTES)
+
+
+def read_range(abs_path: str, offset: int, length: Optional[int]) -> Tuple[bytes, Dict[str, Any]]:
+    """Bytes [offset, offset+length) served from an mmap, so only the touched pages are read."""
+    with open(abs_path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        start = min(max(0, offset), size)
+        end = size if length is None else min(size, start + max(0, length))
+        if start >= end:
+            data = b""
+        else:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[start:end]
+    return data, {"offset": start, "length": len(data), "eof": end >= size}
+
+
+def read_lines(abs_path: str, start_line: int, end_line: Optional[int]) -> Tuple[bytes, Dict[str, Any]]:
+    """1-based inclusive line range; newline scanning happens inside the mmap (no full decode)."""
+    start_line = max(1, start_line)
+    with open(abs_path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            return b"", {"start_line": start_line, "end_line": start_line - 1, "offset": 0, "length": 0, "eof": True}
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos, line = 0, 1
+            while line < start_line and pos < size:
+                nl = mm.find(b"\n", pos)
+                if nl < 0:
+                    pos = size
+                    break
+                pos, line = nl + 1, line + 1
+            start, end, last = pos, pos, line - 1
+            while end < size and (end_line is None or last < end_line):
+                nl = mm.find(b"\n", end)
+                end = size if nl < 0 else nl + 1
+                last += 1
+            data = mm[start:end]
+    return data, {"start_line": start_line, "end_line": last, "offset": start, "length": len(data), "eof": end >= size}
+
+
+def iter_text(abs_path: str, chunk: int = STREAM_CHUNK) -> Iterator[str]:
+    """Decoded text chunks for streaming; multi-byte chars and \\r\\n never split across chunks."""
+    dec = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending_cr = False
+    with open(abs_path, "rb") as fh:
+        while True:
+            block = fh.read(chunk)
+            text = dec.decode(block, final=not block)
+            if pending_cr:
+                text = "\r" + text
+            pending_cr = text.endswith("\r") and bool(block)
+            if pending_cr:
+                text = text[:-1]
+            if text:
+                yield text.replace("\r\n", "\n").replace("\r", "\n")
+            if not block:
+                break
@@ -0,0 +1,240 @@
+import ctypes, ctypes.util, errno, os, select, struct, sys, threading, time
+from typing import Any, Callable, Dict, Optional, Set
+
+from utils.snapshot_engine import SnapshotEngine
+
+# inotify(7) constants
+IN_MODIFY, IN_CLOSE_WRITE = 0x2, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF = 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+IN_ONLYDIR, IN_DONTFOLLOW, IN_EXCL_UNLINK = 0x01000000, 0x02000000, 0x04000000
+_WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+               | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONTFOLLOW | IN_EXCL_UNLINK)
+_EVENT_HDR = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Minimal ctypes binding; raises OSError when inotify is unavailable."""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is Linux-only")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add(self, path: str) -> int:
+        wd = self._add(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, f"inotify_add_watch {path}: {os.strerror(e)}")
+        return wd
+
+    def read(self, timeout: float):
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return
+        try:
+            buf = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return
+        off = 0
+        while off + _EVENT_HDR.size <= len(buf):
+            wd, mask, _cookie, ln = _EVENT_HDR.unpack_from(buf, off)
+            off += _EVENT_HDR.size
+            name = os.fsdecode(buf[off:off + ln].rstrip(b"\0"))
+            off += ln
+            yield wd, mask, name
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class FsWatcher:
+    """
+    Keeps a SnapshotEngine current while files change outside DevPilot.
+
+    mode "inotify" watches every non-ignored directory the engine knows about;
+    "poll" runs the engine's dir-mtime rescan every `poll_interval` seconds and
+    re-stats all files every `restat_every` polls (in-place edits do not move
+    directory mtimes). "auto" prefers inotify and falls back to polling, also
+    when the inotify watch limit is hit.
+
+    Raw events are only collected as dirty paths; once the tree has been quiet
+    for `debounce_ms` (or `max_delay_ms` passed since the first event) they are
+    applied in one go through the engine, so a `git checkout` or `npm install`
+    burst becomes a single delta. Directory-level events fold into one rescan.
+    """
+
+    def __init__(self, engine: SnapshotEngine, mode: str = "auto", debounce_ms: int = 300,
+                 max_delay_ms: int = 3000, poll_interval: float = 2.0, restat_every: int = 10,
+                 logger: Optional[Callable[[str], None]] = None):
+        self.engine = engine
+        self.requested_mode = mode
+        self.mode = mode
+        self.debounce = max(0, debounce_ms) / 1000.0
+        self.max_delay = max(debounce_ms, max_delay_ms) / 1000.0
+        self.poll_interval = poll_interval
+        self.restat_every = max(1, restat_every)
+        self.logger = logger or (lambda _msg: None)
+        self.stats: Dict[str, Any] = {"events": 0, "flushes": 0, "rescans": 0, "watches": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ino: Optional[_Inotify] = None
+        self._wd_dir: Dict[int, str] = {}
+        self._dir_wd: Dict[str, int] = {}
+
+    # ---------- lifecycle ----------
+    def start(self) -> "FsWatcher":
+        if self.requested_mode in ("auto", "inotify"):
+            try:
+                self._ino = _Inotify()
+                self._watch_known_dirs()
+                self.mode = "inotify"
+            except OSError as e:
+                self._close_inotify()
+                if self.requested_mode == "inotify":
+                    raise
+                self.logger(f"watch: inotify unavailable ({e}); polling every {self.poll_interval}s")
+                self.mode = "poll"
+        else:
+            self.mode = "poll"
+        target = self._run_inotify if self.mode == "inotify" else self._run_poll
+        self._thread = threading.Thread(target=target, name="devpilot-watch", daemon=True)
+        self._thread.start()
+        self.logger(f"watch: started ({self.mode}) on {self.engine.repo_root}")
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._close_inotify()
+        self.logger("watch: stopped")
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def status(self) -> Dict[str, Any]:
+        return {"running": self.running, "mode": self.mode, "debounce_ms": int(self.debounce * 1000), **self.stats}
+
+    # ---------- inotify ----------
+    def _close_inotify(self):
+        if self._ino:
+            self._ino.close()
+        self._ino = None
+        self._wd_dir.clear()
+        self._dir_wd.clear()
+
+    def _watch(self, rel_dir: str) -> None:
+        if rel_dir in self._dir_wd or self._ino is None:
+            return
+        wd = self._ino.add(self.engine._abs(rel_dir))
+        self._wd_dir[wd] = rel_dir
+        self._dir_wd[rel_dir] = wd
+        self.stats["watches"] = len(self._dir_wd)
+
+    def _watch_known_dirs(self) -> None:
+        with self.engine.lock:
+            dirs = list(self.engine.dirs.keys())
+        for d in dirs:
+            try:
+                self._watch(d)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise  # ENOSPC: fs.inotify.max_user_watches exhausted
+
+    def _run_inotify(self) -> None:
+        files: Set[str] = set()
+        dirty_dirs = False
+        first = last = 0.0
+        try:
+            while not self._stop.is_set():
+                timeout = self.debounce if (files or dirty_dirs) else 1.0
+                got = False
+                for wd, mask, name in self._ino.read(timeout):  # type: ignore[union-attr]
+                    got = True
+                    self.stats["events"] += 1
+                    if mask & IN_Q_OVERFLOW:
+                        dirty_dirs = True
+                        continue
+                    if mask & IN_IGNORED:
+                        d = self._wd_dir.pop(wd, None)
+                        if d is not None:
+                            self._dir_wd.pop(d, None)
+                        continue
+                    parent = self._wd_dir.get(wd)
+                    if parent is None:
+                        continue
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        dirty_dirs = True
+                        continue
+                    rel = f"{parent}/{name}" if parent else name
+                    if mask & IN_ISDIR:
+                        if self.engine.matcher.match_dir(rel) is None:
+                            dirty_dirs = True
+                    elif name and not self.engine.matcher.is_ignored(rel):
+                        files.add(rel)
+                now = time.monotonic()
+                if got:
+                    first = first or now
+                    last = now
+                pending = files or dirty_dirs
+                if pending and (now - last >= self.debounce or now - first >= self.max_delay):
+                    self._flush(files, dirty_dirs)
+                    files, dirty_dirs, first = set(), False, 0.0
+        except Exception as e:
+            self.logger(f"watch: inotify loop failed: {e}")
+        finally:
+            self._close_inotify()
+
+    def _flush(self, files: Set[str], dirty_dirs: bool) -> None:
+        self.stats["flushes"] += 1
+        if dirty_dirs:
+            self.stats["rescans"] += 1
+            self.engine.rescan()
+            if self.mode == "inotify":
+                try:
+                    self._watch_known_dirs()
+                except OSError as e:
+                    self.logger(f"watch: cannot add watches ({e}); switching to polling")
+                    self._stop.set()
+                    threading.Thread(target=self._fallback_to_poll, daemon=True).start()
+        if files:
+            self.engine.refresh_paths(files)
+
+    def _fallback_to_poll(self) -> None:
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._stop = threading.Event()
+        self.mode = "poll"
+        self._thread = threading.Thread(target=self._run_poll, name="devpilot-watch", daemon=True)
+        self._thread.start()
+
+    # ---------- polling ----------
+    def _run_poll(self) -> None:
+        n = 0
+        while not self._stop.wait(self.poll_interval):
+            n += 1
+            try:
+                self.engine.rescan()
+                self.stats["rescans"] += 1
+                if n % self.restat_every == 0:
+                    with self.engine.lock:
+                        paths = list(self.engine.snapshot.keys())
+                    self.engine.refresh_paths(paths)
+                self.stats["flushes"] += 1
+            except Exception as e:
+                self.logger(f"watch: poll failed: {e}")
@@ -1,20 +1,87 @@
-import subprocess, os
+import subprocess, os, re
 from pathlib import Path
-from typing import Optional, List, Callable
+from typing import Optional, List, Callable, Dict
+
+from utils.job_queue import run_command
 
 class GitTaskManager:
     def __init__(self, repo_root: str, logger: Optional[Callable[[str], None]] = None):
         self.repo_root = str(Path(repo_root).resolve())
         self.logger = logger or (lambda _msg: None)
 
-    def _run(self, args: List[str]) -> subprocess.CompletedProcess:
+    def _run(self, args: List[str], quiet: bool = False) -> subprocess.CompletedProcess:
+        """quiet=True keeps (potentially huge) stdout out of the log."""
         cmd = ["git", "-C", self.repo_root] + args
         self.logger("$ " + " ".join(cmd))
-        r = subprocess.run(cmd, text=True, capture_output=True, check=False)
-        if r.stdout: self.logger(r.stdout.strip())
+        r = run_command(cmd, text=True, encoding="utf-8", errors="surrogateescape")  # killable when run as a job
+        if r.stdout and not quiet: self.logger(r.stdout.strip())
         if r.stderr: self.logger(r.stderr.strip())
         return r
 
+    def is_repo(self) -> bool:
+        r = self._run(["rev-parse", "--is-inside-work-tree"])
+        return r.returncode == 0 and r.stdout.strip() == "true"
+
+    def index_entries(self) -> Dict[str, dict]:
+        """
+        Tracked files straight from the index (one `git ls-files -z --stage --debug`):
+        {path: {"mode", "sha", "stage", "size", "mtime_ns"}}. size/mtime are the values
+        recorded in the index, i.e. as of the last add/refresh.
+        """
+        r = self._run(["ls-files", "-z", "--stage", "--debug"], quiet=True)
+        if r.returncode != 0:
+            raise RuntimeError(r.stderr or "git ls-files failed")
+        out: Dict[str, dict] = {}
+        chunks = r.stdout.split("\0")
+        header = chunks[0]
+        for chunk in chunks[1:]:
+            # each chunk = debug block of the previous entry + header of the next one
+            cut = chunk.find("\n", chunk.find("flags: "))
+            debug, nxt = (chunk[:cut], chunk[cut + 1:]) if cut >= 0 else (chunk, "")
+            meta, _, path = header.partition("\t")
+            parts = meta.split()
+            if len(parts) == 3 and path:
+                size = re.search(r"size: (\d+)", debug)
+                mtime = re.search(r"mtime: (\d+):(\d+)", debug)
+                out[path] = {
+                    "mode": parts[0], "sha": parts[1], "stage": int(parts[2]),
+                    "size": int(size.group(1)) if size else 0,
+                    "mtime_ns": int(mtime.group(1)) * 1_000_000_000 + int(mtime.group(2)) if mtime else 0,
+                }
+            header = nxt
+        return out
+
+    def status_entries(self) -> Dict[str, str]:
+        """
+        One `git status --porcelain=v2 -z --untracked-files=all`: {path: XY} for changed
+        entries, "??" for untracked files and "UU"-style codes for unmerged paths.
+        """
+        r = self._run(["status", "--porcelain=v2", "-z", "--untracked-files=all", "--ignore-submodules=all"], quiet=True)
+        if r.returncode != 0:
+            raise RuntimeError(r.stderr or "git status failed")
+        out: Dict[str, str] = {}
+        recs = r.stdout.split("\0")
+        i = 0
+        while i < len(recs):
+            rec = recs[i]
+            i += 1
+            if not rec:
+                continue
+            kind = rec[0]
+            if kind == "?":
+                out[rec[2:]] = "??"
+            elif kind == "1":
+                f = rec.split(" ", 8)
+                if len(f) == 9: out[f[8]] = f[1]
+            elif kind == "2":
+                f = rec.split(" ", 9)
+                if len(f) == 10: out[f[9]] = f[1]
+                i += 1  # skip the original path record of a rename/copy
+            elif kind == "u":
+                f = rec.split(" ", 10)
+                if len(f) == 11: out[f[10]] = f[1]
+        return out
+
     def current_branch(self) -> str:
         r = self._run(["rev-parse", "--abbrev-ref", "HEAD"])
         return r.stdout.strip()
@@ -0,0 +1,164 @@
+import hashlib, threading, time, weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GITHUB_API = "https://api.github.com"
+
+
+def fingerprint(secret: Optional[str]) -> str:
+    """Short, non-reversible tag for a key/token (so pools can be keyed on it without storing it)."""
+    return hashlib.sha256((secret or "").encode("utf-8")).hexdigest()[:12]
+
+
+def origin(url: str) -> str:
+    u = urlsplit(url)
+    return f"{u.scheme}://{u.netloc}"
+
+
+class _PoolCounter:
+    """
+    Request / new-connection counts for an httpx-style client (the OpenAI SDK's), fed by
+    its response hook. Works on whichever httpx flavour the installed SDK is built on.
+    """
+
+    def __init__(self, client: Any):
+        self.requests = 0
+        self.opened = 0
+        self._pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        self._seen: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        client.event_hooks["response"].append(self.on_response)
+
+    def connections(self) -> list:
+        return list(getattr(self._pool, "connections", None) or ())
+
+    def on_response(self, _response: Any) -> None:
+        with self._lock:
+            self.requests += 1
+            for conn in self.connections():
+                if conn not in self._seen:
+                    self._seen.add(conn)
+                    self.opened += 1
+
+
+class _Slot:
+    __slots__ = ("sig", "client", "pool", "target", "created_at", "closer")
+
+    def __init__(self, sig: Tuple[Any, ...], client: Any, pool: Any, target: str, closer: Callable[[], None]):
+        self.sig, self.client, self.target, self.closer = sig, client, target, closer
+        self.pool = pool  # requests.Session or _PoolCounter, for stats()
+        self.created_at = time.time()
+
+
+class ClientPool:
+    """
+    Long-lived HTTP clients with keep-alive connection pools, one per named slot
+    ("openai", "http-provider", "github").
+
+    A slot is created on first use and reused while its signature (API key
+    fingerprint, base URL / origin) stays the same; a changed signature (e.g. a new
+    key or endpoint saved through /settings) closes the old client and builds a new
+    one. stats() reports requests, connections opened and the reuse rate per slot.
+    """
+
+    def __init__(self, max_connections: int = 16, logger: Optional[Callable[[str], None]] = None):
+        self.max_connections = max_connections
+        self.logger = logger or (lambda _msg: None)
+        self._slots: Dict[str, _Slot] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, sig: Tuple[Any, ...], build: Callable[[], _Slot]) -> Any:
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is not None and slot.sig == sig:
+                return slot.client
+            if slot is not None:
+                self.logger(f"http clients: rebuilding {name} ({slot.target} -> settings changed)")
+                self._close(slot)
+            slot = self._slots[name] = build()
+            return slot.client
+
+    @staticmethod
+    def _close(slot: _Slot) -> None:
+        try:
+            slot.closer()
+        except Exception:
+            pass
+
+    # ---------- clients ----------
+    def session(self, name: str, url: str, headers: Optional[Dict[str, str]] = None,
+                secret: Optional[str] = None) -> requests.Session:
+        """requests.Session for url's origin with headers baked in; secret is whatever those headers carry."""
+        target = origin(url)
+        sig = (target, fingerprint(secret))
+
+        def build() -> _Slot:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_connections)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update(headers or {})
+            return _Slot(sig, s, s, target, s.close)
+        return self._get(name, sig, build)
+
+    def openai(self, api_key: str, base_url: Optional[str] = None):
+        """OpenAI client on a shared keep-alive pool (the SDK's own httpx client, kept for reuse)."""
+        from openai import DefaultHttpxClient, OpenAI
+        sig = (fingerprint(api_key), base_url)
+
+        def build() -> _Slot:
+            http = DefaultHttpxClient()
+            counter = _PoolCounter(http)
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http)
+            return _Slot(sig, client, counter, base_url or str(client.base_url), http.close)
+        return self._get("openai", sig, build)
+
+    def github(self, token: str) -> requests.Session:
+        return self.session("github", GITHUB_API, secret=token,
+                            headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json"})
+
+    # ---------- housekeeping ----------
+    def reset(self, name: Optional[str] = None) -> int:
+        with self._lock:
+            names = [name] if name is not None else list(self._slots)
+            gone = [self._slots.pop(n) for n in names if n in self._slots]
+        for slot in gone:
+            self._close(slot)
+        return len(gone)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            slots = dict(self._slots)
+        out = {}
+        for name, slot in slots.items():
+            if isinstance(slot.pool, _PoolCounter):
+                kind, s = "httpx", self._httpx_stats(slot.pool)
+            else:
+                kind, s = "requests", self._requests_stats(slot.pool)
+            s["reuse_rate"] = round(1 - s["connections_opened"] / s["requests"], 3) if s["requests"] else None
+            out[name] = {"kind": kind, "target": slot.target, "created_at": slot.created_at, **s}
+        return out
+
+    @staticmethod
+    def _httpx_stats(counter: _PoolCounter) -> Dict[str, Any]:
+        conns = counter.connections()
+        return {"requests": counter.requests, "connections_opened": counter.opened,
+                "open": len(conns), "idle": sum(1 for c in conns if c.is_idle())}
+
+    @staticmethod
+    def _requests_stats(session: requests.Session) -> Dict[str, Any]:
+        reqs = opened = idle = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                reqs += pool.num_requests
+                opened += pool.num_connections
+                if pool.pool is not None:
+                    idle += sum(1 for c in list(pool.pool.queue) if c is not None and getattr(c, "sock", None) is not None)
+        return {"requests": reqs, "connections_opened": opened, "open": idle, "idle": idle}
@@ -0,0 +1,53 @@
+import fnmatch, os, re
+from typing import Dict, List, Optional
+
+
+class IgnoreMatcher:
+    """
+    Compiled form of an ignore list (fnmatch globs, '#' comments skipped).
+
+    All patterns are folded into one regex with a named group per pattern, so
+    a lookup is a single match() and still tells which pattern fired.
+    Semantics follow the old per-pattern loop: fnmatch against the repo-relative
+    posix path, plus 'X/**' also matching the path 'X' itself.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = [p for p in patterns if p and not p.startswith("#")]
+        self._norm = os.path.normcase if os.path.normcase("A/b") != "A/b" else None
+        file_alts, dir_alts = [], []
+        for i, pat in enumerate(self.patterns):
+            p = self._norm(pat) if self._norm else pat
+            body = fnmatch.translate(p)
+            if pat.endswith("/**"):
+                body = f"(?:{body})|(?:{fnmatch.translate(p[:-3])})"
+            file_alts.append(f"(?P<p{i}>{body})")
+            # a directory can be skipped wholesale only when everything below it
+            # matches too, i.e. the pattern ends in '*' and already matches 'dir/'
+            if pat.endswith("*"):
+                dir_alts.append(f"(?P<p{i}>{body})")
+        self._file_re = re.compile("|".join(file_alts)) if file_alts else None
+        self._dir_re = re.compile("|".join(dir_alts)) if dir_alts else None
+        self._sep = os.sep if self._norm else "/"
+
+    def match(self, rel_posix: str) -> Optional[int]:
+        """Index of the pattern that ignores this file, or None."""
+        if self._file_re is None:
+            return None
+        m = self._file_re.match(self._norm(rel_posix) if self._norm else rel_posix)
+        return int(m.lastgroup[1:]) if m else None  # type: ignore[index]
+
+    def match_dir(self, rel_dir: str) -> Optional[int]:
+        """Index of the pattern that ignores every path below this directory, or None."""
+        if self._dir_re is None or not rel_dir:
+            return None
+        probe = self._norm(rel_dir) + self._sep if self._norm else rel_dir + "/"
+        m = self._dir_re.match(probe)
+        return int(m.lastgroup[1:]) if m else None  # type: ignore[index]
+
+    def is_ignored(self, rel_posix: str) -> bool:
+        return self.match(rel_posix) is not None
+
+    def report(self, file_hits: Dict[int, int], dir_hits: Dict[int, int]) -> List[dict]:
+        return [{"pattern": p, "files": file_hits.get(i, 0), "dirs_pruned": dir_hits.get(i, 0)}
+                for i, p in enumerate(self.patterns)]
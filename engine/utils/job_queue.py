@@ -0,0 +1,238 @@
+import contextvars, os, signal, subprocess, threading, time, uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.event_hub import EventHub
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+_current: "contextvars.ContextVar[Optional[Job]]" = contextvars.ContextVar("current_job", default=None)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobRejected(Exception):
+    """The queue is full."""
+
+
+class Job:
+    __slots__ = ("id", "kind", "lane", "status", "created_at", "started_at", "finished_at", "result", "error",
+                 "progress", "_cancel", "_on_cancel", "_lock", "_hub")
+
+    def __init__(self, kind: str, lane: str, hub: EventHub):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind, self.lane = kind, lane
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.progress: List[Dict[str, Any]] = []   # last few progress events, for pollers
+        self._cancel = threading.Event()
+        self._on_cancel: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._hub = hub
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self) -> None:
+        """Raise JobCancelled if cancel() was called; long steps call this between units of work."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        with self._lock:
+            callbacks = list(self._on_cancel)
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception:
+                pass
+
+    def on_cancel(self, cb: Callable[[], None]) -> None:
+        with self._lock:
+            self._on_cancel.append(cb)
+        if self._cancel.is_set():
+            cb()
+
+    def off_cancel(self, cb: Callable[[], None]) -> None:
+        with self._lock:
+            if cb in self._on_cancel:
+                self._on_cancel.remove(cb)
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        ev = {**event, "type": "progress", "job": self.id, "kind": self.kind, "event": event.get("type")}
+        with self._lock:
+            self.progress.append(ev)
+            del self.progress[:-20]
+        self._hub.publish(ev)
+
+    def to_dict(self, result: bool = True) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        d = {"id": self.id, "kind": self.kind, "lane": self.lane, "status": self.status,
+             "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+             "wait_ms": int(((self.started_at or end) - self.created_at) * 1000),
+             "run_ms": int((end - self.started_at) * 1000) if self.started_at else None,
+             "error": self.error, "progress": self.progress[-1] if self.progress else None}
+        if result:
+            d["result"] = self.result
+        return d
+
+
+class JobQueue:
+    """
+    Background jobs for long operations (model calls, hooks, git push, scans).
+
+    submit() returns at once; the job runs on its own thread once a slot in its
+    lane is free (lanes bound concurrency per kind of work, e.g. one git
+    operation at a time). Status changes and job progress are published on
+    self.events for SSE; finished jobs are kept for polling up to `history`.
+    Cancellation is cooperative (Job.check()) plus whatever the job registered
+    with on_cancel(), e.g. killing its subprocess via run_command().
+    """
+
+    def __init__(self, lanes: Dict[str, int], history: int = 200, max_pending: int = 100,
+                 logger: Optional[Callable[[str], None]] = None):
+        self.lanes = {name: threading.BoundedSemaphore(n) for name, n in lanes.items()}
+        self.limits = dict(lanes)
+        self.history = history
+        self.max_pending = max_pending
+        self.logger = logger or (lambda _msg: None)
+        self.events = EventHub()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, lane: str, fn: Callable[..., Any], *args: Any) -> Job:
+        if lane not in self.lanes:
+            raise KeyError(lane)
+        job = Job(kind, lane, self.events)
+        with self._lock:
+            if sum(1 for j in self._jobs.values() if j.status == QUEUED) >= self.max_pending:
+                raise JobRejected(f"{self.max_pending} jobs already queued")
+            self._jobs[job.id] = job
+            self._trim()
+        self._publish(job)
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(self._run, job, fn, args), name=f"job-{kind}-{job.id}",
+                         daemon=True).start()
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any], args: tuple) -> None:
+        sem = self.lanes[job.lane]
+        while not sem.acquire(timeout=0.5):
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                return
+        try:
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                return
+            job.status, job.started_at = RUNNING, time.time()
+            self._publish(job)
+            _current.set(job)
+            try:
+                job.result = fn(job, *args)
+                self._finish(job, CANCELLED if job.cancelled else DONE)
+            except JobCancelled:
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                job.error = {"status": getattr(e, "status_code", 500), "detail": getattr(e, "detail", None) or str(e)}
+                self.logger(f"job {job.kind} {job.id} failed: {job.error['detail']}")
+                self._finish(job, CANCELLED if job.cancelled else FAILED)
+        finally:
+            _current.set(None)
+            sem.release()
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status, job.finished_at = status, time.time()
+        self._publish(job)
+
+    def _publish(self, job: Job) -> None:
+        self.events.publish({"type": "job", **job.to_dict(result=False)})
+
+    def _trim(self) -> None:
+        done = [jid for jid, j in self._jobs.items() if j.status in FINISHED]
+        for jid in done[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, status: Optional[str] = None, kind: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [j for j in reversed(jobs) if (status is None or j.status == status) and (kind is None or j.kind == kind)]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None and job.status not in FINISHED:
+            job.cancel()
+        return job
+
+    def shutdown(self) -> None:
+        for job in self.list():
+            if job.status not in FINISHED:
+                job.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        jobs = self.list()
+        return {"lanes": {name: {"limit": n, "running": sum(1 for j in jobs if j.lane == name and j.status == RUNNING),
+                                 "queued": sum(1 for j in jobs if j.lane == name and j.status == QUEUED)}
+                          for name, n in self.limits.items()},
+                "jobs": len(jobs), "subscribers": self.events.subscribers}
+
+
+def current_job() -> Optional[Job]:
+    return _current.get()
+
+
+def emit(event: Dict[str, Any]) -> None:
+    """Progress event for the job running on this thread (no-op outside a job)."""
+    job = _current.get()
+    if job is not None:
+        job.emit(event)
+
+
+def _kill(p: subprocess.Popen) -> None:
+    try:
+        if os.name == "posix":
+            os.killpg(p.pid, signal.SIGKILL)  # shell=True: take the children with it
+        else:
+            p.kill()
+    except (OSError, ProcessLookupError):
+        pass
+
+
+def run_command(args: Any, timeout: Optional[float] = None, **kwargs: Any) -> subprocess.CompletedProcess:
+    """
+    subprocess.run(args, capture_output=True, ...) that a cancelled job can kill.
+    Outside a job this is plain subprocess.run; inside one the process (and its
+    process group on POSIX) is killed on cancel and JobCancelled is raised.
+    """
+    job = _current.get()
+    if job is None:
+        return subprocess.run(args, capture_output=True, timeout=timeout, **kwargs)
+    job.check()
+    if os.name == "posix":
+        kwargs.setdefault("start_new_session", True)
+    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs) as p:
+        kill = lambda: _kill(p)
+        job.on_cancel(kill)
+        try:
+            out, err = p.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill(p)
+            p.communicate()
+            raise
+        finally:
+            job.off_cancel(kill)
+    job.check()
+    return subprocess.CompletedProcess(args, p.returncode, out, err)
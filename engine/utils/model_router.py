@@ -0,0 +1,176 @@
+import contextvars, threading, time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# histogram bucket upper bounds (ms); the last bucket is everything slower
+BUCKETS_MS = (100, 200, 400, 800, 1600, 3200, 6400, 12800, 25600, 51200, 102400)
+
+
+class AllProvidersFailed(Exception):
+    def __init__(self, errors: Dict[str, BaseException]):
+        super().__init__("; ".join(f"{name}: {getattr(e, 'detail', None) or e}" for name, e in errors.items()))
+        self.errors = errors
+
+
+class ProviderStats:
+    """Latency of recent successful calls (for percentiles), outcomes of recent calls, and an all-time histogram."""
+
+    def __init__(self, window: int):
+        self.latencies: "deque[float]" = deque(maxlen=window)   # seconds
+        self.outcomes: "deque[bool]" = deque(maxlen=window)
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+        self.calls = self.failures = self.wins = self.hedges = 0
+
+    def record(self, ok: bool, seconds: float) -> None:
+        self.calls += 1
+        self.outcomes.append(ok)
+        if not ok:
+            self.failures += 1
+            return
+        self.latencies.append(seconds)
+        self.histogram[bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def failure_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        ms = lambda s: None if s is None else int(s * 1000)
+        labels = [f"<={b}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {"calls": self.calls, "failures": self.failures, "failure_rate": round(self.failure_rate, 3),
+                "wins": self.wins, "hedges": self.hedges, "samples": len(self.latencies),
+                "p50_ms": ms(self.percentile(0.5)), "p90_ms": ms(self.percentile(0.9)),
+                "p99_ms": ms(self.percentile(0.99)),
+                "histogram": {label: n for label, n in zip(labels, self.histogram) if n}}
+
+
+class ModelRouter:
+    """
+    Hedged racing across model providers.
+
+    race() starts the healthiest provider first (failure rate, then p50 latency over
+    the recent window; providers without enough samples keep their configured order
+    behind measured ones). If it has not answered within its p90 latency (or
+    `hedge_after` until min_samples calls have been measured), the next provider is
+    started as well; a provider that fails or returns an invalid reply hands over to
+    the next one at once. The first valid reply wins. Losing calls are not
+    interrupted: they run to completion in the background and still feed the stats,
+    so slow tails stay visible.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 8, max_workers: int = 8,
+                 logger: Optional[Callable[[str], None]] = None):
+        self.window = window
+        self.min_samples = min_samples
+        self.logger = logger or (lambda _msg: None)
+        self._stats: Dict[str, ProviderStats] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+
+    def _get(self, name: str) -> ProviderStats:
+        s = self._stats.get(name)
+        if s is None:
+            s = self._stats[name] = ProviderStats(self.window)
+        return s
+
+    def record(self, name: str, ok: bool, seconds: float) -> None:
+        with self._lock:
+            self._get(name).record(ok, seconds)
+
+    def order(self, names: List[str]) -> List[str]:
+        with self._lock:
+            def rank(item: Tuple[int, str]) -> Tuple[Any, ...]:
+                i, name = item
+                s = self._get(name)
+                if len(s.outcomes) < self.min_samples:
+                    return (1, 0.0, i)
+                return (0 if s.failure_rate < 0.5 else 2, s.percentile(0.5) or 0.0, i)
+            return [name for _, name in sorted(enumerate(names), key=rank)]
+
+    def hedge_delay(self, name: str, default: float) -> float:
+        with self._lock:
+            s = self._get(name)
+            p90 = s.percentile(0.9) if len(s.latencies) >= self.min_samples else None
+        return default if p90 is None else p90
+
+    def timed(self, name: str, call: Callable[[str], Any]) -> Any:
+        """call(name), recorded as a success (with its latency) or a failure."""
+        t0 = time.perf_counter()
+        try:
+            value = call(name)
+        except BaseException:
+            self.record(name, False, time.perf_counter() - t0)
+            raise
+        self.record(name, True, time.perf_counter() - t0)
+        return value
+
+    def race(self, names: List[str], call: Callable[[str], Any], hedge_after: float = 8.0,
+             check: Optional[Callable[[], None]] = None) -> Tuple[str, Any, Dict[str, Any]]:
+        """
+        (winner, value, info) for the first call(name) that returns; call raises on an
+        invalid reply. info: order, started (names, in launch order), errors, elapsed_ms.
+        check() runs while waiting and may raise to give up. Raises AllProvidersFailed.
+        """
+        if not names:
+            raise ValueError("no providers to route to")
+        order = self.order(names)
+        t0 = time.perf_counter()
+        pending: Dict[Future, str] = {}
+        started: List[str] = []
+        errors: Dict[str, BaseException] = {}
+
+        def launch() -> float:
+            name = order[len(started)]
+            started.append(name)
+            if len(started) > 1:
+                with self._lock:
+                    self._get(name).hedges += 1
+            ctx = contextvars.copy_context()  # current job, for cancellable rate limit waits
+            pending[self._pool.submit(ctx.run, self.timed, name, call)] = name
+            return time.perf_counter() + self.hedge_delay(name, hedge_after)
+
+        deadline = launch()
+        while pending:
+            more = len(started) < len(order)
+            timeout = max(0.0, deadline - time.perf_counter()) if more else None
+            done, _ = wait(list(pending), timeout=0.25 if timeout is None else min(timeout, 0.25),
+                           return_when=FIRST_COMPLETED)
+            if check is not None:
+                check()
+            for fut in done:
+                name = pending.pop(fut)
+                try:
+                    value = fut.result()
+                except Exception as e:
+                    errors[name] = e
+                    self.logger(f"model router: {name} failed: {getattr(e, 'detail', None) or e}")
+                    continue
+                with self._lock:
+                    self._get(name).wins += 1
+                return name, value, {"order": order, "started": started, "errors": {
+                    n: str(getattr(e, "detail", None) or e) for n, e in errors.items()},
+                    "elapsed_ms": int((time.perf_counter() - t0) * 1000)}
+            if more and (not pending or time.perf_counter() >= deadline):
+                deadline = launch()  # hedge: the last one is slow (or everything started so far failed)
+        raise AllProvidersFailed(errors)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {name: s.to_dict() for name, s in self._stats.items()}
+
+    def reset(self) -> int:
+        with self._lock:
+            n = len(self._stats)
+            self._stats.clear()
+            return n
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
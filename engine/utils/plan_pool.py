@@ -0,0 +1,114 @@
+import multiprocessing, threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.diff_engine import DiffEngine
+
+Work = Dict[str, Any]  # {kind: create | update | conflict, path, hash?, current?, new, expected?}
+
+
+def plan_entry(work: Work, engine: DiffEngine) -> Tuple[str, Dict[str, Any]]:
+    """(bucket, entry) of /apply/plan for a file whose disk state is already known; only diffing is left."""
+    kind, rel = work["kind"], work["path"]
+    if kind == "create":
+        return "create", engine.into({"path": rel}, "diff", "", work["new"])
+    if kind == "conflict":
+        entry = {"path": rel, "hash": work["hash"], "diff_expected_vs_current": []}
+        if work.get("expected") is not None:
+            engine.into(entry, "diff_expected_vs_current", work["expected"], work["current"], "expected", "current")
+        return "conflict", engine.into(entry, "diff_current_vs_proposed", work["current"], work["new"], "current", "proposed")
+    return "update", engine.into({"path": rel, "hash": work["hash"]}, "diff", work["current"], work["new"], "current", "proposed")
+
+
+def _size(work: Work) -> int:
+    return len(work.get("current") or "") + len(work["new"]) + len(work.get("expected") or "")
+
+
+def _plan_shard(shard: List[Tuple[int, Work]], diff: Dict[str, Any]) -> List[Tuple[int, str, Dict[str, Any]]]:
+    engine = DiffEngine(**diff)
+    return [(i, *plan_entry(w, engine)) for i, w in shard]
+
+
+def shard(work: List[Tuple[int, Work]], max_bytes: int, max_files: int) -> List[List[Tuple[int, Work]]]:
+    """Consecutive runs of work of at most max_bytes text / max_files files (a bigger file gets a shard alone)."""
+    out: List[List[Tuple[int, Work]]] = []
+    cur: List[Tuple[int, Work]] = []
+    size = 0
+    for item in work:
+        n = _size(item[1])
+        if cur and (size + n > max_bytes or len(cur) >= max_files):
+            out.append(cur)
+            cur, size = [], 0
+        cur.append(item)
+        size += n
+    if cur:
+        out.append(cur)
+    return out
+
+
+class PlanPool:
+    """
+    Bounded process pool for plan diffs.
+
+    The engine prepares each file (path checks, hashes, reads) and hands the diff
+    work here in shards; run() yields (index, bucket, entry) as shards finish.
+    Workers are spawned (not forked: the engine has watcher and job threads) on
+    first use and reused. Work below min_bytes, or any left over if the pool
+    breaks, is planned in the calling process instead.
+    """
+
+    def __init__(self, workers: int, shard_bytes: int = 4 * 1024 * 1024, shard_files: int = 32,
+                 min_bytes: int = 1024 * 1024, logger: Optional[Callable[[str], None]] = None):
+        self.workers = max(1, workers)
+        self.shard_bytes, self.shard_files, self.min_bytes = shard_bytes, shard_files, min_bytes
+        self.logger = logger or (lambda _msg: None)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.counters = {"runs": 0, "pooled_runs": 0, "shards": 0, "files": 0, "fallbacks": 0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def run(self, work: List[Tuple[int, Work]], diff: Dict[str, Any]) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """(index, bucket, entry) per work item, in completion order; diff is DiffEngine's keyword arguments."""
+        self.counters["runs"] += 1
+        self.counters["files"] += len(work)
+        if self.workers < 2 or len(work) < 2 or sum(_size(w) for _, w in work) < self.min_bytes:
+            yield from _plan_shard(work, diff)
+            return
+        self.counters["pooled_runs"] += 1
+        shards = shard(work, self.shard_bytes, self.shard_files)
+        self.counters["shards"] += len(shards)
+        pending: Dict[Future, List[Tuple[int, Work]]] = {}
+        try:
+            try:
+                ex = self._executor()
+                for s in shards:
+                    pending[ex.submit(_plan_shard, s, diff)] = s
+                for fut in as_completed(list(pending)):
+                    results = fut.result()
+                    del pending[fut]
+                    yield from results
+            except (BrokenProcessPool, OSError) as e:
+                self.logger(f"plan pool unavailable ({e}); planning {sum(map(len, pending.values()))} files in-process")
+                self.counters["fallbacks"] += 1
+                self.shutdown()
+                left = [item for s in pending.values() for item in s]
+                pending.clear()
+                yield from _plan_shard(left, diff)
+        finally:
+            for fut in pending:
+                fut.cancel()  # caller stopped early (e.g. a stream client went away)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "started": self._pool is not None, **self.counters}
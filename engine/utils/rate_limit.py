@@ -0,0 +1,51 @@
+import threading, time
+from typing import Any, Callable, Dict, Optional
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second refill up to `burst`.
+    acquire() blocks until a token is available and returns how long it waited.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0     # total seconds callers spent waiting
+        self.granted = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0, check: Optional[Callable[[], None]] = None) -> float:
+        """Take `tokens`, sleeping as needed; check() runs between naps and may raise to give up."""
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    waited = now - start
+                    self.waited += waited
+                    self.granted += 1
+                    return waited
+                need = (tokens - self._tokens) / self.rate
+            time.sleep(min(need, 0.25))
+            if check is not None:
+                check()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {"rate_per_s": self.rate, "burst": self.burst, "available": round(self._tokens, 2),
+                    "granted": self.granted, "waited_s": round(self.waited, 3)}
+
+
+def bucket_for(rpm: float, burst: float) -> Optional[TokenBucket]:
+    """Bucket for a requests-per-minute limit; None (unlimited) for rpm <= 0."""
+    return TokenBucket(rpm / 60.0, burst) if rpm and rpm > 0 else None
@@ -0,0 +1,126 @@
+import hashlib, marshal, sqlite3, sys, threading, time, zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# bump when the saved state layout changes; marshal data is also tied to the Python version
+FORMAT = f"1-py{sys.version_info[0]}.{sys.version_info[1]}-m{marshal.version}"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    repo_root   TEXT NOT NULL,
+    source      TEXT NOT NULL,
+    format      TEXT NOT NULL,
+    ignore_key  TEXT NOT NULL,
+    files       INTEGER NOT NULL,
+    bytes       INTEGER NOT NULL,
+    saved_at    REAL NOT NULL,
+    last_used   REAL NOT NULL,
+    payload     BLOB NOT NULL,
+    PRIMARY KEY (repo_root, source)
+)
+"""
+
+
+def ignore_key(patterns: Iterable[str]) -> str:
+    return hashlib.blake2b("\n".join(patterns).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SnapshotCache:
+    """
+    Per-repo snapshot state (SnapshotEngine.export_state() + content hashes) in one
+    SQLite file, so a restarted engine can skip the initial walk.
+
+    A row is only used when repo root, source, ignore patterns and the payload
+    format all match; the caller still validates it against the disk. Rows are
+    evicted by last use (older than max_age_days) and then oldest-first until the
+    total payload size fits max_bytes.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 512 * 1024 * 1024, max_age_days: float = 30,
+                 logger: Optional[Callable[[str], None]] = None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.logger = logger or (lambda _msg: None)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.execute(_SCHEMA)
+
+    @contextmanager
+    def _db(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with db:  # commit / rollback
+                yield db
+        finally:
+            db.close()
+
+    def load(self, repo_root: str, source: str, ign_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._db() as db:
+            row = db.execute("SELECT format, ignore_key, payload FROM snapshots WHERE repo_root=? AND source=?",
+                             (repo_root, source)).fetchone()
+            if row is None:
+                return None
+            fmt, key, payload = row
+            if fmt != FORMAT or key != ign_key:
+                self.logger(f"snapshot cache: stale entry for {repo_root} ({'format' if fmt != FORMAT else 'ignores'} changed)")
+                db.execute("DELETE FROM snapshots WHERE repo_root=? AND source=?", (repo_root, source))
+                return None
+            db.execute("UPDATE snapshots SET last_used=? WHERE repo_root=? AND source=?", (time.time(), repo_root, source))
+        try:
+            return marshal.loads(zlib.decompress(payload))
+        except (ValueError, EOFError, TypeError, zlib.error) as e:
+            self.logger(f"snapshot cache: unreadable entry for {repo_root}: {e}")
+            self.drop(repo_root)
+            return None
+
+    def save(self, repo_root: str, source: str, ign_key: str, state: Dict[str, Any], files: int = 0) -> int:
+        """Store state for (repo_root, source); returns the compressed size."""
+        payload = zlib.compress(marshal.dumps(state), 1)
+        now = time.time()
+        with self._lock, self._db() as db:
+            db.execute("INSERT OR REPLACE INTO snapshots VALUES (?,?,?,?,?,?,?,?,?)",
+                       (repo_root, source, FORMAT, ign_key, files, len(payload), now, now, payload))
+            self._evict(db)
+        return len(payload)
+
+    def _evict(self, db: sqlite3.Connection) -> List[str]:
+        gone = [r for (r,) in db.execute("SELECT repo_root FROM snapshots WHERE last_used < ?",
+                                        (time.time() - self.max_age,))]
+        db.execute("DELETE FROM snapshots WHERE last_used < ?", (time.time() - self.max_age,))
+        total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM snapshots").fetchone()[0]
+        if total > self.max_bytes:
+            # keep the most recently used entry even if it alone is over budget
+            for repo_root, source, size in db.execute(
+                    "SELECT repo_root, source, bytes FROM snapshots ORDER BY last_used ASC").fetchall()[:-1]:
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM snapshots WHERE repo_root=? AND source=?", (repo_root, source))
+                total -= size
+                gone.append(repo_root)
+        if gone:
+            self.logger(f"snapshot cache: evicted {gone}")
+        return gone
+
+    def evict(self) -> List[str]:
+        with self._lock, self._db() as db:
+            return self._evict(db)
+
+    def drop(self, repo_root: Optional[str] = None) -> int:
+        with self._lock, self._db() as db:
+            if repo_root is None:
+                return db.execute("DELETE FROM snapshots").rowcount
+            return db.execute("DELETE FROM snapshots WHERE repo_root=?", (repo_root,)).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock, self._db() as db:
+            rows = db.execute("SELECT repo_root, source, files, bytes, saved_at, last_used FROM snapshots "
+                              "ORDER BY last_used DESC").fetchall()
+        return {
+            "path": str(self.path), "max_bytes": self.max_bytes, "max_age_days": self.max_age / 86400,
+            "bytes": sum(r[3] for r in rows),
+            "entries": [{"repo_root": r[0], "source": r[1], "files": r[2], "bytes": r[3],
+                         "saved_at": r[4], "last_used": r[5]} for r in rows],
+        }
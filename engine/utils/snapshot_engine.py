@@ -0,0 +1,509 @@
+import os, stat, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.ignore_matcher import IgnoreMatcher
+from utils.git_task_manager import GitTaskManager
+from utils.snapshot_store import SnapshotStore
+
+
+class _DirState:
+    __slots__ = ("mtime_ns", "files", "subdirs")
+
+    def __init__(self, mtime_ns: int):
+        self.mtime_ns = mtime_ns
+        self.files: set = set()
+        self.subdirs: set = set()
+
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
+
+
+def _entry(name: str, st: os.stat_result) -> Dict[str, Any]:
+    return {"size": st.st_size, "ext": os.path.splitext(name)[1].lower(), "mtime_ns": st.st_mtime_ns}
+
+
+# network-backed storage is latency bound, so more threads than cores pays off
+DEFAULT_SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+SOURCES = ("walk", "git")
+
+
+def _git_state(xy: Optional[str]) -> str:
+    """Porcelain v2 XY code -> clean | staged | modified | untracked | conflicted."""
+    if not xy:
+        return "clean"
+    if xy == "??":
+        return "untracked"
+    if "U" in xy or xy in ("AA", "DD"):
+        return "conflicted"
+    return "modified" if xy[1] != "." else "staged"
+
+
+class SnapshotEngine:
+    """
+    Owns the repo snapshot ({rel_path: {"size", "ext", "mtime_ns"}}, held in a columnar
+    SnapshotStore) and keeps it current without re-walking the whole tree.
+
+    Every scanned directory remembers its mtime; rescan() only re-lists the
+    directories whose mtime moved (entries added/removed/renamed) and
+    refresh_paths() updates the exact files written by apply/revert.
+    In-place edits of existing files do not touch the directory mtime, so
+    callers that write files must report them through refresh_paths().
+
+    `ignores` returns the current compiled IgnoreMatcher; it is fetched once
+    per operation and ignored directories are never descended into.
+
+    source="git" builds the snapshot from the index and `git status` instead of
+    walking (two subprocess calls); entries then also carry the index blob
+    "sha" and a "git" state, and rescan() re-queries git.
+    """
+
+    def __init__(self, repo_root: str, ignores: Optional[Callable[[], IgnoreMatcher]] = None,
+                 logger: Optional[Callable[[str], None]] = None, workers: int = DEFAULT_SCAN_WORKERS,
+                 source: str = "walk"):
+        if source not in SOURCES:
+            raise ValueError(f"unknown snapshot source: {source}")
+        self.source = source
+        self.repo_root = str(Path(repo_root).resolve())
+        self.ignores = ignores or (lambda: IgnoreMatcher([]))
+        self.logger = logger or (lambda _msg: None)
+        self.snapshot = SnapshotStore()
+        self.dirs: Dict[str, _DirState] = {}
+        self.lock = threading.RLock()
+        self.version = 0
+        self.workers = max(1, int(workers))
+        self.last_scan: Dict[str, Any] = {}
+        self.matcher = self.ignores()
+        # per-pattern exclusion counts from the last full scan (pattern index -> n)
+        self.ignored_files: Dict[int, int] = {}
+        self.pruned_dirs: Dict[int, int] = {}
+        self.ignore_stats: List[dict] = []
+        self._counting = False
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def _abs(self, rel: str) -> str:
+        return os.path.join(self.repo_root, rel) if rel else self.repo_root
+
+    # ---------- scanning ----------
+    def _list_dir(self, rel_dir: str):
+        """
+        List one directory without touching shared state (safe to run on a worker thread).
+        Returns (state, [(rel, entry)], ignored_hits, pruned_hits) or None if it vanished.
+        """
+        path = self._abs(rel_dir)
+        try:
+            st = os.stat(path)
+            it = os.scandir(path)
+        except OSError:
+            return None
+        state = _DirState(st.st_mtime_ns)
+        entries, ignored, pruned = [], [], []
+        prefix = rel_dir + "/" if rel_dir else ""
+        match, match_dir = self.matcher.match, self.matcher.match_dir
+        with it:
+            for e in it:
+                name = e.name
+                rel = prefix + name
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        hit = match_dir(rel)
+                        if hit is None:
+                            state.subdirs.add(name)
+                        else:
+                            pruned.append(hit)
+                        continue
+                    if not e.is_file():
+                        continue
+                except OSError:
+                    continue
+                state.files.add(name)
+                hit = match(rel)
+                if hit is not None:
+                    ignored.append(hit)
+                    continue
+                try:
+                    st = e.stat()  # DirEntry caches the stat result
+                    size, mtime_ns = st.st_size, st.st_mtime_ns
+                except OSError:
+                    size, mtime_ns = 0, 0
+                entries.append((rel, {"size": size, "ext": os.path.splitext(name)[1].lower(), "mtime_ns": mtime_ns}))
+        return state, entries, ignored, pruned
+
+    def _merge(self, rel_dir: str, listing) -> _DirState:
+        state, entries, ignored, pruned = listing
+        self.snapshot.update(entries)
+        self.dirs[rel_dir] = state
+        if self._counting:
+            for hit in ignored:
+                self.ignored_files[hit] = self.ignored_files.get(hit, 0) + 1
+            for hit in pruned:
+                self.pruned_dirs[hit] = self.pruned_dirs.get(hit, 0) + 1
+        return state
+
+    def _scan_dir(self, rel_dir: str) -> Optional[_DirState]:
+        """List one directory, record its state and add its files. Returns None if it vanished."""
+        listing = self._list_dir(rel_dir)
+        return self._merge(rel_dir, listing) if listing is not None else None
+
+    def _scan_tree(self, rel_dir: str, workers: Optional[int] = None) -> int:
+        """
+        Scan rel_dir and everything below it. Returns the number of directories listed.
+        Directory listing fans out over a bounded thread pool (scandir/stat release
+        the GIL); results are merged on the calling thread.
+        """
+        workers = self.workers if workers is None else max(1, int(workers))
+        if workers == 1:
+            pending, listed = [rel_dir], 0
+            while pending:
+                d = pending.pop()
+                state = self._scan_dir(d)
+                if state is None:
+                    continue
+                listed += 1
+                pending.extend(_join(d, s) for s in state.subdirs)
+            return listed
+        listed = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+            running = {pool.submit(self._list_dir, rel_dir): rel_dir}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    d = running.pop(fut)
+                    listing = fut.result()
+                    if listing is None:
+                        continue
+                    state = self._merge(d, listing)
+                    listed += 1
+                    for sub in state.subdirs:
+                        child = _join(d, sub)
+                        running[pool.submit(self._list_dir, child)] = child
+        return listed
+
+    def _drop_tree(self, rel_dir: str, removed: List[str]) -> None:
+        """Forget rel_dir and everything below it, collecting the snapshot paths removed."""
+        pending = [rel_dir]
+        while pending:
+            d = pending.pop()
+            state = self.dirs.pop(d, None)
+            if state is None:
+                continue
+            for name in state.files:
+                rel = _join(d, name)
+                if self.snapshot.pop(rel, None) is not None:
+                    removed.append(rel)
+            pending.extend(_join(d, s) for s in state.subdirs)
+
+    # ---------- change notification ----------
+    def subscribe(self, fn: Callable[[Dict[str, Any]], None]) -> None:
+        """fn(delta) after every mutation; delta = {"version", "added", "removed", "changed"} or {"version", "reset": True}."""
+        self.listeners.append(fn)
+
+    def unsubscribe(self, fn: Callable[[Dict[str, Any]], None]) -> None:
+        if fn in self.listeners:
+            self.listeners.remove(fn)
+
+    def _emit(self, delta: Dict[str, Any]) -> None:
+        self.version += 1
+        delta["version"] = self.version
+        for fn in list(self.listeners):
+            try:
+                fn(delta)
+            except Exception as e:
+                self.logger(f"snapshot: listener failed: {e}")
+
+    def _emit_paths(self, added: List[str], removed: List[str], changed: List[str]) -> None:
+        if not (added or removed or changed):
+            return
+        snap = self.snapshot
+        self._emit({
+            "added": [{"path": r, **snap[r]} for r in added if r in snap],
+            "removed": removed,
+            "changed": [{"path": r, **snap[r]} for r in changed if r in snap],
+        })
+
+    # ---------- full / incremental scans ----------
+    def full_scan(self, workers: Optional[int] = None) -> SnapshotStore:
+        t0 = time.perf_counter()
+        with self.lock:
+            self.matcher = self.ignores()
+            self.snapshot.clear()
+            self.dirs.clear()
+            self.ignored_files, self.pruned_dirs = {}, {}
+            self._counting = True
+            try:
+                if self.source == "git":
+                    self.snapshot.update(self._git_listing())
+                    listed = self._dirs_from_snapshot()
+                else:
+                    listed = self._scan_tree("", workers)
+            finally:
+                self._counting = False
+            self.ignore_stats = self.matcher.report(self.ignored_files, self.pruned_dirs)
+            self._emit({"reset": True})
+        elapsed = time.perf_counter() - t0
+        self.last_scan = {
+            "source": self.source, "files": len(self.snapshot), "dirs": listed, "workers": workers or self.workers,
+            "elapsed_ms": int(elapsed * 1000), "files_per_sec": int(len(self.snapshot) / elapsed) if elapsed > 0 else 0,
+        }
+        self.logger(f"snapshot: full scan {self.last_scan}")
+        return self.snapshot
+
+    # ---------- persistence ----------
+    def export_state(self) -> Dict[str, Any]:
+        """Snapshot + directory mtimes as plain builtins, for SnapshotCache."""
+        with self.lock:
+            return {
+                "source": self.source,
+                "snapshot": self.snapshot.dump(),
+                "dirs": [(d, st.mtime_ns, list(st.files), list(st.subdirs)) for d, st in self.dirs.items()],
+                "last_scan": dict(self.last_scan),
+                "ignore_stats": list(self.ignore_stats),
+            }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """
+        Adopt a state saved by export_state() (same repo, source and ignores) instead of
+        walking. The caller validates it: rescan() catches added/removed entries through
+        the directory mtimes, refresh_paths() catches in-place edits.
+        """
+        if state.get("source") != self.source:
+            raise ValueError(f"cached snapshot is for source {state.get('source')!r}, not {self.source!r}")
+        snapshot = SnapshotStore.load(state["snapshot"])
+        dirs: Dict[str, _DirState] = {}
+        for d, mtime_ns, files, subdirs in state["dirs"]:
+            st = dirs[d] = _DirState(mtime_ns)
+            st.files, st.subdirs = set(files), set(subdirs)
+        with self.lock:
+            self.matcher = self.ignores()
+            self.snapshot = snapshot
+            self.dirs = dirs
+            self.ignore_stats = state.get("ignore_stats") or []
+            self.last_scan = {**(state.get("last_scan") or {}), "cached": True}
+            self._emit({"reset": True})
+
+    # ---------- git index source ----------
+    def _git_listing(self) -> Dict[str, Dict[str, Any]]:
+        """Tracked files from the index plus untracked ones from porcelain status, ignores applied."""
+        g = GitTaskManager(self.repo_root, logger=self.logger)
+        index = g.index_entries()
+        status = g.status_entries()
+        out: Dict[str, Dict[str, Any]] = {}
+        match = self.matcher.match
+        for rel, ix in index.items():
+            if ix["mode"] == "160000":  # submodule gitlink, not a file
+                continue
+            xy = status.get(rel)
+            if xy and xy[1] == "D":  # deleted in the worktree
+                continue
+            hit = match(rel)
+            if hit is not None:
+                if self._counting:
+                    self.ignored_files[hit] = self.ignored_files.get(hit, 0) + 1
+                continue
+            entry = {"size": ix["size"], "ext": os.path.splitext(rel)[1].lower(), "mtime_ns": ix["mtime_ns"],
+                     "sha": ix["sha"], "git": _git_state(xy)}
+            if xy and xy[1] != ".":
+                # index size/mtime are stale for worktree edits
+                try:
+                    st = os.stat(self._abs(rel))
+                except OSError:
+                    continue
+                entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            out[rel] = entry
+        for rel, xy in status.items():
+            if xy != "??":
+                continue
+            hit = match(rel)
+            if hit is not None:
+                if self._counting:
+                    self.ignored_files[hit] = self.ignored_files.get(hit, 0) + 1
+                continue
+            try:
+                st = os.stat(self._abs(rel))
+            except OSError:
+                continue
+            out[rel] = {"size": st.st_size, "ext": os.path.splitext(rel)[1].lower(), "mtime_ns": st.st_mtime_ns,
+                        "sha": None, "git": "untracked"}
+        return out
+
+    def _dirs_from_snapshot(self) -> int:
+        """Derive directory states from snapshot paths so refresh_paths()/watchers work without a walk."""
+        self.dirs.clear()
+        self.dirs[""] = _DirState(0)
+        for rel in self.snapshot:
+            parent, _, name = rel.rpartition("/")
+            self._dir_chain(parent).files.add(name)
+        for d, state in self.dirs.items():
+            try:
+                state.mtime_ns = os.stat(self._abs(d)).st_mtime_ns
+            except OSError:
+                pass
+        return len(self.dirs)
+
+    def _dir_chain(self, rel_dir: str) -> _DirState:
+        """State for rel_dir, registering it and any missing ancestors."""
+        state = self.dirs.get(rel_dir)
+        if state is not None:
+            return state
+        state = self.dirs[rel_dir] = _DirState(0)
+        child = rel_dir
+        while child:
+            up, _, leaf = child.rpartition("/")
+            up_state = self.dirs.get(up)
+            known = up_state is not None
+            if not known:
+                up_state = self.dirs[up] = _DirState(0)
+            up_state.subdirs.add(leaf)  # type: ignore[union-attr]
+            if known:
+                break
+            child = up
+        return state
+
+    def _rescan_git(self) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        with self.lock:
+            self.matcher = self.ignores()
+            fresh = self._git_listing()
+            old = self.snapshot
+            added = [r for r in fresh if r not in old]
+            removed = [r for r in old if r not in fresh]
+            changed = [r for r, e in fresh.items() if r in old and old[r] != e]
+            for r in removed:
+                del old[r]
+            for r in added + changed:
+                old[r] = fresh[r]
+            if added or removed:
+                self._dirs_from_snapshot()
+            self._emit_paths(added, removed, changed)
+        stats = {"source": "git", "added": len(added), "removed": len(removed), "updated": len(changed),
+                 "files": len(self.snapshot), "elapsed_ms": int((time.perf_counter() - t0) * 1000)}
+        self.logger(f"snapshot: git rescan {stats}")
+        return stats
+
+    def rescan(self) -> Dict[str, Any]:
+        """Re-list only directories whose mtime changed since the last scan (git source: re-query git)."""
+        if self.source == "git":
+            return self._rescan_git()
+        t0 = time.perf_counter()
+        stats = {"dirs_checked": 0, "dirs_relisted": 0}
+        added: List[str] = []
+        removed: List[str] = []
+        changed: List[str] = []
+        with self.lock:
+            self.matcher = self.ignores()
+            # parents before children so a dropped subtree is never visited
+            for rel_dir in sorted(self.dirs.keys(), key=lambda d: d.count("/") + (1 if d else 0)):
+                old = self.dirs.get(rel_dir)
+                if old is None:
+                    continue
+                stats["dirs_checked"] += 1
+                try:
+                    mtime_ns = os.stat(self._abs(rel_dir)).st_mtime_ns
+                except OSError:
+                    self._drop_tree(rel_dir, removed)
+                    continue
+                if mtime_ns == old.mtime_ns:
+                    continue
+                stats["dirs_relisted"] += 1
+                self._relist(rel_dir, old, added, removed, changed)
+            self._emit_paths(added, removed, changed)
+        stats.update(added=len(added), removed=len(removed), updated=len(changed), files=len(self.snapshot),
+                     elapsed_ms=int((time.perf_counter() - t0) * 1000))
+        self.logger(f"snapshot: incremental rescan {stats}")
+        return stats
+
+    def _relist(self, rel_dir: str, old: _DirState, added: List[str], removed: List[str], changed: List[str]):
+        before = {n: self.snapshot.pop(_join(rel_dir, n), None) for n in old.files}
+        state = self._scan_dir(rel_dir)
+        if state is None:
+            removed.extend(_join(rel_dir, n) for n, v in before.items() if v is not None)
+            self._drop_tree(rel_dir, removed)
+            return
+        for n in old.files | state.files:
+            rel = _join(rel_dir, n)
+            prev, cur = before.get(n), self.snapshot.get(rel)
+            if prev is None and cur is not None:
+                added.append(rel)
+            elif prev is not None and cur is None:
+                removed.append(rel)
+            elif prev is not None and prev != cur:
+                changed.append(rel)
+        for s in old.subdirs - state.subdirs:
+            self._drop_tree(_join(rel_dir, s), removed)
+        for s in state.subdirs - old.subdirs:
+            sub = _join(rel_dir, s)
+            self._scan_tree(sub)
+            added.extend(self._files_below(sub))
+
+    def _files_below(self, rel_dir: str) -> List[str]:
+        out, pending = [], [rel_dir]
+        while pending:
+            d = pending.pop()
+            state = self.dirs.get(d)
+            if state is None:
+                continue
+            out.extend(r for r in (_join(d, n) for n in state.files) if r in self.snapshot)
+            pending.extend(_join(d, s) for s in state.subdirs)
+        return out
+
+    # ---------- targeted updates ----------
+    def refresh_paths(self, rels: Iterable[str]) -> List[str]:
+        """Re-stat exactly these files (written/restored/deleted) and patch the snapshot in place."""
+        added: List[str] = []
+        removed: List[str] = []
+        changed: List[str] = []
+        with self.lock:
+            self.matcher = self.ignores()
+            for rel in rels:
+                rel = Path(rel).as_posix()
+                parent, _, name = rel.rpartition("/")
+                try:
+                    st = os.stat(self._abs(rel))
+                    is_file = stat.S_ISREG(st.st_mode)
+                except OSError:
+                    st, is_file = None, False
+                state = self.dirs.get(parent)
+                if is_file:
+                    if state is not None:
+                        state.files.add(name)
+                    if self.matcher.is_ignored(rel):
+                        continue
+                    prev = self.snapshot.get(rel)
+                    cur = _entry(name, st)  # type: ignore[arg-type]
+                    if self.source == "git":
+                        sha = prev.get("sha") if prev else None
+                        cur.update(sha=sha, git="modified" if sha else "untracked")
+                    self.snapshot[rel] = cur
+                    if prev is None:
+                        added.append(rel)
+                    elif prev != cur:
+                        changed.append(rel)
+                else:
+                    if state is not None:
+                        state.files.discard(name)
+                    if self.snapshot.pop(rel, None) is not None:
+                        removed.append(rel)
+            self._emit_paths(added, removed, changed)
+        return added + removed + changed
+
+    def prune_ignored(self) -> int:
+        """Drop entries and directories that became ignored (ignore set grew). No disk access."""
+        removed: List[str] = []
+        with self.lock:
+            self.matcher = self.ignores()
+            for rel_dir in [d for d in self.dirs if self.matcher.match_dir(d) is not None]:
+                if rel_dir not in self.dirs:
+                    continue
+                parent, _, name = rel_dir.rpartition("/")
+                self._drop_tree(rel_dir, removed)
+                if parent in self.dirs:
+                    self.dirs[parent].subdirs.discard(name)
+            gone = [rel for rel in self.snapshot if self.matcher.is_ignored(rel)]
+            for rel in gone:
+                del self.snapshot[rel]
+            removed.extend(gone)
+            self._emit_paths([], removed, [])
+        return len(removed)
@@ -0,0 +1,83 @@
+import queue, threading, time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class SnapshotFollower(ABC):
+    """
+    Base for derived indexes that track a SnapshotEngine from one background thread.
+
+    attach() subscribes to the engine and queues a full build; snapshot deltas
+    are queued as update(paths, removed) calls and a reset delta queues another
+    rebuild(paths). Listeners run under the engine lock, so nothing heavier than
+    a queue put happens there. Subclasses implement rebuild() and update() and
+    set self.ready when a build completes.
+    """
+
+    name = "index"
+
+    def __init__(self, logger: Optional[Callable[[str], None]] = None):
+        self.logger = logger or (lambda _msg: None)
+        self.ready = False
+        self.stats: Dict[str, Any] = {"builds": 0, "updates": 0, "build_ms": 0}
+        self._queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._engine = None
+
+    def attach(self, engine) -> "SnapshotFollower":
+        self._engine = engine
+        engine.subscribe(self._on_delta)
+        self._queue.put(("reset", None))
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def detach(self) -> None:
+        if self._engine is not None:
+            self._engine.unsubscribe(self._on_delta)
+        self._queue.put(("stop", None))
+
+    def superseded(self) -> bool:
+        """True when a rebuild/stop is waiting, so a running build can bail out early."""
+        with self._queue.mutex:
+            return any(op in ("reset", "stop") for op, _ in self._queue.queue)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _on_delta(self, delta: Dict[str, Any]) -> None:
+        if delta.get("reset"):
+            self._queue.put(("reset", None))
+            return
+        paths = [e["path"] for e in delta.get("added", [])] + [e["path"] for e in delta.get("changed", [])]
+        self._queue.put(("update", (paths, list(delta.get("removed", [])))))
+
+    def _run(self) -> None:
+        while True:
+            op, arg = self._queue.get()
+            try:
+                if op == "stop":
+                    return
+                if op == "reset":
+                    t0 = time.perf_counter()
+                    with self._engine.lock:
+                        paths = list(self._engine.snapshot)
+                    self.ready = False
+                    if self.rebuild(paths) is not False:
+                        self.ready = True
+                        self.stats["builds"] += 1
+                        self.stats["build_ms"] = int((time.perf_counter() - t0) * 1000)
+                else:
+                    self.update(*arg)
+                    self.stats["updates"] += 1
+            except Exception as e:
+                self.logger(f"{self.name}: {op} failed: {e}")
+
+    @abstractmethod
+    def rebuild(self, paths: List[str]) -> Optional[bool]:
+        """Index these snapshot paths from scratch; return False if abandoned (superseded())."""
+
+    @abstractmethod
+    def update(self, paths: Iterable[str], removed: Iterable[str] = ()) -> None:
+        """Re-index changed/added paths and forget removed ones."""
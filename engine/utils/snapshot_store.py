@@ -0,0 +1,231 @@
+import binascii, sys
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# flag bits: which optional keys a row carries
+_F_MTIME, _F_SHA, _F_SHA_SET, _F_GIT = 1, 2, 4, 8
+_KEY_ORDER = ("size", "ext", "mtime_ns", "sha", "git")
+_SHA_BYTES = 20
+
+
+class SnapshotStore(MutableMapping):
+    """
+    Columnar replacement for the {rel_path: {"size", "ext", "mtime_ns"[, "sha", "git"]}} snapshot dict.
+
+    Directory paths are stored once and file names are interned, so a path costs
+    one slot in its directory's name -> row dict. size/mtime_ns live in int64
+    arrays, ext and git state are ids into a small symbol table, git blob shas
+    are packed 20-byte columns (allocated only once a sha shows up).
+
+    Reads build a fresh entry dict, so entries must be replaced whole
+    (store[rel] = {...}); mutating a returned dict does not write back.
+    Entries with any other shape are kept verbatim on the side.
+    """
+
+    def __init__(self, data: Optional[Any] = None):
+        self.clear()
+        if data:
+            self.update(data)
+
+    # ---------- MutableMapping ----------
+    def clear(self) -> None:
+        self._dir_ids: Dict[str, int] = {}
+        self._dir_paths: List[str] = []
+        self._index: List[Dict[str, int]] = []  # per dir id: name -> row
+        self._sym_ids: Dict[str, int] = {}
+        self._syms: List[str] = []
+        self._size = array("q")
+        self._mtime = array("q")
+        self._ext = array("I")
+        self._git = array("I")
+        self._flags = array("B")
+        self._sha: Optional[bytearray] = None
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self._free: List[int] = []
+        self._len = 0
+
+    def __repr__(self) -> str:
+        return f"<SnapshotStore {self._len} files in {len(self._dir_paths)} dirs>"
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        for d, names in zip(self._dir_paths, self._index):
+            if d:
+                prefix = d + "/"
+                for name in names:
+                    yield prefix + name
+            else:
+                yield from names
+
+    def __contains__(self, rel: object) -> bool:
+        return isinstance(rel, str) and self._row(rel) is not None
+
+    def __getitem__(self, rel: str) -> Dict[str, Any]:
+        row = self._row(rel) if isinstance(rel, str) else None
+        if row is None:
+            raise KeyError(rel)
+        return self._entry(row)
+
+    def __setitem__(self, rel: str, entry: Dict[str, Any]) -> None:
+        parent, _, name = rel.rpartition("/")
+        did = self._dir_ids.get(parent)
+        if did is None:
+            did = self._dir_ids[parent] = len(self._dir_paths)
+            self._dir_paths.append(sys.intern(parent))
+            self._index.append({})
+        names = self._index[did]
+        row = names.get(name)
+        if row is None:
+            row = self._alloc()
+            names[sys.intern(name)] = row
+            self._len += 1
+        self._write(row, entry)
+
+    def __delitem__(self, rel: str) -> None:
+        parent, _, name = rel.rpartition("/")
+        did = self._dir_ids.get(parent)
+        row = self._index[did].pop(name, None) if did is not None else None
+        if row is None:
+            raise KeyError(rel)
+        self._extra.pop(row, None)
+        self._free.append(row)
+        self._len -= 1
+
+    def pop(self, rel: str, *default: Any) -> Any:
+        try:
+            entry = self[rel]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[rel]
+        return entry
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:  # type: ignore[override]
+        for d, names in zip(self._dir_paths, self._index):
+            prefix = d + "/" if d else ""
+            for name, row in names.items():
+                yield prefix + name, self._entry(row)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self.items())
+
+    def dump(self) -> Tuple[Any, ...]:
+        """Plain builtins (marshal/pickle friendly) that load() turns back into an equal store."""
+        index = [(list(names), array("I", names.values()).tobytes()) for names in self._index]
+        return (1, self._dir_paths, index, self._syms, self._size.tobytes(), self._mtime.tobytes(),
+                self._ext.tobytes(), self._git.tobytes(), self._flags.tobytes(),
+                bytes(self._sha) if self._sha is not None else None, self._extra, self._free, self._len)
+
+    @classmethod
+    def load(cls, data: Tuple[Any, ...]) -> "SnapshotStore":
+        if data[0] != 1:
+            raise ValueError(f"unknown snapshot dump format: {data[0]}")
+        _, dir_paths, index, syms, size, mtime, ext, git, flags, sha, extra, free, n = data
+        store = cls()
+        store._dir_paths = [sys.intern(d) for d in dir_paths]
+        store._dir_ids = {d: i for i, d in enumerate(store._dir_paths)}
+        store._index = [dict(zip(names, array("I", rows))) for names, rows in index]
+        store._syms = list(syms)
+        store._sym_ids = {s: i for i, s in enumerate(store._syms)}
+        for col, raw in ((store._size, size), (store._mtime, mtime), (store._ext, ext), (store._git, git),
+                         (store._flags, flags)):
+            col.frombytes(raw)
+        store._sha = bytearray(sha) if sha is not None else None
+        store._extra, store._free, store._len = dict(extra), list(free), n
+        if not len(store._size) == len(store._mtime) == len(store._ext) == len(store._git) == len(store._flags):
+            raise ValueError("corrupt snapshot dump: column lengths differ")
+        return store
+
+    def stats(self) -> Dict[str, int]:
+        rows = len(self._size)
+        return {"files": self._len, "dirs": len(self._dir_paths), "rows": rows, "free_rows": len(self._free),
+                "symbols": len(self._syms), "irregular": len(self._extra),
+                "column_bytes": rows * 25 + (len(self._sha) if self._sha is not None else 0)}
+
+    # ---------- rows ----------
+    def _row(self, rel: str) -> Optional[int]:
+        parent, _, name = rel.rpartition("/")
+        did = self._dir_ids.get(parent)
+        return self._index[did].get(name) if did is not None else None
+
+    def _alloc(self) -> int:
+        if self._free:
+            return self._free.pop()
+        row = len(self._size)
+        for col in (self._size, self._mtime, self._ext, self._git):
+            col.append(0)
+        self._flags.append(0)
+        if self._sha is not None:
+            self._sha.extend(bytes(_SHA_BYTES))
+        return row
+
+    def _sym(self, s: str) -> int:
+        i = self._sym_ids.get(s)
+        if i is None:
+            i = self._sym_ids[s] = len(self._syms)
+            self._syms.append(s)
+        return i
+
+    def _write(self, row: int, entry: Dict[str, Any]) -> None:
+        packed = self._pack(entry)
+        if packed is None:
+            self._extra[row] = dict(entry)
+            return
+        self._extra.pop(row, None)
+        size, mtime, ext, git, flags, sha = packed
+        self._size[row], self._mtime[row], self._ext[row], self._git[row], self._flags[row] = size, mtime, ext, git, flags
+        if sha is not None:
+            if self._sha is None:
+                self._sha = bytearray(_SHA_BYTES * len(self._size))
+            self._sha[row * _SHA_BYTES:(row + 1) * _SHA_BYTES] = sha
+
+    def _pack(self, e: Dict[str, Any]):
+        """Column values for a regular entry, or None if it has to be stored verbatim."""
+        if not isinstance(e, dict) or tuple(e) != _KEY_ORDER[:len(e)]:
+            return None  # unusual shape or key order: keep verbatim so serialization is unchanged
+        size, ext = e.get("size"), e.get("ext")
+        if type(size) is not int or type(ext) is not str or not -2 ** 63 <= size < 2 ** 63:
+            return None
+        flags, mtime, git, sha = 0, 0, 0, None
+        if "mtime_ns" in e:
+            mtime = e["mtime_ns"]
+            if type(mtime) is not int or not -2 ** 63 <= mtime < 2 ** 63:
+                return None
+            flags |= _F_MTIME
+        if "sha" in e:
+            flags |= _F_SHA
+            if e["sha"] is not None:
+                if not isinstance(e["sha"], str) or len(e["sha"]) != 2 * _SHA_BYTES:
+                    return None
+                try:
+                    sha = binascii.unhexlify(e["sha"])
+                except (binascii.Error, ValueError):
+                    return None
+                if binascii.hexlify(sha).decode() != e["sha"]:  # keep uppercase etc. verbatim
+                    return None
+                flags |= _F_SHA_SET
+        if "git" in e:
+            if type(e["git"]) is not str:
+                return None
+            git = self._sym(e["git"])
+            flags |= _F_GIT
+        return size, mtime, self._sym(ext), git, flags, sha
+
+    def _entry(self, row: int) -> Dict[str, Any]:
+        extra = self._extra.get(row)
+        if extra is not None:
+            return dict(extra)
+        flags = self._flags[row]
+        e: Dict[str, Any] = {"size": self._size[row], "ext": self._syms[self._ext[row]]}
+        if flags & _F_MTIME:
+            e["mtime_ns"] = self._mtime[row]
+        if flags & _F_SHA:
+            e["sha"] = (self._sha[row * _SHA_BYTES:(row + 1) * _SHA_BYTES].hex()  # type: ignore[index]
+                        if flags & _F_SHA_SET else None)
+        if flags & _F_GIT:
+            e["git"] = self._syms[self._git[row]]
+        return e
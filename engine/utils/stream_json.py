@@ -0,0 +1,100 @@
+import json, re
+from typing import Any, Dict, List, Optional
+
+_STR_SPECIAL = re.compile(r'["\\]')
+
+
+class FilesStreamParser:
+    """
+    Incremental extractor for the `files` array of a streamed {"files": [...]} reply.
+
+    feed() takes completion text as it arrives and returns every files[] element
+    whose object closed in that chunk, already json-decoded. Text before the
+    first "{" (prose, ``` fences) is skipped; strings and escapes are tracked so
+    braces inside code do not count. Each character is scanned once and only the
+    unfinished tail (the open file object) is buffered.
+    """
+
+    def __init__(self, key: str = "files"):
+        self.key = key
+        self.count = 0
+        self._buf = ""
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._str_start = -1
+        self._last_key: Optional[str] = None
+        self._array_depth: Optional[int] = None   # depth inside the files array
+        self._obj_start = -1
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        text = self._buf + chunk
+        out: List[Dict[str, Any]] = []
+        i, n = len(self._buf), len(text)
+        while i < n and not self._done:
+            c = text[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                    i += 1
+                    continue
+                m = _STR_SPECIAL.search(text, i)  # skip string bodies (most of the code) in one go
+                if m is None:
+                    i = n
+                    break
+                i = m.start()
+                if text[i] == "\\":
+                    self._esc = True
+                else:
+                    self._in_str = False
+                    if self._depth == 1:
+                        self._last_key = text[self._str_start + 1:i]
+            elif self._depth == 0:
+                if c == "{":
+                    self._depth = 1
+            elif c == '"':
+                self._in_str, self._str_start = True, i
+            elif c in "{[":
+                self._depth += 1
+                if c == "[" and self._depth == 2 and self._array_depth is None and self._last_key == self.key:
+                    self._array_depth = 2
+                elif c == "{" and self._depth == 3 and self._array_depth == 2:
+                    self._obj_start = i
+            elif c in "}]":
+                self._depth -= 1
+                if c == "}" and self._depth == 2 and self._array_depth == 2 and self._obj_start >= 0:
+                    item = self._decode(text[self._obj_start:i + 1])
+                    if item is not None:
+                        out.append(item)
+                    self._obj_start = -1
+                elif self._depth == 1 and self._array_depth == 2:
+                    self._array_depth = -1  # files[] closed
+                elif self._depth == 0:
+                    self._done = True
+            i += 1
+        # keep only what a later chunk may still need: the open object or key string
+        keep = self._obj_start if self._obj_start >= 0 else self._str_start if self._in_str else i
+        self._buf = text[keep:i]
+        if self._obj_start >= 0:
+            self._obj_start -= keep
+        if self._in_str:
+            self._str_start -= keep
+        self.count += len(out)
+        return out
+
+    def _decode(self, raw: str) -> Optional[Dict[str, Any]]:
+        try:
+            obj = json.loads(raw)
+        except ValueError:
+            return None
+        return obj if isinstance(obj, dict) else None
+
+
+def parse_files(text: str) -> List[Dict[str, Any]]:
+    """files[] of a complete reply: the outermost {...} (or the whole text) as JSON."""
+    start, end = text.find("{"), text.rfind("}")
+    obj = json.loads(text[start:end + 1] if start >= 0 and end > start else text)
+    if not isinstance(obj, dict) or not isinstance(obj.get("files"), list):
+        raise ValueError("no files[]")
+    return obj["files"]
@@ -0,0 +1,472 @@
+import ast, bisect, os, re, threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.content_hash import HashCache, decode_text
+from utils.snapshot_follower import SnapshotFollower
+
+PY_EXTS = {".py", ".pyi"}
+JS_EXTS = {".ts", ".tsx", ".js", ".jsx", ".mjs", ".cjs", ".mts", ".cts"}
+MAX_PARSE_BYTES = 2 * 1024 * 1024
+
+_IDENT = re.compile(r"[A-Za-z_$][\w$]*")
+
+
+def language(rel: str) -> Optional[str]:
+    ext = os.path.splitext(rel)[1].lower()
+    return "python" if ext in PY_EXTS else "js" if ext in JS_EXTS else None
+
+
+# ---------- Python ----------
+def parse_python(text: str) -> Dict[str, Any]:
+    """Top-level defs, class members and module imports with 1-based line spans (decorators included)."""
+    tree = ast.parse(text)
+    defs: List[Dict[str, Any]] = []
+    imports: List[Dict[str, Any]] = []
+
+    def visit(body, parent: Optional[str], in_class: bool):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qual = f"{parent}.{node.name}" if parent else node.name
+                is_class = isinstance(node, ast.ClassDef)
+                defs.append({"name": node.name, "qualname": qual,
+                             "kind": "class" if is_class else "method" if in_class else "function",
+                             "line": min([d.lineno for d in node.decorator_list] + [node.lineno]),
+                             "decl_line": node.lineno, "end_line": node.end_lineno, "parent": parent})
+                if is_class:
+                    visit(node.body, qual, True)
+            elif parent is None and isinstance(node, (ast.Import, ast.ImportFrom)):
+                if isinstance(node, ast.Import):
+                    names = [a.asname or a.name.split(".")[0] for a in node.names]
+                    module = ", ".join(a.name for a in node.names)
+                else:
+                    names = [a.asname or a.name for a in node.names]
+                    module = "." * node.level + (node.module or "")
+                imports.append({"module": module, "names": None if "*" in names else names,
+                                "line": node.lineno, "end_line": node.end_lineno})
+            elif parent is None and isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for t in targets:
+                    if isinstance(t, ast.Name):
+                        defs.append({"name": t.id, "qualname": t.id, "kind": "variable", "line": node.lineno,
+                                     "decl_line": node.lineno, "end_line": node.end_lineno, "parent": None})
+            elif parent is None and isinstance(node, (ast.If, ast.Try, ast.With)):
+                # `try: import x` / `if TYPE_CHECKING:` blocks still define module names
+                for block in ("body", "orelse", "finalbody"):
+                    visit(getattr(node, block, []) or [], None, False)
+                for h in getattr(node, "handlers", []) or []:
+                    visit(h.body, None, False)
+
+    visit(tree.body, None, False)
+    return {"lang": "python", "defs": defs, "imports": imports}
+
+
+# ---------- TS / JS ----------
+def mask_js(text: str) -> str:
+    """
+    Same-length copy of text with comments, string/template contents and regex
+    literals blanked (newlines kept), so braces and keywords can be matched safely.
+    """
+    out = list(text)
+    n, i = len(text), 0
+    tmpl: List[int] = []  # brace depth at each open `${`
+    depth = 0
+    prev = ""  # last significant char, for the regex-literal heuristic
+
+    def blank(a: int, b: int):
+        for k in range(a, min(b, n)):
+            if out[k] != "\n":
+                out[k] = " "
+
+    while i < n:
+        c = text[i]
+        if c == "/" and i + 1 < n and text[i + 1] == "/":
+            j = text.find("\n", i)
+            j = n if j < 0 else j
+            blank(i, j)
+            i = j
+            continue
+        if c == "/" and i + 1 < n and text[i + 1] == "*":
+            j = text.find("*/", i + 2)
+            j = n if j < 0 else j + 2
+            blank(i, j)
+            i = j
+            continue
+        if c in "'\"":
+            j = i + 1
+            while j < n and text[j] != c and text[j] != "\n":
+                j += 2 if text[j] == "\\" else 1
+            blank(i + 1, j)
+            i, prev = j + 1, c
+            continue
+        if c == "`" or (c == "}" and tmpl and tmpl[-1] == depth):
+            if c == "}":
+                tmpl.pop()
+            j = i + 1
+            while j < n and text[j] != "`":
+                if text[j] == "\\":
+                    j += 2
+                    continue
+                if text.startswith("${", j):
+                    break
+                j += 1
+            blank(i + 1, j)
+            if j < n and text.startswith("${", j):
+                tmpl.append(depth)
+                i = j + 2
+            else:
+                i = j + 1
+            prev = "`"
+            continue
+        if c == "/" and (prev == "" or prev in "(,=:[!&|?{};+-*%<>~^"):
+            j, in_cls = i + 1, False
+            while j < n and text[j] != "\n":
+                if text[j] == "\\":
+                    j += 2
+                    continue
+                if text[j] == "[":
+                    in_cls = True
+                elif text[j] == "]":
+                    in_cls = False
+                elif text[j] == "/" and not in_cls:
+                    break
+                j += 1
+            if j < n and text[j] == "/":
+                blank(i + 1, j)
+                i, prev = j + 1, "/"
+                continue
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+        if not c.isspace():
+            prev = c
+        i += 1
+    return "".join(out)
+
+
+_JS_DECL = re.compile(
+    r"^[ \t]*(?:export[ \t]+(?:default[ \t]+)?)?(?:declare[ \t]+)?(?:abstract[ \t]+)?(?:async[ \t]+)?"
+    r"(function\*?|class|interface|type|enum|const|let|var|namespace)[ \t]+([A-Za-z_$][\w$]*)", re.M)
+_JS_MEMBER = re.compile(
+    r"^[ \t]*(?:(?:public|private|protected|static|readonly|async|override|abstract|get|set|declare)[ \t]+)*\*?"
+    r"(#?[A-Za-z_$][\w$]*)[ \t]*\??[ \t]*(?:<[^>\n]*>[ \t]*)?(\(|=)", re.M)
+_JS_IMPORT = re.compile(r"^[ \t]*import\b", re.M)
+_JS_REQUIRE = re.compile(r"^[ \t]*(?:const|let|var)[ \t]+([^=]+?)[ \t]*=[ \t]*require[ \t]*\(", re.M)
+_JS_NOT_MEMBER = {"if", "for", "while", "switch", "catch", "return", "else", "do", "new", "typeof", "await",
+                  "yield", "super", "this", "function", "throw", "case", "delete", "void"}
+_CONT_NEXT = set(".,)]}?:+-*/%&|=<>{")
+_CONT_PREV = set("=,(+-*/%&|.?:<>[{!~^")
+_NON_SPACE = re.compile(r"\S")
+
+
+def _stmt_end(m: str, pos: int) -> int:
+    """Offset of the last char of the statement/declaration starting at pos (masked text)."""
+    depth, n, i, last = 0, len(m), pos, ""
+    while i < n:
+        c = m[i]
+        if c in "({[":
+            depth += 1
+        elif c in ")}]":
+            depth -= 1
+            if depth < 0:
+                return i - 1
+        elif depth == 0:
+            if c == ";":
+                return i
+            if c == "\n" and last and last not in _CONT_PREV:
+                nxt = _NON_SPACE.search(m, i)
+                if nxt is None or nxt.group(0) not in _CONT_NEXT:
+                    return i - 1
+        if not c.isspace():
+            last = c
+        i += 1
+    return n - 1
+
+
+def _js_import_names(clause: str) -> List[str]:
+    clause = re.sub(r"\btype\b", " ", clause)
+    names: List[str] = []
+    braces = re.search(r"\{([^}]*)\}", clause)
+    if braces:
+        for part in braces.group(1).split(","):
+            bits = part.split()
+            if bits:
+                names.append(bits[-1])
+        clause = clause[:braces.start()] + clause[braces.end():]
+    star = re.search(r"\*\s*as\s+([A-Za-z_$][\w$]*)", clause)
+    if star:
+        names.append(star.group(1))
+        clause = clause[:star.start()] + clause[star.end():]
+    names.extend(_IDENT.findall(clause))
+    return names
+
+
+def parse_js(text: str) -> Dict[str, Any]:
+    m = mask_js(text)
+    starts = [0] + [nl.end() for nl in re.finditer("\n", m)]
+    line_of = lambda off: bisect.bisect_right(starts, off)  # noqa: E731  (1-based)
+    # brace depth at the start of every line
+    depth_at: List[int] = []
+    d, k = 0, 0
+    for ln_start in starts:
+        while k < ln_start:
+            if m[k] == "{":
+                d += 1
+            elif m[k] == "}":
+                d -= 1
+            k += 1
+        depth_at.append(d)
+    depth = lambda off: depth_at[line_of(off) - 1]  # noqa: E731
+
+    defs: List[Dict[str, Any]] = []
+    imports: List[Dict[str, Any]] = []
+    for mt in _JS_IMPORT.finditer(m):
+        if depth(mt.start()) != 0:
+            continue
+        end = _stmt_end(m, mt.end())
+        src = text[mt.start():end + 1]
+        mod = re.search(r"""['"]([^'"]+)['"]\s*;?\s*$""", src)
+        clause = m[mt.end():end + 1]
+        clause = clause[:clause.rfind("from")] if "from" in clause else ""
+        imports.append({"module": mod.group(1) if mod else "", "names": _js_import_names(clause),
+                        "line": line_of(mt.start()), "end_line": line_of(end)})
+    required: Set[int] = set()
+    for mt in _JS_REQUIRE.finditer(m):
+        if depth(mt.start()) != 0:
+            continue
+        end = _stmt_end(m, mt.start())
+        mod = re.search(r"""require\s*\(\s*['"]([^'"]+)['"]""", text[mt.start():end + 1])
+        imports.append({"module": mod.group(1) if mod else "", "names": _IDENT.findall(mt.group(1)),
+                        "line": line_of(mt.start()), "end_line": line_of(end)})
+        required.add(mt.start())
+    for mt in _JS_DECL.finditer(m):
+        if depth(mt.start()) != 0 or mt.start() in required:
+            continue
+        kw, name = mt.group(1), mt.group(2)
+        end = _stmt_end(m, mt.end())
+        kind = {"class": "class", "interface": "interface", "type": "type", "enum": "enum",
+                "namespace": "namespace"}.get(kw.rstrip("*"), "function" if kw.startswith("function") else "variable")
+        if kind == "variable":
+            first = m[mt.end():m.find("\n", mt.end()) if "\n" in m[mt.end():] else len(m)]
+            if "=>" in first or re.search(r"=\s*(async\s+)?function\b", first):
+                kind = "function"
+        line, end_line = line_of(mt.start()), line_of(end)
+        defs.append({"name": name, "qualname": name, "kind": kind, "line": _lead_in(text, line),
+                     "decl_line": line, "end_line": end_line, "parent": None})
+        if kind == "class":
+            body_depth = depth_at[line - 1] + 1
+            for mm in _JS_MEMBER.finditer(m, starts[line] if line < len(starts) else len(m), end + 1):
+                mline = line_of(mm.start())
+                member = mm.group(1)
+                if depth_at[mline - 1] != body_depth or member in _JS_NOT_MEMBER:
+                    continue
+                mend = _stmt_end(m, mm.start(2))
+                if mm.group(2) == "=":
+                    head = m[mm.end():m.find("\n", mm.end())]
+                    if "=>" not in head and not re.search(r"^\s*(async\s+)?function\b", head):
+                        continue
+                defs.append({"name": member, "qualname": f"{name}.{member}", "kind": "method",
+                             "line": _lead_in(text, mline), "decl_line": mline, "end_line": line_of(mend),
+                             "parent": name})
+    defs.sort(key=lambda x: x["line"])
+    return {"lang": "js", "defs": defs, "imports": imports}
+
+
+def _lead_in(text: str, line: int) -> int:
+    """Extend a declaration upwards over decorators and a directly preceding doc comment."""
+    lines = text.split("\n", line)[:line]
+    i = line - 1
+    while i > 0:
+        s = lines[i - 1].strip()
+        if s.startswith(("@", "/**", "*", "//")) or s.endswith("*/"):
+            i -= 1
+        else:
+            break
+    return i + 1
+
+
+def parse_source(rel: str, text: str) -> Optional[Dict[str, Any]]:
+    lang = language(rel)
+    try:
+        if lang == "python":
+            return parse_python(text)
+        if lang == "js":
+            return parse_js(text)
+    except (SyntaxError, ValueError, RecursionError) as e:
+        return {"lang": lang, "defs": [], "imports": [], "error": str(e)}
+    return None
+
+
+class SymbolIndex(SnapshotFollower):
+    """
+    Definitions, imports and line spans for the Python and TS/JS files of a snapshot.
+
+    Parse results are cached by content hash (HashCache), so unchanged files are
+    never re-parsed across rebuilds and identical files share one entry. The
+    name table maps both short names and qualified names (Class.method) to files.
+    Files not indexed yet are parsed on demand by symbols()/slice().
+    """
+
+    name = "symbol-index"
+
+    def __init__(self, repo_root: str, hash_cache: HashCache, logger: Optional[Callable[[str], None]] = None):
+        super().__init__(logger)
+        self.repo_root = repo_root
+        self.hashes = hash_cache
+        self._lock = threading.Lock()
+        self._by_hash: Dict[str, Dict[str, Any]] = {}
+        self._files: Dict[str, str] = {}          # rel -> content hash
+        self._names: Dict[str, Set[str]] = {}     # name / qualname -> rels
+        self.parses = 0
+
+    # ---------- maintenance ----------
+    def rebuild(self, paths: List[str]) -> Optional[bool]:
+        with self._lock:
+            for rel in list(self._files):
+                self._drop(rel)
+        for i, rel in enumerate(paths):
+            if i % 256 == 0 and self.superseded():
+                return False
+            if language(rel):
+                self._load(rel)
+        with self._lock:
+            live = set(self._files.values())
+            self._by_hash = {h: v for h, v in self._by_hash.items() if h in live}
+        self.logger(f"symbol index: {len(self._files)} files, {len(self._names)} names ({self.parses} parsed)")
+        return True
+
+    def update(self, paths: Iterable[str], removed: Iterable[str] = ()) -> None:
+        with self._lock:
+            for rel in removed:
+                self._drop(rel)
+        for rel in paths:
+            if language(rel):
+                self._load(rel)
+
+    def _drop(self, rel: str) -> None:
+        digest = self._files.pop(rel, None)
+        syms = self._by_hash.get(digest) if digest else None
+        for d in (syms or {}).get("defs", []):
+            for key in (d["name"], d["qualname"]):
+                rels = self._names.get(key)
+                if rels is not None:
+                    rels.discard(rel)
+                    if not rels:
+                        del self._names[key]
+
+    def _load(self, rel: str) -> Tuple[Optional[Dict[str, Any]], Optional[bytes]]:
+        """(symbols, bytes read or None when served from the hash cache) for rel, registering it."""
+        abs_path = os.path.join(self.repo_root, rel)
+        data: Optional[bytes] = None
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            with self._lock:
+                self._drop(rel)
+            return None, None
+        if st.st_size > MAX_PARSE_BYTES:
+            return None, None
+        digest = self.hashes.cached(rel, st)
+        syms = self._by_hash.get(digest) if digest else None
+        if syms is None:
+            data, digest = self.hashes.read(abs_path, rel)
+            if data is None or digest is None:
+                return None, None
+            syms = self._by_hash.get(digest)
+            if syms is None:
+                syms = parse_source(rel, decode_text(data))
+                self.parses += 1
+                if syms is None:
+                    return None, data
+        with self._lock:
+            if self._files.get(rel) != digest:
+                self._drop(rel)
+                self._by_hash[digest] = syms  # type: ignore[index]
+                self._files[rel] = digest  # type: ignore[assignment]
+                for d in syms["defs"]:
+                    self._names.setdefault(d["name"], set()).add(rel)
+                    self._names.setdefault(d["qualname"], set()).add(rel)
+        return syms, data
+
+    # ---------- queries ----------
+    def symbols(self, rel: str) -> Optional[Dict[str, Any]]:
+        """Outline of one file (parsed now if it changed or was never indexed)."""
+        return self._load(rel)[0] if language(rel) else None
+
+    def lookup(self, name: str, kind: Optional[str] = None, prefix: bool = False,
+               limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            if prefix:
+                keys = [k for k in self._names if k.startswith(name)]
+            else:
+                keys = [name] if name in self._names else []
+            rels = sorted({r for k in keys for r in self._names[k]})
+            out: List[Dict[str, Any]] = []
+            for rel in rels:
+                for d in self._by_hash[self._files[rel]]["defs"]:
+                    hit = d["name"].startswith(name) or d["qualname"].startswith(name) if prefix \
+                        else name in (d["name"], d["qualname"])
+                    if hit and (kind is None or d["kind"] == kind):
+                        out.append({"path": rel, **d})
+                        if len(out) >= limit:
+                            return out
+            return out
+
+    def slice(self, rel: str, symbol: Optional[str] = None, line: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        The definition (by qualified/short name, or the innermost one containing
+        `line`) plus only the imports and short module constants it references,
+        and for methods the class header. None if rel has no such symbol.
+        """
+        syms, data = self._load(rel)
+        if syms is None:
+            return None
+        if data is None:
+            try:
+                with open(os.path.join(self.repo_root, rel), "rb") as fh:
+                    data = fh.read()
+            except OSError:
+                return None
+        defs = syms["defs"]
+        if symbol is not None:
+            found = [d for d in defs if d["qualname"] == symbol] or [d for d in defs if d["name"] == symbol]
+        else:
+            found = sorted((d for d in defs if line is not None and d["line"] <= line <= d["end_line"]),
+                           key=lambda d: d["end_line"] - d["line"])
+        if not found:
+            return None
+        d = found[0]
+        lines = decode_text(data).split("\n")
+        body = lines[d["line"] - 1:d["end_line"]]
+        idents = set(_IDENT.findall("\n".join(body)))
+        used = [imp for imp in syms["imports"] if imp["names"] is None or idents & set(imp["names"])]
+        parts: List[str] = []
+        for imp in used:
+            parts.extend(lines[imp["line"] - 1:imp["end_line"]])
+        if parts:
+            parts.append("")
+        # module-level constants the definition reads (short ones only)
+        for v in defs:
+            if v["kind"] == "variable" and v is not d and v["name"] in idents and v["end_line"] - v["line"] < 10:
+                parts.extend(lines[v["line"] - 1:v["end_line"]])
+        if parts and parts[-1] != "":
+            parts.append("")
+        parent = next((p for p in defs if p["qualname"] == d["parent"]), None) if d["parent"] else None
+        elided = "..." if syms["lang"] == "python" else "// ..."
+        if parent is not None:
+            parts.extend(lines[parent["line"] - 1:parent["decl_line"]])
+            indent = re.match(r"\s*", body[0] if body else "").group(0)  # type: ignore[union-attr]
+            if d["line"] > parent["decl_line"] + 1:
+                parts.append(indent + elided)
+        parts.extend(body)
+        if parent is not None and syms["lang"] == "js":
+            parts.append(re.match(r"\s*", lines[parent["decl_line"] - 1]).group(0) + "}")  # type: ignore[union-attr]
+        content = "\n".join(parts)
+        return {"path": rel, "symbol": d["qualname"], "kind": d["kind"], "lang": syms["lang"],
+                "start_line": d["line"], "end_line": d["end_line"], "content": content,
+                "imports": [imp["module"] for imp in used], "bytes": len(content.encode("utf-8")),
+                "file_bytes": len(data)}
+
+    def status(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "files": len(self._files), "names": len(self._names),
+                "parsed": self.parses, "pending": self.pending, **self.stats}
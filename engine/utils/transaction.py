@@ -0,0 +1,246 @@
+import json, os, shutil, stat, threading, time, uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.content_hash import hash_bytes
+
+JOURNAL_SUFFIX = ".journal.json"
+TEMP_MARK = ".devpilot-tmp"
+# one transaction commits at a time per process; recover() takes it too, so a
+# journal it finds can't belong to a commit still in flight here
+_COMMIT_LOCK = threading.Lock()
+
+
+class TransactionError(Exception):
+    """A commit failed and every staged file was rolled back (path is the file it failed on, if any)."""
+
+    def __init__(self, message: str, path: Optional[str] = None):
+        super().__init__(message)
+        self.path = path
+
+
+def _fsync_dir(path: str) -> None:
+    if os.name == "nt":
+        return  # directories can't be opened for fsync there; NTFS journals renames itself
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ApplyTransaction:
+    """
+    All-or-nothing write of a batch of files under root.
+
+    stage() queues new contents (stage_delete() a removal) and drops files already identical on disk, so
+    unchanged files keep their mtime and watchers stay quiet. commit() writes each
+    file to a temp beside its target, records a journal (with hardlinks to the
+    originals) in journal_dir, os.replace()s everything into place and fsyncs each
+    touched directory once. If anything fails before the journal is removed, all
+    files are put back; recover() does the same for a journal left by a crash.
+    """
+
+    def __init__(self, root: str, journal_dir: str, fsync: bool = True):
+        self.root, self.journal_dir, self.fsync = root, journal_dir, fsync
+        self.id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.unchanged: List[str] = []
+        self._staged: Dict[str, Dict[str, Any]] = {}
+        self.timings: Dict[str, float] = {}
+
+    def stage(self, rel: str, data: bytes, current_hash: Optional[str] = None, data_hash: Optional[str] = None) -> bool:
+        """
+        Queue rel := data. False (and listed in .unchanged) when the file already holds exactly data.
+        current_hash / data_hash: hash_bytes of the file on disk / of data, when the caller has them.
+        """
+        dst = os.path.join(self.root, rel)
+        if os.path.islink(dst):
+            dst = os.path.realpath(dst)  # like write_text: write through the link, keep the link
+        try:
+            st: Optional[os.stat_result] = os.stat(dst)
+        except FileNotFoundError:
+            st = None
+        if st is not None:
+            if not stat.S_ISREG(st.st_mode):
+                raise TransactionError(f"not a regular file: {rel}", rel)
+            if current_hash is not None:
+                data_hash = data_hash or hash_bytes(data)
+                same = current_hash == data_hash
+            elif st.st_size == len(data):
+                with open(dst, "rb") as fh:
+                    same = fh.read() == data
+            else:
+                same = False
+            if same:
+                self.unchanged.append(rel)
+                self._staged.pop(rel, None)
+                return False
+        self._staged[rel] = {"path": rel, "dst": dst, "data": data, "hash": data_hash, "existed": st is not None,
+                             "old_hash": current_hash, "mode": stat.S_IMODE(st.st_mode) if st is not None else None}
+        return True
+
+    def stage_delete(self, rel: str) -> bool:
+        """Queue removal of rel; False (and listed in .unchanged) when there is no such file."""
+        dst = os.path.join(self.root, rel)
+        if not os.path.lexists(dst):
+            self.unchanged.append(rel)
+            self._staged.pop(rel, None)
+            return False
+        if not os.path.islink(dst) and not os.path.isfile(dst):
+            raise TransactionError(f"not a regular file: {rel}", rel)
+        self._staged[rel] = {"path": rel, "dst": dst, "data": None, "hash": None, "existed": True, "old_hash": None, "mode": None}
+        return True
+
+    @property
+    def staged(self) -> List[str]:
+        return list(self._staged)
+
+    def commit(self, before_replace: Optional[Callable[[str, str, Optional[str]], None]] = None) -> List[str]:
+        """
+        Apply everything staged; returns the paths written or deleted. Raises TransactionError after a rollback.
+        before_replace(rel, original, hash) is called for each existing file once its original is preserved
+        (original is a path to it, hash the current_hash given to stage()); raising from it rolls back.
+        """
+        items = list(self._staged.values())
+        if not items:
+            return []
+        with _COMMIT_LOCK:
+            journal = {"id": self.id, "root": self.root, "started": time.time(), "dirs": [], "entries": []}
+            jpath = os.path.join(self.journal_dir, self.id + JOURNAL_SUFFIX)
+            t0 = time.perf_counter()
+            at: Optional[str] = None  # the file being worked on, for the error
+            try:
+                os.makedirs(self.journal_dir, exist_ok=True)
+                for i, it in enumerate(items):
+                    d, name = os.path.split(it["dst"])
+                    it["tmp"] = os.path.join(d, f".{name}.{self.id}{TEMP_MARK}") if it["data"] is not None else None
+                    it["saved"] = os.path.join(self.journal_dir, f"{self.id}.{i}") if it["existed"] else None
+                    journal["entries"].append({"path": it["path"], "dst": it["dst"], "tmp": it["tmp"], "saved": it["saved"],
+                                               "existed": it["existed"],  # new files: hash tells ours from a later write
+                                               "hash": None if it["existed"] else it["hash"] or hash_bytes(it["data"])})
+                    if it["data"] is not None:
+                        journal["dirs"].extend(self._missing_dirs(d, journal["dirs"]))
+                self._write_journal(jpath, journal)
+                self.timings["journal"] = time.perf_counter() - t0
+                for d in journal["dirs"]:
+                    os.makedirs(d, exist_ok=True)
+                writes = [it for it in items if it["data"] is not None]
+                for it in writes:
+                    at = it["path"]
+                    with open(it["tmp"], "wb") as fh:
+                        fh.write(it["data"])
+                    if it["mode"] is not None:
+                        os.chmod(it["tmp"], it["mode"])
+                if self.fsync:  # second pass: the kernel has been writing back while we created the rest
+                    for it in writes:
+                        at = it["path"]
+                        fd = os.open(it["tmp"], os.O_RDONLY)
+                        try:
+                            os.fsync(fd)
+                        finally:
+                            os.close(fd)
+                self.timings["write"] = time.perf_counter() - t0
+                for it in items:
+                    at = it["path"]
+                    if it["saved"]:
+                        _preserve(it["dst"], it["saved"])
+                        if before_replace:
+                            before_replace(it["path"], it["saved"], it["old_hash"])
+                for it in items:
+                    at = it["path"]
+                    if it["tmp"] is None:
+                        os.unlink(it["dst"])
+                    else:
+                        os.replace(it["tmp"], it["dst"])
+                at = None
+                if self.fsync:
+                    for d in sorted({os.path.dirname(it["dst"]) for it in items}):
+                        _fsync_dir(d)
+                self.timings["replace"] = time.perf_counter() - t0
+            except BaseException as e:
+                _roll_back(journal)
+                _remove(jpath)
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    raise
+                raise TransactionError(f"apply rolled back{f' at {at}' if at else ''}: {e}", at) from e
+            _remove(jpath)  # committed
+            for it in items:
+                if it["saved"]:
+                    _remove(it["saved"])
+        return [it["path"] for it in items]
+
+    def _missing_dirs(self, d: str, planned: List[str]) -> List[str]:
+        out: List[str] = []
+        while not os.path.isdir(d) and d not in planned and d not in out:
+            out.append(d)
+            d = os.path.dirname(d)
+        return out[::-1]
+
+    def _write_journal(self, jpath: str, journal: Dict[str, Any]) -> None:
+        part = jpath + ".part"
+        with open(part, "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(journal))
+            if self.fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(part, jpath)  # a journal is either complete or absent
+        if self.fsync:
+            _fsync_dir(self.journal_dir)
+
+
+def _preserve(src: str, saved: str) -> None:
+    """Keep the original reachable for rollback: a hardlink (no copy) where the filesystem allows."""
+    try:
+        os.link(src, saved)
+    except OSError:
+        shutil.copy2(src, saved)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _roll_back(journal: Dict[str, Any]) -> None:
+    for e in reversed(journal["entries"]):
+        if e["tmp"]:
+            _remove(e["tmp"])
+        saved = e.get("saved")
+        if saved and os.path.exists(saved):
+            if os.path.exists(e["dst"]) and os.path.samefile(saved, e["dst"]):
+                _remove(saved)  # never replaced
+            else:
+                os.replace(saved, e["dst"])
+        elif not e["existed"] and os.path.exists(e["dst"]):
+            with open(e["dst"], "rb") as fh:
+                if hash_bytes(fh.read()) == e["hash"]:  # ours, not something written since
+                    _remove(e["dst"])
+    for d in reversed(journal["dirs"]):
+        try:
+            os.rmdir(d)
+        except OSError:
+            pass
+
+
+def recover(journal_dir: str, logger: Optional[Callable[[str], None]] = None) -> List[str]:
+    """Roll back transactions a crash left half-applied; returns their ids."""
+    done: List[str] = []
+    with _COMMIT_LOCK:  # listed under the lock: a commit finishing meanwhile has removed its journal
+        try:
+            names = [n for n in os.listdir(journal_dir) if n.endswith(JOURNAL_SUFFIX)]
+        except OSError:
+            return []
+        for name in sorted(names):
+            jpath = os.path.join(journal_dir, name)
+            try:
+                with open(jpath, encoding="utf-8") as fh:
+                    journal = json.load(fh)
+                _roll_back(journal)
+            except (OSError, ValueError) as e:
+                if logger: logger(f"journal {name}: recovery failed ({e}); left in place")
+                continue
+            _remove(jpath)
+            done.append(journal.get("id") or name)
+            if logger: logger(f"rolled back interrupted apply {done[-1]} ({len(journal.get('entries', []))} files)")
+    return done
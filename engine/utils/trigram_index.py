@@ -0,0 +1,312 @@
+import fnmatch, os, threading, time
+from array import array
+from re import Pattern
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+try:  # Python 3.11+
+    from re import _parser as _sre_parse  # type: ignore[attr-defined]
+except ImportError:  # pragma: no cover
+    import sre_parse as _sre_parse  # type: ignore[no-redef]
+
+from utils.content_hash import decode_text
+from utils.file_reader import SNIFF_BYTES, looks_binary
+from utils.snapshot_follower import SnapshotFollower
+
+MAX_INDEX_BYTES = 1024 * 1024  # larger files are searched by brute force, not indexed
+_COMPACT_MIN = 1024
+
+
+def trigrams(data: bytes) -> Set[bytes]:
+    """Distinct 3-byte sequences of the ASCII-lowercased data."""
+    data = data.lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+
+def _lit_trigrams(text: str) -> List[bytes]:
+    # the index lowercases ASCII only; trigrams touching non-ASCII bytes could differ in case
+    return [t for t in trigrams(text.encode("utf-8")) if max(t) < 0x80]
+
+
+# ---------- query planning ----------
+# A plan is None (matches anything), ("lit", text), ("and", [plans]) or ("or", [plans]).
+
+def _plan_regex(items) -> Any:
+    parts, run = [], []
+
+    def flush():
+        if len(run) >= 3:
+            parts.append(("lit", "".join(run)))
+        run.clear()
+
+    for op, av in items:
+        name = str(op)
+        if name == "LITERAL":
+            run.append(chr(av))
+            continue
+        flush()
+        if name == "SUBPATTERN":
+            parts.append(_plan_regex(av[-1]))
+        elif name == "ATOMIC_GROUP":
+            parts.append(_plan_regex(av))
+        elif name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and av[0] >= 1:
+            parts.append(_plan_regex(av[2]))
+        elif name == "BRANCH":
+            alts = [_plan_regex(b) for b in av[1]]
+            if all(a is not None for a in alts):
+                parts.append(("or", alts))
+    flush()
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else ("and", parts)
+
+
+def plan_query(pattern: str, regex: bool) -> Any:
+    if not regex:
+        return ("lit", pattern) if len(pattern) >= 3 else None
+    try:
+        return _plan_regex(_sre_parse.parse(pattern))
+    except Exception:
+        return None  # let re.compile report the error; scan everything otherwise
+
+
+class TrigramIndex(SnapshotFollower):
+    """
+    Inverted trigram index over the text files of a snapshot, for /repo/search.
+
+    Postings are append-only arrays of doc ids; a changed or removed file gets a
+    fresh id and its old one is tombstoned (compacted once tombstones pile up).
+    Trigrams come from the same decoded, newline-normalized text the search runs
+    over. The index only narrows the candidate files and every hit is confirmed
+    against the file, but a file edited without a snapshot delta (watch mode off,
+    directory mtime unchanged) would be pruned by its old postings: candidates()
+    therefore re-stats every file it has read and re-indexes the ones whose
+    (size, mtime_ns) moved before trusting the postings. Binary files are
+    skipped; files over max_bytes are not indexed but still scanned for every query.
+    """
+
+    name = "search-index"
+
+    def __init__(self, repo_root: str, max_bytes: int = MAX_INDEX_BYTES,
+                 logger: Optional[Callable[[str], None]] = None):
+        super().__init__(logger)
+        self.repo_root = repo_root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._postings: Dict[bytes, array] = {}
+        self._paths: List[Optional[str]] = []   # doc id -> path (None once tombstoned)
+        self._ids: Dict[str, int] = {}          # path -> live doc id
+        self._dead: Set[int] = set()
+        self._unindexed: Set[str] = set()       # text files over max_bytes
+        self._keys: Dict[str, Tuple[int, int]] = {}  # path -> (size, mtime_ns) when last read
+
+    def rebuild(self, paths: List[str]) -> Optional[bool]:
+        with self._lock:
+            self._postings, self._paths, self._ids, self._dead, self._unindexed = {}, [], {}, set(), set()
+            self._keys = {}
+        for i, rel in enumerate(paths):
+            if i % 256 == 0 and self.superseded():
+                return False
+            self._add(rel)
+        self.logger(f"search index: {len(self._ids)} files, {len(self._postings)} trigrams")
+        return True
+
+    # ---------- maintenance ----------
+    def update(self, paths: Iterable[str], removed: Iterable[str] = ()) -> None:
+        for rel in removed:
+            with self._lock:
+                self._drop(rel)
+        for rel in paths:
+            self._add(rel)
+        if len(self._dead) > max(_COMPACT_MIN, len(self._ids) // 4):
+            self._compact()
+
+    def _drop(self, rel: str) -> None:
+        doc = self._ids.pop(rel, None)
+        if doc is not None:
+            self._paths[doc] = None
+            self._dead.add(doc)
+        self._unindexed.discard(rel)
+        self._keys.pop(rel, None)
+
+    def _add(self, rel: str) -> None:
+        data, oversized, key = self._read(rel)
+        tris = trigrams(decode_text(data).encode("utf-8")) if data is not None else ()
+        with self._lock:
+            self._drop(rel)
+            if key is not None:
+                self._keys[rel] = key
+            if oversized:
+                self._unindexed.add(rel)
+                return
+            if data is None:
+                return
+            doc = len(self._paths)
+            self._paths.append(rel)
+            self._ids[rel] = doc
+            postings = self._postings
+            for t in tris:
+                arr = postings.get(t)
+                if arr is None:
+                    arr = postings[t] = array("I")
+                arr.append(doc)
+
+    def _read(self, rel: str) -> Tuple[Optional[bytes], bool, Optional[Tuple[int, int]]]:
+        """
+        (bytes, oversized, (size, mtime_ns)): bytes is None for binary/unreadable files and text
+        files over max_bytes; the key is None only when the file could not be opened.
+        """
+        try:
+            with open(os.path.join(self.repo_root, rel), "rb") as fh:
+                st = os.fstat(fh.fileno())
+                key = (st.st_size, st.st_mtime_ns)
+                head = fh.read(SNIFF_BYTES)
+                if looks_binary(head):
+                    return None, False, key
+                if st.st_size > self.max_bytes:
+                    return None, True, key
+                return head + fh.read(), False, key
+        except OSError:
+            return None, False, None
+
+    def refresh_stale(self) -> List[str]:
+        """Re-index files whose (size, mtime_ns) changed since they were read; returns them."""
+        with self._lock:
+            known = list(self._keys.items())
+        stale = []
+        for rel, key in known:
+            try:
+                st = os.stat(os.path.join(self.repo_root, rel))
+                if (st.st_size, st.st_mtime_ns) == key:
+                    continue
+            except OSError:
+                pass  # gone: _add drops it
+            stale.append(rel)
+        if stale:
+            self.update(stale)
+        return stale
+
+    def _compact(self) -> None:
+        with self._lock:
+            dead = self._dead
+            for t in list(self._postings):
+                arr = array("I", (d for d in self._postings[t] if d not in dead))
+                if arr:
+                    self._postings[t] = arr
+                else:
+                    del self._postings[t]
+            self._dead = set()
+        self.logger(f"search index: compacted {len(dead)} stale docs")
+
+    # ---------- queries ----------
+    def _eval(self, plan) -> Optional[Set[int]]:
+        if plan is None:
+            return None
+        kind, arg = plan
+        if kind == "lit":
+            tris = _lit_trigrams(arg)
+            if not tris:
+                return None
+            lists = sorted((self._postings.get(t, ()) for t in tris), key=len)
+            cand = set(lists[0])
+            for arr in lists[1:]:
+                if not cand:
+                    break
+                cand.intersection_update(arr)
+            return cand
+        subs = [self._eval(p) for p in arg]
+        if kind == "and":
+            known = [s for s in subs if s is not None]
+            if not known:
+                return None
+            known.sort(key=len)
+            out = set(known[0])
+            for s in known[1:]:
+                out &= s
+            return out
+        if any(s is None for s in subs):
+            return None
+        return set().union(*subs)  # type: ignore[arg-type]
+
+    def candidates(self, pattern: str, regex: bool) -> Tuple[Optional[List[str]], List[str]]:
+        """(indexed files that may match, files that must always be scanned)."""
+        plan = plan_query(pattern, regex)
+        self.refresh_stale()
+        with self._lock:
+            docs = self._eval(plan)
+            if docs is None:
+                paths = [p for p in self._paths if p is not None]
+            else:
+                paths = [self._paths[d] for d in docs if self._paths[d] is not None]  # type: ignore[misc]
+            return sorted(paths), sorted(self._unindexed)  # type: ignore[arg-type]
+
+    def status(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "files": len(self._ids), "unindexed": len(self._unindexed),
+                "trigrams": len(self._postings), "stale": len(self._dead), "pending": self.pending, **self.stats}
+
+
+def search_files(repo_root: str, paths: Iterable[str], rx: Pattern[str], context: int = 2, limit: int = 100,
+                 max_per_file: int = 20, deadline: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Run rx over each file and return hits as {path, line, column, text, before, after}
+    (1-based line/column). Stops at `limit` hits or at `deadline` (time.perf_counter()).
+    """
+    hits: List[Dict[str, Any]] = []
+    scanned, truncated = 0, False
+    for rel in paths:
+        if len(hits) >= limit or (deadline is not None and time.perf_counter() > deadline):
+            truncated = True
+            break
+        try:
+            with open(os.path.join(repo_root, rel), "rb") as fh:
+                data = fh.read()
+        except OSError:
+            continue
+        scanned += 1
+        if looks_binary(data[:SNIFF_BYTES]):
+            continue
+        text = decode_text(data)
+        n, line, pos, last_line = 0, 1, 0, 0
+        for m in rx.finditer(text):
+            line += text.count("\n", pos, m.start())
+            pos = m.start()
+            if line == last_line:
+                continue  # one hit per line
+            last_line = line
+            start = text.rfind("\n", 0, pos) + 1
+            end = text.find("\n", pos)
+            end = len(text) if end < 0 else end
+            hits.append({"path": rel, "line": line, "column": pos - start + 1, "text": text[start:end],
+                         "before": _lines_before(text, start, context), "after": _lines_after(text, end, context)})
+            n += 1
+            if n >= max_per_file or len(hits) >= limit:
+                truncated = truncated or len(hits) >= limit
+                break
+    return hits, {"scanned": scanned, "truncated": truncated}
+
+
+def _lines_before(text: str, start: int, n: int) -> List[str]:
+    out: List[str] = []
+    while n > 0 and start > 0:
+        prev = text.rfind("\n", 0, start - 1) + 1
+        out.append(text[prev:start - 1])
+        start, n = prev, n - 1
+    return out[::-1]
+
+
+def _lines_after(text: str, end: int, n: int) -> List[str]:
+    out: List[str] = []
+    while n > 0 and end < len(text):
+        nxt = text.find("\n", end + 1)
+        nxt = len(text) if nxt < 0 else nxt
+        out.append(text[end + 1:nxt])
+        end, n = nxt, n - 1
+    return out
+
+
+def path_filter(paths: Iterable[str], prefix: str = "", glob: Optional[str] = None) -> List[str]:
+    prefix = prefix.strip("/")
+    out = [p for p in paths if not prefix or p == prefix or p.startswith(prefix + "/")]
+    if glob:
+        out = [p for p in out if fnmatch.fnmatchcase(p, glob) or fnmatch.fnmatchcase(p.rpartition("/")[2], glob)]
+    return out